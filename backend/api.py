@@ -2,69 +2,268 @@
 Flask API Server for Melanoma Detection
 Provides endpoints for image analysis using the trained model and computer vision
 """
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, send_file
 from flask_cors import CORS
-from PIL import Image
-import base64
+import contextvars
+import hmac
+import json
+import logging
+import re
+import time
+import uuid
 from io import BytesIO
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import traceback
 
 from config import Config
 from model_loader import ModelLoader
-# from image_processor import ImageProcessor  # Commented out for now
+from model_registry import ModelRegistry
+from result_cache import ResultCache
+from heatmap_jobs import HeatmapJobs
+from image_io import (
+    ImageInputError, decode_base64_image, read_image_stream, read_request_image_bytes, open_image_bytes
+)
+from image_processor import ImageProcessor
+from image_encoding import IMAGE_DELIVERY_MODES, from_data_url, encode_heatmap_grid
+from profiling import RequestProfiler
+from tta import TTA_VIEW_NAMES
+from metrics import (
+    registry, stage, start_request_timings, current_request_timings, end_request_timings,
+    REQUESTS, REQUEST_SECONDS, ANALYSIS_ERRORS, GRADCAM_FAILURES, CACHE_LOOKUPS
+)
+
+logging.basicConfig(
+    level=Config.LOG_LEVEL,
+    format='%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
 
+# Reject oversized bodies before they are read (413 Request Entity Too Large)
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_REQUEST_SIZE
+
 # Configure CORS - Allow all origins temporarily
 CORS(app, resources={
     r"/api/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "ngrok-skip-browser-warning"]
+        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "ngrok-skip-browser-warning"],
+        "expose_headers": ["Server-Timing"]
     }
 })
 
 # Initialize model (singleton pattern)
+# With BACKGROUND_MODEL_LOAD the model loads in a thread and requests get 503 until ready
 try:
     model_loader = ModelLoader()
-except Exception as e:
-    print(f"Error initializing model: {str(e)}")
+except Exception:
+    logger.exception("Error initializing model")
     raise
 
+# Versioned models served side by side: the model above is the initial default.
+# /api/analyze is routed through the registry; the other endpoints use the default.
+model_registry = ModelRegistry(
+    model_loader, Config.MODEL_NAME,
+    state_file=Config.MODEL_REGISTRY_FILE,
+    poll_seconds=Config.MODEL_REGISTRY_POLL_SECONDS
+)
+if not Config.DEFER_MODEL_LOAD:
+    model_registry.start()
+
+# Result cache for repeated analyses (None when disabled)
+result_cache = ResultCache(
+    max_entries=Config.RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=Config.RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=Config.RESULT_CACHE_TTL_SECONDS,
+    disk_dir=Config.RESULT_CACHE_DIR,
+    max_disk_bytes=Config.RESULT_CACHE_MAX_DISK_BYTES
+) if Config.RESULT_CACHE_ENABLED else None
+
+# Background Grad-CAM rendering for HEATMAP_MODE='async'
+heatmap_jobs = HeatmapJobs(
+    max_workers=Config.HEATMAP_WORKERS,
+    max_pending=Config.HEATMAP_MAX_PENDING,
+    max_jobs=Config.HEATMAP_MAX_JOBS,
+    ttl_seconds=Config.HEATMAP_JOB_TTL_SECONDS
+)
+
+HEATMAP_MODES = ('async', 'inline', 'none')
+HEATMAP_OUTPUTS = ('image', 'grid')
+HEATMAP_RESULT_FIELDS = ('processed_image', 'heatmap_grid')
+
+# Computer vision (ABCDE) analysis, run next to model inference on /api/analyze
+image_processor = ImageProcessor()
+analysis_executor = ThreadPoolExecutor(
+    max_workers=Config.ANALYSIS_WORKERS, thread_name_prefix='abcde'
+) if Config.ABCDE_ANALYSIS_ENABLED else None
+
+# Sampling profiler for /api/analyze (None when PROFILE_SAMPLE_RATE is 0)
+request_profiler = RequestProfiler(
+    Config.PROFILE_DIR,
+    sample_rate=Config.PROFILE_SAMPLE_RATE,
+    max_profiles=Config.PROFILE_MAX_FILES,
+    tf_trace=Config.PROFILE_TF_TRACE
+) if Config.PROFILE_SAMPLE_RATE > 0 else None
+
+registry.gauge('melanox_model_ready', 'Whether the default model is loaded and warmed up',
+               lambda: 1 if model_registry.get_default().loader.is_loaded() else 0)
+registry.gauge('melanox_heatmap_jobs_pending', 'Heatmap jobs queued or running',
+               lambda: heatmap_jobs.get_stats()['pending'])
+
+@app.before_request
+def start_request_metrics():
+    """Start the latency clock and the stage timings of the request"""
+    g.request_start = time.perf_counter()
+    start_request_timings()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and add the Server-Timing header when enabled or asked for"""
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    
+    timings = current_request_timings()
+    if timings is not None and timings.stages and (
+            Config.TIMING_HEADER_ENABLED or request.args.get('timing') in ('1', 'true')):
+        response.headers['Server-Timing'] = f'{timings.server_timing()}, total;dur={elapsed * 1000:.1f}'
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    end_request_timings()
+
+def start_request_profile():
+    """Profile a sampled share of the analysis requests"""
+    if request.endpoint == 'analyze_image':
+        g.request_profile = request_profiler.start()
+
+def record_profile_status(response):
+    g.response_status = response.status_code
+    return response
+
+def end_request_profile(exc):
+    """Stop the profile of a sampled request and write it to PROFILE_DIR"""
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        request_profiler.stop(profile, {
+            'path': request.path,
+            'query': request.query_string.decode('utf-8', 'replace'),
+            'status': g.get('response_status', 500)
+        })
+
+# Only hooked in when sampling is on, so unsampled deployments pay nothing
+if request_profiler is not None:
+    app.before_request(start_request_profile)
+    app.after_request(record_profile_status)
+    app.teardown_request(end_request_profile)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (metrics of the worker process that answers)"""
+    if not Config.METRICS_ENABLED:
+        return jsonify({'error': 'Endpoint not found'}), 404
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({
+    """Health check endpoint (liveness: answers while the model is still loading)"""
+    default_loader = model_registry.get_default().loader
+    model_status = default_loader.get_status()
+    health = {
         'status': 'healthy',
         'message': 'Melanoma Detection API is running',
-        'model_loaded': model_loader._model is not None
-    })
+        'model_loaded': default_loader.is_loaded(),
+        'model_status': model_status['status']
+    }
+    if 'error' in model_status:
+        health['model_error'] = model_status['error']
+    if 'load_seconds' in model_status:
+        health['model_load_seconds'] = model_status['load_seconds']
+    return jsonify(health)
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint for load balancers: 200 once the model is loaded, 503 before"""
+    default_loader = model_registry.get_default().loader
+    return jsonify({
+        'ready': default_loader.is_loaded(),
+        **default_loader.get_status()
+    }), 200 if default_loader.is_loaded() else 503
+
+def model_not_ready_response():
+    """503 response for inference requests received before the model is ready"""
+    status = model_registry.get_default().loader.get_status()['status']
+    return jsonify({
+        'success': False,
+        'error': 'Model failed to load' if status == 'failed' else 'Model is loading, retry shortly'
+    }), 503, {'Retry-After': '5'}
 
 @app.route('/api/model-info', methods=['GET'])
 def model_info():
-    """Get information about the loaded model"""
-    info = model_loader.get_model_info()
+    """Get information about the default model, and every registered model with its latency"""
+    default = model_registry.get_default()
+    info = default.loader.get_model_info()
     if info:
-        return jsonify(info)
+        return jsonify({
+            **info,
+            'model_name': default.name,
+            'registry': model_registry.get_info()
+        })
     else:
         return jsonify({'error': 'Model not loaded'}), 500
 
+@app.route('/api/batching-stats', methods=['GET'])
+def batching_stats():
+    """Get micro-batching queue depth and batch size metrics (default model)"""
+    return jsonify(model_registry.get_default().loader.get_batching_stats())
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """Get result cache hit/miss counters"""
+    if result_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **result_cache.get_stats()})
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
     """
     Main endpoint for melanoma detection analysis
     
-    Expected request body:
-    {
-        "image": "data:image/png;base64,..."
-    }
+    Expected request body, one of:
+    - JSON: {"image": "data:image/png;base64,..."}
+    - raw image bytes with Content-Type image/jpeg or image/png
+    - multipart/form-data with an "image" file part
+    
+    Query parameters:
+    - heatmap: 'async' (default, Config.HEATMAP_MODE), 'inline' or 'none'
+    - heatmap_output: 'image' (default, Config.HEATMAP_OUTPUT) renders the Grad-CAM
+      overlay on the server; 'grid' returns the raw heatmap in heatmap_grid instead
+    - image_delivery: 'inline' (default, Config.OUTPUT_IMAGE_DELIVERY) returns the
+      overlay as a data URL in processed_image; 'url' returns processed_image_url,
+      the binary image at /api/analyze/<job_id>/heatmap/image
+    - tta: number of test-time augmentation views (default Config.TTA_VIEWS, 1 = off)
     
     Returns:
     {
         "success": true,
         "prediction": "Benigno" | "Maligno",
         "confidence": 85.5,
+        "model_name": "primary",   (registry model that served the request)
+        "model_version": "best_model.h5-...",
+        "heatmap_status": "done" | "pending" | "skipped" | "unavailable",
+        "heatmap_job_id": "...",   (when pending)
+        "heatmap_url": "/api/analyze/<job_id>/heatmap",   (when pending)
+        "processed_image": "data:image/webp;base64,...",   (image_delivery=inline)
+        "processed_image_url": "/api/analyze/<job_id>/heatmap/image",   (image_delivery=url)
+        "heatmap_grid": {"shape": [7, 7], "dtype": "uint8", "data": "<base64>"},   (heatmap_output=grid)
+        "tta": {"views": 8, "malignant_probability_mean": 0.12, ...},   (tta > 1)
+        "lesion_detected": true | false | null,   (null without an ABCDE result)
+        "analysis_error": true,   (when the ABCDE analysis failed)
         "details": {
             "type": "Nevus Melanocítico" | "Melanoma",
             "risk": "Bajo" | "Medio" | "Alto",
@@ -78,42 +277,123 @@ def analyze_image():
         }
     }
     """
+    if not model_registry.get_default().loader.is_loaded():
+        return model_not_ready_response()
+    
+    heatmap_mode = request.args.get('heatmap', Config.HEATMAP_MODE)
+    if heatmap_mode not in HEATMAP_MODES:
+        return jsonify({
+            'success': False,
+            'error': f"Invalid heatmap mode (options: {', '.join(HEATMAP_MODES)})"
+        }), 400
+    
+    heatmap_output = request.args.get('heatmap_output', Config.HEATMAP_OUTPUT)
+    if heatmap_output not in HEATMAP_OUTPUTS:
+        return jsonify({
+            'success': False,
+            'error': f"Invalid heatmap output (options: {', '.join(HEATMAP_OUTPUTS)})"
+        }), 400
+    
+    image_delivery = request.args.get('image_delivery', Config.OUTPUT_IMAGE_DELIVERY)
+    if image_delivery not in IMAGE_DELIVERY_MODES:
+        return jsonify({
+            'success': False,
+            'error': f"Invalid image delivery (options: {', '.join(IMAGE_DELIVERY_MODES)})"
+        }), 400
+    
     try:
-        # Get JSON data
-        data = request.get_json()
-        
-        if not data or 'image' not in data:
+        tta_views = int(request.args.get('tta', Config.TTA_VIEWS))
+    except ValueError:
+        tta_views = 0
+    if not 1 <= tta_views <= len(TTA_VIEW_NAMES):
+        return jsonify({
+            'success': False,
+            'error': f"Invalid tta views (1 to {len(TTA_VIEW_NAMES)})"
+        }), 400
+    
+    served = None
+    try:
+        # Read the uploaded image (raw body, multipart or base64 JSON)
+        try:
+            with stage('read'):
+                image_bytes = read_request_image_bytes(request)
+        except ImageInputError as e:
             return jsonify({
                 'success': False,
-                'error': 'No image provided'
-            }), 400
+                'error': str(e)
+            }), e.status_code
         
-        # Parse base64 image
-        image_data = data['image']
+        # Same image, same model: the A/B split is sticky per image
+        # (the model is held until the request, and its heatmap job, are done)
+        served = model_registry.route(image_bytes)
+        loader = served.loader
         
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
+        # Serve repeated analyses of the same image from the result cache
+        cache_key = None
+        if result_cache is not None:
+            with stage('cache_lookup'):
+                cache_key = ResultCache.make_key(
+                    image_bytes, loader.get_model_version(),
+                    Config.MODEL_NORMALIZATION, Config.FAST_PREPROCESS,
+                    Config.ABCDE_ANALYSIS_ENABLED, Config.ANALYSIS_MAX_DIMENSION,
+                    Config.OUTPUT_IMAGE_FORMAT, Config.OUTPUT_IMAGE_QUALITY, Config.OUTPUT_MAX_DIMENSION,
+                    heatmap_output, tta_views
+                )
+                cached_response = result_cache.get(cache_key)
+            CACHE_LOOKUPS.inc(result='miss' if cached_response is None else 'hit')
+            if cached_response is not None:
+                if image_delivery == 'url':
+                    return jsonify(_deliver_by_url(json.loads(cached_response), cache_key))
+                return Response(cached_response, mimetype='application/json')
         
-        # Decode base64
         try:
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(BytesIO(image_bytes))
-        except Exception as e:
+            # Header only: the pixels are decoded by the preprocess stage
+            with stage('open'):
+                image = open_image_bytes(image_bytes)
+        except ImageInputError as e:
             return jsonify({
                 'success': False,
-                'error': f'Invalid image data: {str(e)}'
-            }), 400
+                'error': str(e)
+            }), e.status_code
         
-        # Validate image size
-        if len(image_bytes) > Config.MAX_IMAGE_SIZE:
-            return jsonify({
-                'success': False,
-                'error': 'Image too large (max 10MB)'
-            }), 400
+        # The ABCDE analysis (OpenCV) and the inference (TensorFlow) both release
+        # the GIL: run the analysis on its own copy of the image meanwhile
+        # (in a copy of the request context, so its timing joins the request's)
+        analysis_future = None
+        if analysis_executor is not None:
+            analysis_future = analysis_executor.submit(
+                contextvars.copy_context().run, _analyze_abcde, image_bytes
+            )
+        
+        gradcam_available = loader.is_gradcam_available()
+        inference_start = time.perf_counter()
+        try:
+            if tta_views > 1:
+                # All augmented views in one forward pass; Grad-CAM needs its own pass
+                prediction_result = loader.predict_tta(image, tta_views)
+                heatmap = (_inline_heatmap(loader, image)
+                           if heatmap_mode == 'inline' and gradcam_available else None)
+            elif heatmap_mode == 'inline' and gradcam_available:
+                # Run model prediction and Grad-CAM from a single forward pass
+                prediction_result, heatmap = loader.predict_with_gradcam(image)
+            else:
+                # Prediction only; the heatmap (if wanted) is rendered in the background
+                prediction_result, heatmap = loader.predict(image), None
+        except Exception:
+            model_registry.record(served, time.perf_counter() - inference_start, error=True)
+            raise
+        model_registry.record(served, time.perf_counter() - inference_start)
         
-        # Run model prediction
-        prediction_result = model_loader.predict(image)
+        cv_result = None
+        analysis_error = False
+        if analysis_future is not None:
+            try:
+                with stage('abcde_wait'):
+                    cv_result = analysis_future.result()
+            except Exception:
+                logger.exception("Error in ABCDE analysis")
+                ANALYSIS_ERRORS.inc(stage='abcde')
+                analysis_error = True
         
         # Determine if malignant
         is_malignant = prediction_result['prediction'] == 'Maligno'
@@ -144,39 +424,17 @@ def analyze_image():
             recommendation = 'Consulta con un dermatólogo para evaluación profesional y monitoreo rutinario.'
         
         # ---------------------------------------------------------
-        # GENERATE GRAD-CAM HEATMAP (Lesion Detection)
+        # GRAD-CAM HEATMAP OVERLAY (Lesion Detection)
         # ---------------------------------------------------------
-        processed_image_b64 = None
-        try:
-            # Import local module here to avoid circular imports or startup errors
-            import sys
-            import os
-            
-            # Ensure backend directory is in path
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            if current_dir not in sys.path:
-                sys.path.append(current_dir)
-                
-            from gradcam import make_gradcam_heatmap, save_and_display_gradcam, get_last_conv_layer_name
-            
-            # Get underlying model
-            model = model_loader.get_model()
-            
-            # Identify last conv layer
-            last_conv_layer_name = get_last_conv_layer_name(model)
-            
-            if last_conv_layer_name:
-                # Preprocess for Grad-CAM
-                img_array = model_loader.preprocess_image(image)
-                
-                # Generate heatmap
-                heatmap = make_gradcam_heatmap(img_array, model, last_conv_layer_name)
-                
-                # Overlay on original image
-                processed_image_b64, _ = save_and_display_gradcam(image, heatmap, alpha=0.4)
-                
-        except Exception as e:
-            pass  # Silently fail Grad-CAM generation
+        heatmap_fields = {}
+        if heatmap is not None:
+            try:
+                # Overlay on original image, or the raw grid for the client
+                heatmap_fields = _heatmap_fields(image, heatmap, heatmap_output)
+            except Exception:
+                # The prediction is still returned, with heatmap_status 'unavailable'
+                logger.exception("Error rendering Grad-CAM heatmap")
+                GRADCAM_FAILURES.inc(mode='inline')
         # ---------------------------------------------------------
         
         # Build response
@@ -184,31 +442,578 @@ def analyze_image():
             'success': True,
             'prediction': prediction_result['prediction'],
             'confidence': prediction_result['confidence'],
+            'model_name': served.name,
+            'model_version': loader.get_model_version(),
             'details': {
                 'type': lesion_type,
                 'risk': risk_level,
                 'recommendation': recommendation
             },
-            'lesion_detected': True,
-            'processed_image': processed_image_b64 if processed_image_b64 else None,
-            'lesion_location': None,
-            'lesion_metrics': None,
-            'abcde_analysis': None
+            # Unknown (None) when the ABCDE analysis is disabled or failed
+            'lesion_detected': cv_result['lesion_detected'] if cv_result else None,
+            'processed_image': None,
+            'heatmap_status': 'done' if heatmap_fields else (
+                'skipped' if heatmap_mode == 'none' else 'unavailable'
+            ),
+            'lesion_location': cv_result['lesion_location'] if cv_result else None,
+            'lesion_metrics': cv_result['lesion_metrics'] if cv_result else None,
+            'abcde_analysis': cv_result['abcde_analysis'] if cv_result else None,
+            **heatmap_fields
         }
+        if analysis_error:
+            response['analysis_error'] = True
+        if 'tta' in prediction_result:
+            response['tta'] = prediction_result['tta']
+        
+        abcde = response['abcde_analysis']
+        if abcde:
+            response['details']['characteristics'] = {
+                'asymmetry': abcde['asymmetry']['description'],
+                'border': abcde['border']['description'],
+                'color': abcde['color']['description'],
+                'diameter': abcde['diameter']['description']
+            }
         
-        return jsonify(response)
+        if heatmap_mode == 'async' and gradcam_available:
+            # The content hash doubles as job id, so repeated submissions share a job
+            # and finished heatmaps can be found in the (shared) result cache
+            job_id = cache_key or uuid.uuid4().hex
+            served.retain()
+            if heatmap_jobs.submit(job_id, _render_heatmap, served, image, response,
+                                   cache_key, heatmap_output, on_skip=served.release):
+                response = {
+                    **response,
+                    'heatmap_status': 'pending',
+                    'heatmap_job_id': job_id,
+                    'heatmap_url': f'/api/analyze/{job_id}/heatmap'
+                }
+                if image_delivery == 'url' and heatmap_output == 'image':
+                    response['processed_image_url'] = f'/api/analyze/{job_id}/heatmap/image'
+            # The complete response is cached by the job once the heatmap is ready
+            return jsonify(response)
         
-    except Exception as e:
+        # Only cache complete responses: with the heatmap (or that can never
+        # have one) and the ABCDE analysis, which may only have failed transiently
+        if (cache_key is not None and not analysis_error
+                and (heatmap_mode == 'inline' or not gradcam_available)):
+            with stage('cache_store'):
+                result_cache.set(cache_key, response)
+        
+        if image_delivery == 'url':
+            response = _deliver_by_url(response, cache_key or uuid.uuid4().hex)
+        
+        with stage('serialize'):
+            return jsonify(response)
+    
+    except Exception:
+        logger.exception("Analysis failed")
+        ANALYSIS_ERRORS.inc(stage='analysis')
         return jsonify({
             'success': False,
             'error': 'Analysis failed'
         }), 500
+    finally:
+        if served is not None:
+            served.release()
+
+def _inline_heatmap(loader, image):
+    """Grad-CAM heatmap of the unaugmented image, or None if it fails"""
+    try:
+        return loader.gradcam_heatmap(image)
+    except Exception:
+        logger.exception("Error generating Grad-CAM heatmap")
+        GRADCAM_FAILURES.inc(mode='inline')
+        return None
+
+def _analyze_abcde(image_bytes):
+    """ABCDE analysis job for /api/analyze (runs on the analysis executor)"""
+    with stage('abcde'):
+        return image_processor.process_image_bytes(image_bytes, include_overlay=False)
+
+def _deliver_by_url(response, job_id):
+    """
+    Move the overlay of a finished analysis out of the JSON response: it is
+    kept with the heatmap jobs and served as binary at processed_image_url
+    """
+    processed_image = response.get('processed_image')
+    if not processed_image:
+        return response
+    
+    heatmap_jobs.put(job_id, {'processed_image': processed_image})
+    return {
+        **response,
+        'processed_image': None,
+        'processed_image_url': f'/api/analyze/{job_id}/heatmap/image'
+    }
+
+def _heatmap_fields(image, heatmap, heatmap_output):
+    """
+    Turn a Grad-CAM heatmap into its response fields
+    
+    Args:
+        image: PIL Image the heatmap was computed for
+        heatmap: normalized Grad-CAM heatmap (last conv layer resolution)
+        heatmap_output: 'image' (overlay data URL) or 'grid' (quantized raw heatmap)
+        
+    Returns:
+        dict with processed_image or heatmap_grid
+    """
+    if heatmap_output == 'grid':
+        # The client upsamples, colorizes and blends it (no server-side rendering)
+        with stage('encode'):
+            return {'heatmap_grid': encode_heatmap_grid(heatmap)}
+    
+    # Imported here so the API starts without importing TensorFlow
+    from gradcam import save_and_display_gradcam
+    
+    processed_image_b64, _ = save_and_display_gradcam(image, heatmap, alpha=0.4)
+    return {'processed_image': processed_image_b64}
+
+def _render_heatmap(model, image, response, cache_key, heatmap_output='image'):
+    """
+    Heatmap job: compute Grad-CAM and render it for an analysis already
+    returned to the client, then cache the complete response (unless its
+    ABCDE analysis failed)
+    
+    Args:
+        model: registry model that served the analysis, acquired for the job
+            (released here)
+            
+    Returns:
+        the heatmap response fields (processed_image or heatmap_grid)
+    """
+    try:
+        heatmap = model.loader.gradcam_heatmap(image)
+        heatmap_fields = _heatmap_fields(image, heatmap, heatmap_output)
+    except Exception:
+        # Logged by the job pool, which marks the job failed
+        GRADCAM_FAILURES.inc(mode='async')
+        raise
+    finally:
+        model.release()
+    
+    if cache_key is not None and not response.get('analysis_error'):
+        result_cache.set(cache_key, {
+            **response,
+            **heatmap_fields,
+            'heatmap_status': 'done'
+        })
+    
+    return heatmap_fields
+
+def _get_heatmap_job(job_id):
+    """
+    Look up a heatmap job for the poll endpoints, waiting up to ?wait= seconds
+    
+    Returns:
+        (job dict or None, None) or (None, error response) for an invalid wait
+    """
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), Config.HEATMAP_MAX_WAIT_SECONDS)
+    except ValueError:
+        return None, (jsonify({
+            'success': False,
+            'error': 'Invalid wait value'
+        }), 400)
+    
+    job = heatmap_jobs.get(job_id, wait=wait)
+    
+    # Jobs run in the worker that served the analysis; finished heatmaps are
+    # also found in the result cache (shared between workers with RESULT_CACHE_DIR)
+    if job is None and result_cache is not None and re.fullmatch(r'[0-9a-f]{64}', job_id):
+        cached_response = result_cache.get(job_id)
+        if cached_response is not None:
+            cached = json.loads(cached_response)
+            heatmap_fields = {field: cached[field] for field in HEATMAP_RESULT_FIELDS if cached.get(field)}
+            if heatmap_fields:
+                job = {'status': 'done', 'result': heatmap_fields}
+    
+    return job, None
+
+def _heatmap_job_error(job):
+    """Response for a heatmap job that is unknown, pending or failed (None when done)"""
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Unknown or expired heatmap job'
+        }), 404
+    
+    if job['status'] == 'pending':
+        return jsonify({'success': True, 'status': 'pending'}), 202, {'Retry-After': '1'}
+    
+    if job['status'] == 'failed':
+        return jsonify({
+            'success': False,
+            'status': 'failed',
+            'error': 'Heatmap generation failed'
+        }), 500
+    
+    return None
+
+@app.route('/api/analyze/<job_id>/heatmap', methods=['GET'])
+def analyze_heatmap(job_id):
+    """
+    Poll the Grad-CAM heatmap of an analysis made with heatmap=async
+    
+    Query parameters:
+    - wait: seconds to wait for a pending heatmap (long polling, max HEATMAP_MAX_WAIT_SECONDS)
+    
+    Returns:
+    - 200 {"success": true, "status": "done", "processed_image": "data:image/webp;base64,..."}
+      (or "heatmap_grid": {...} for heatmap_output=grid)
+    - 202 {"success": true, "status": "pending"} (retry later)
+    - 404 unknown or expired job, 500 if rendering failed
+    """
+    job, error_response = _get_heatmap_job(job_id)
+    if error_response is None:
+        error_response = _heatmap_job_error(job)
+    if error_response is not None:
+        return error_response
+    
+    return jsonify({
+        'success': True,
+        'status': 'done',
+        **job['result']
+    })
+
+@app.route('/api/analyze/<job_id>/heatmap/image', methods=['GET'])
+def analyze_heatmap_image(job_id):
+    """
+    Get the Grad-CAM overlay of an analysis as a binary image (image_delivery=url)
+    
+    Query parameters:
+    - wait: seconds to wait for a pending heatmap (long polling, max HEATMAP_MAX_WAIT_SECONDS)
+    
+    Returns:
+    - 200 with the encoded image (Content-Type image/webp, image/jpeg or image/png)
+    - 202/404/500 JSON, as /api/analyze/<job_id>/heatmap
+    """
+    job, error_response = _get_heatmap_job(job_id)
+    if error_response is None:
+        error_response = _heatmap_job_error(job)
+    if error_response is not None:
+        return error_response
+    
+    processed_image = job['result'].get('processed_image')
+    if not processed_image:
+        return jsonify({
+            'success': False,
+            'error': 'No overlay image for this heatmap (made with heatmap_output=grid)'
+        }), 404
+    
+    image_data, mime_type = from_data_url(processed_image)
+    return Response(image_data, mimetype=mime_type, headers={
+        'Cache-Control': f'private, max-age={Config.HEATMAP_JOB_TTL_SECONDS}'
+    })
+
+@app.route('/api/heatmap-stats', methods=['GET'])
+def heatmap_stats():
+    """Get background heatmap job counters and backlog"""
+    return jsonify(heatmap_jobs.get_stats())
+
+def admin_auth_error():
+    """Error response for admin requests without the ADMIN_TOKEN (None when authorized)"""
+    if not Config.ADMIN_TOKEN:
+        return jsonify({'error': 'Endpoint not found'}), 404
+    
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(token.encode('utf-8'), Config.ADMIN_TOKEN.encode('utf-8')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    return None
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """List the stored request profiles, newest first (admin)"""
+    error_response = admin_auth_error()
+    if error_response is not None:
+        return error_response
+    
+    if request_profiler is None:
+        return jsonify({'enabled': False, 'profiles': []})
+    
+    return jsonify({
+        'enabled': True,
+        'sample_rate': request_profiler.sample_rate,
+        'tf_trace': request_profiler.tf_trace,
+        'max_profiles': request_profiler.max_profiles,
+        'profiles': request_profiler.list_profiles()
+    })
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download a request profile in pstats format (admin)"""
+    error_response = admin_auth_error()
+    if error_response is not None:
+        return error_response
+    
+    path = request_profiler.get_profile_path(profile_id) if request_profiler is not None else None
+    if path is None:
+        return jsonify({'success': False, 'error': 'Unknown profile'}), 404
+    
+    return send_file(path, mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f'{profile_id}.prof')
+
+@app.route('/api/admin/profiles/<profile_id>/tf-trace', methods=['GET'])
+def download_profile_tf_trace(profile_id):
+    """Download the TensorFlow trace of a request profile as a zip (admin)"""
+    error_response = admin_auth_error()
+    if error_response is not None:
+        return error_response
+    
+    archive = request_profiler.get_tf_trace_archive(profile_id) if request_profiler is not None else None
+    if archive is None:
+        return jsonify({'success': False, 'error': 'No TensorFlow trace for this profile'}), 404
+    
+    return Response(archive, mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename={profile_id}-tf.zip'
+    })
+
+def _update_registry(change):
+    """Apply an admin change to the model registry and answer with its state"""
+    try:
+        model_registry.update(change)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **model_registry.get_info()})
+
+@app.route('/api/admin/models/<name>', methods=['PUT'])
+def register_model(name):
+    """
+    Register a model and load it in the background (admin)
+    
+    Expected request body:
+    {"path": "model_v2.h5", "backend": "keras"}   (path relative to MODEL_DIR,
+    backend defaults to Config.INFERENCE_BACKEND)
+    
+    The model gets traffic once it is ready and activated or made the candidate.
+    """
+    error_response = admin_auth_error()
+    if error_response is not None:
+        return error_response
+    
+    if not re.fullmatch(r'[A-Za-z0-9_.-]{1,64}', name):
+        return jsonify({'success': False, 'error': 'Invalid model name'}), 400
+    
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('path'), str):
+        return jsonify({'success': False, 'error': 'No model path provided'}), 400
+    
+    def change(state):
+        if name in state['models']:
+            raise ValueError(f"Model {name} is already registered; use a new name for a new version")
+        state['models'][name] = {
+            'path': model_registry.resolve_path(data['path']),
+            'backend': data.get('backend', Config.INFERENCE_BACKEND)
+        }
+    
+    return _update_registry(change)
+
+@app.route('/api/admin/models/<name>', methods=['DELETE'])
+def unregister_model(name):
+    """Unregister a model that is not the default and unload it (admin)"""
+    error_response = admin_auth_error()
+    if error_response is not None:
+        return error_response
+    
+    def change(state):
+        if name not in state['models']:
+            raise ValueError(f"Unknown model: {name}")
+        if state['default'] == name:
+            raise ValueError("The default model cannot be unregistered; activate another first")
+        del state['models'][name]
+        if state['candidate'] == name:
+            state['candidate'], state['candidate_percent'] = None, 0
+    
+    return _update_registry(change)
+
+@app.route('/api/admin/models/<name>/activate', methods=['POST'])
+def activate_model(name):
+    """
+    Make a registered model the default (admin)
+    
+    The swap happens once the model is loaded and warmed up; until then the
+    current default keeps serving.
+    """
+    error_response = admin_auth_error()
+    if error_response is not None:
+        return error_response
+    
+    def change(state):
+        state['default'] = name
+        if state['candidate'] == name:
+            state['candidate'], state['candidate_percent'] = None, 0
+    
+    return _update_registry(change)
+
+@app.route('/api/admin/routing', methods=['PUT'])
+def update_routing():
+    """
+    Send a share of the /api/analyze traffic to a candidate model (admin)
+    
+    Expected request body:
+    {"candidate": "v2", "percent": 10}   (candidate null to stop the test)
+    """
+    error_response = admin_auth_error()
+    if error_response is not None:
+        return error_response
+    
+    data = request.get_json(silent=True) or {}
+    candidate = data.get('candidate')
+    percent = data.get('percent', 0 if candidate is None else None)
+    if not isinstance(percent, (int, float)) or isinstance(percent, bool):
+        return jsonify({'success': False, 'error': 'No routing percent provided'}), 400
+    
+    def change(state):
+        state['candidate'] = candidate
+        state['candidate_percent'] = percent if candidate is not None else 0
+    
+    return _update_registry(change)
+
+def _collect_batch_sources():
+    """
+    Collect (id, source) pairs for a batch request
+    
+    Sources are multipart file parts (any field name) or, for JSON bodies,
+    the entries of the "images" list (base64 strings or {"id", "image"} objects).
+    Uploaded parts stay spooled by werkzeug and are read lazily per batch.
+    """
+    sources = []
+    
+    if request.files:
+        for index, (field, storage) in enumerate(request.files.items(multi=True)):
+            sources.append((storage.filename or f'{field}-{index}', storage.stream))
+            # Take ownership of the spooled upload: the request closes its files
+            # when the view returns, before the streamed response is generated
+            storage.stream = BytesIO()
+        return sources
+    
+    data = request.get_json(silent=True) or {}
+    for index, item in enumerate(data.get('images') or []):
+        if isinstance(item, dict):
+            sources.append((item.get('id', index), item.get('image')))
+        else:
+            sources.append((index, item))
+    return sources
+
+def _preprocess_batch_source(loader, source):
+    """Decode one batch source and preprocess it for the model"""
+    if hasattr(source, 'read'):
+        # Each part gets the single-image size limit, not just the batch body limit
+        try:
+            image_bytes = read_image_stream(source)
+        finally:
+            source.close()
+    else:
+        image_bytes = decode_base64_image(source)
+    
+    image = open_image_bytes(image_bytes)
+    
+    return loader.preprocess_image(image)
+
+def _generate_batch_results(sources):
+    """
+    Preprocess sources on a thread pool and run them through the model in
+    fixed-size batches, yielding one NDJSON line per image as soon as its
+    batch is done. The next batch is preprocessed while the current one runs.
+    The whole batch is served by the default model at its start, even across a swap.
+    """
+    model = model_registry.acquire_default()
+    loader = model.loader
+    executor = ThreadPoolExecutor(max_workers=Config.BATCH_PREPROCESS_WORKERS)
+    chunks = iter(lambda: list(islice(sources, Config.BATCH_ANALYSIS_SIZE)), [])
+    total = failed = 0
+    
+    def submit(chunk):
+        return [(item_id, executor.submit(_preprocess_batch_source, loader, source))
+                for item_id, source in chunk]
+    
+    try:
+        pending = submit(next(chunks, []))
+        while pending:
+            current = pending
+            pending = submit(next(chunks, []))
+            
+            lines = []
+            arrays = []
+            for item_id, future in current:
+                try:
+                    arrays.append(future.result())
+                    lines.append({'id': item_id, 'success': True,
+                                  'model_version': loader.get_model_version()})
+                except Exception as e:
+                    ANALYSIS_ERRORS.inc(stage='batch_image')
+                    lines.append({'id': item_id, 'success': False, 'error': str(e)})
+            
+            try:
+                results = iter(loader.predict_batch(arrays) if arrays else [])
+                for line in lines:
+                    if line['success']:
+                        line.update(next(results))
+            except Exception:
+                logger.exception("Batch inference failed")
+                ANALYSIS_ERRORS.inc(stage='batch_inference')
+                for line in lines:
+                    if line['success']:
+                        line.update({'success': False, 'error': 'Analysis failed'})
+            
+            for line in lines:
+                total += 1
+                failed += 0 if line['success'] else 1
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+        
+        yield json.dumps({'done': True, 'total': total, 'failed': failed}) + '\n'
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        model.release()
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Batch endpoint for screening many images
+    
+    Accepts multipart/form-data with one or more image file parts, or a JSON body:
+    {
+        "images": ["data:image/png;base64,...", {"id": "img-2", "image": "..."}]
+    }
+    
+    Streams NDJSON (application/x-ndjson), one line per image:
+    {"id": "img-1.jpg", "success": true, "model_version": "...", "prediction": "Benigno", ...}
+    followed by a summary line:
+    {"done": true, "total": 120, "failed": 1}
+    """
+    if not model_registry.get_default().loader.is_loaded():
+        return model_not_ready_response()
+    
+    # Batch uploads carry many images, so they get their own body limit
+    request.max_content_length = Config.MAX_BATCH_REQUEST_SIZE
+    
+    sources = _collect_batch_sources()
+    
+    if not sources:
+        return jsonify({
+            'success': False,
+            'error': 'No images provided'
+        }), 400
+    
+    return Response(
+        _generate_batch_results(iter(sources)),
+        mimetype='application/x-ndjson'
+    )
 
 @app.errorhandler(404)
 def not_found(e):
     """Handle 404 errors"""
     return jsonify({'error': 'Endpoint not found'}), 404
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Handle bodies over the configured size limit"""
+    return jsonify({
+        'success': False,
+        'error': 'Request too large'
+    }), 413
+
 @app.errorhandler(500)
 def internal_error(e):
     """Handle 500 errors"""
@@ -218,12 +1023,23 @@ if __name__ == '__main__':
     print(f"\n{'='*60}")
     print(f"🔬 Melanoma Detection API Server")
     print(f"{'='*60}")
-    print(f"Model: {Config.MODEL_PATH}")
+    print(f"Model: {Config.MODEL_NAME} = {Config.MODEL_PATH} (backend: {Config.INFERENCE_BACKEND})")
     print(f"Server: http://{Config.API_HOST}:{Config.API_PORT}")
     print(f"Endpoints:")
+    print(f"  - GET  /metrics")
     print(f"  - GET  /api/health")
+    print(f"  - GET  /api/ready")
     print(f"  - GET  /api/model-info")
+    print(f"  - GET  /api/batching-stats")
+    print(f"  - GET  /api/cache-stats")
     print(f"  - POST /api/analyze")
+    print(f"  - GET  /api/analyze/<job_id>/heatmap")
+    print(f"  - GET  /api/analyze/<job_id>/heatmap/image")
+    print(f"  - GET  /api/heatmap-stats")
+    print(f"  - POST /api/analyze/batch")
+    print(f"  - GET  /api/admin/profiles (ADMIN_TOKEN)")
+    print(f"  - PUT  /api/admin/models/<name> (ADMIN_TOKEN)")
+    print(f"  - PUT  /api/admin/routing (ADMIN_TOKEN)")
     print(f"{'='*60}\n")
     
     app.run(
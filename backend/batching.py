@@ -0,0 +1,169 @@
+"""
+Batching Module - Dynamic micro-batching of concurrent inference requests
+"""
+import threading
+import queue
+import time
+from concurrent.futures import Future
+import numpy as np
+from metrics import BATCH_SIZE
+
+# Queued by close(): the worker stops once the inputs queued before it are done
+_CLOSE = object()
+
+class BatchScheduler:
+    """
+    Collects single inputs from concurrent callers and runs them as one batch
+
+    A background worker waits for the first queued input, then keeps collecting
+    until either max_batch_size inputs are available or max_wait_ms has elapsed,
+    runs batch_fn once on the stacked batch and hands each caller its own rows.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5, name='inference'):
+        """
+        Initialize the scheduler and start its worker thread
+
+        Args:
+            batch_fn: callable taking a stacked numpy batch and returning an array
+                or a tuple of arrays whose first dimension is the batch
+            max_batch_size: maximum number of inputs per forward pass
+            max_wait_ms: maximum time to wait for a batch to fill up
+            name: label used for the worker thread and stats
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._close_lock = threading.Lock()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._last_batch_size = 0
+        self._batch_size_counts = {}
+
+        self._worker = threading.Thread(
+            target=self._run, name=f'batch-scheduler-{name}', daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, item):
+        """
+        Queue a single input (without batch dimension)
+
+        Returns:
+            Future resolving to the batch_fn output rows for this input,
+            keeping a leading batch dimension of 1
+        """
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError(f"Batch scheduler {self.name} is closed")
+            self._queue.put((item, future))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+        return future
+
+    def run(self, item):
+        """Queue a single input and block until its result is available"""
+        return self.submit(item).result()
+
+    def close(self, timeout=None):
+        """
+        Stop the worker thread once the inputs already queued are processed
+
+        Args:
+            timeout: seconds to wait for the worker to exit (None: until it does)
+        """
+        with self._close_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_CLOSE)
+        self._worker.join(timeout)
+
+    def get_stats(self):
+        """Get queue depth and batch size metrics"""
+        with self._stats_lock:
+            return {
+                'name': self.name,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'batches': self._batches,
+                'items': self._items,
+                'errors': self._errors,
+                'avg_batch_size': round(self._items / self._batches, 2) if self._batches else 0.0,
+                'last_batch_size': self._last_batch_size,
+                'batch_size_counts': {
+                    str(size): count for size, count in sorted(self._batch_size_counts.items())
+                }
+            }
+
+    def _collect_batch(self):
+        """
+        Block for the first input, then gather more until full or timed out
+
+        Returns:
+            (batch, closing): the inputs collected, and whether close() was
+            reached (the worker exits after this batch)
+        """
+        batch = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.max_wait
+
+        while item is not _CLOSE:
+            batch.append(item)
+            if len(batch) >= self.max_batch_size:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+        return batch, item is _CLOSE
+
+    def _run(self):
+        """Worker loop: run one forward pass per collected batch until closed"""
+        closing = False
+        while not closing:
+            batch, closing = self._collect_batch()
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        """Run one forward pass and hand each caller its rows"""
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+
+        try:
+            outputs = self.batch_fn(np.stack(items))
+        except Exception as e:
+            with self._stats_lock:
+                self._errors += 1
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._last_batch_size = len(batch)
+            self._batch_size_counts[len(batch)] = self._batch_size_counts.get(len(batch), 0) + 1
+        BATCH_SIZE.observe(len(batch), source=self.name)
+
+        for i, future in enumerate(futures):
+            if isinstance(outputs, tuple):
+                future.set_result(tuple(output[i:i + 1] for output in outputs))
+            else:
+                future.set_result(outputs[i:i + 1])
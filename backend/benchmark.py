@@ -0,0 +1,351 @@
+"""
+Benchmark suite for the backend hot paths
+
+Suites:
+    stages  every stage of an analysis, on synthetic lesions of several resolutions:
+            base64 decode, image decode, preprocess_image, ModelLoader.predict,
+            test-time augmentation (8 views),
+            Grad-CAM (engine and make_gradcam_heatmap), overlay rendering and
+            each ImageProcessor (ABCDE) stage
+    e2e     POST /api/analyze through the Flask test client (result cache disabled)
+    paths   keras Model.predict against the compiled tf.function serving path
+
+Each case reports p50/p95/p99 latency, throughput and the process peak RSS after
+it ran. Results can be saved as a baseline and later runs compared against it:
+cases whose p50 grew by more than --tolerance are flagged and the exit status is 1.
+
+Usage:
+    python benchmark.py [--suite all|stages|e2e|paths] [--iterations 20] [--warmup 3]
+                        [--resolutions 640x480,1600x1200,4000x3000]
+                        [--model path/to/model.h5 | --stand-in-model]
+                        [--save-baseline baseline.json] [--baseline baseline.json]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+
+from config import Config
+
+SUITES = ('stages', 'e2e', 'paths')
+DEFAULT_RESOLUTIONS = '640x480,1600x1200,4000x3000'
+
+# A case regresses when its p50 grows by more than the tolerance and by at least this much
+MIN_REGRESSION_MS = 0.5
+
+
+def summarize(latencies):
+    """Summarize a list of latencies (seconds) as milliseconds"""
+    ms = np.array(latencies) * 1000.0
+    return {
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'throughput_per_s': round(float(1000.0 / ms.mean()), 2)
+    }
+
+
+def time_calls(fn, iterations, warmup):
+    """Time repeated calls of fn after some warm-up calls"""
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def bench_case(results, name, fn, iterations, warmup):
+    """Time fn and store its stats (plus peak RSS) under results[name]"""
+    stats = summarize(time_calls(fn, iterations, warmup))
+    stats['peak_rss_mb'] = peak_rss_mb()
+    results[name] = stats
+    print(f"  {name:<56}{stats['p50_ms']:>10.2f} ms p50", flush=True)
+
+
+def make_stand_in_model(path):
+    """
+    Build a small randomly initialized Keras model in place of best_model.h5
+
+    It has the served input size, a sigmoid output and a 'top_conv' layer, so
+    every code path (including Grad-CAM) runs. Timings measure the pipeline
+    around the model, not the production network.
+    """
+    from tensorflow import keras
+
+    keras.utils.set_random_seed(0)
+    width, height = Config.MODEL_INPUT_SIZE
+    inputs = keras.Input((height, width, 3))
+    x = keras.layers.Rescaling(1 / 255.0)(inputs)
+    x = keras.layers.Conv2D(16, 3, strides=2, activation='relu')(x)
+    x = keras.layers.Conv2D(32, 3, strides=2, activation='relu')(x)
+    x = keras.layers.Conv2D(64, 3, strides=2, name='top_conv')(x)
+    x = keras.layers.Activation('relu', name='top_activation')(x)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    outputs = keras.layers.Dense(1, activation='sigmoid')(x)
+    keras.Model(inputs, outputs).save(path)
+    return path
+
+
+def bench_stages(model_loader, resolutions, iterations, warmup):
+    """Benchmark each stage of an analysis at every resolution"""
+    from image_io import decode_base64_image, open_image_bytes
+    from image_processor import ImageProcessor
+    from image_encoding import encode_heatmap_grid
+    from preprocess_parity import make_synthetic_lesion
+    from tta import build_views
+
+    image_processor = ImageProcessor()
+    results = {}
+
+    for index, (width, height) in enumerate(resolutions):
+        label = f'{width}x{height}'
+        image_bytes = make_synthetic_lesion(width, height, seed=index)
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(image_bytes).decode('ascii')
+        image = open_image_bytes(image_bytes)
+        image.load()
+
+        cases = [
+            ('decode_base64', lambda: decode_base64_image(data_url)),
+            ('decode_image', lambda: open_image_bytes(image_bytes).load()),
+            ('preprocess_image', lambda: model_loader.preprocess_image(open_image_bytes(image_bytes))),
+            ('predict', lambda: model_loader.predict(image)),
+            ('tta_views_8', lambda: build_views(model_loader.preprocess_image(image), 8)),
+            ('predict_tta_8', lambda: model_loader.predict_tta(image, 8)),
+        ]
+
+        if model_loader.is_gradcam_available():
+            from gradcam import make_gradcam_heatmap, save_and_display_gradcam
+
+            img_array = model_loader.preprocess_image(image)
+            layer_name = model_loader._gradcam.last_conv_layer_name
+            heatmap = model_loader.gradcam_heatmap(image)
+            cases += [
+                ('gradcam_heatmap', lambda: model_loader.gradcam_heatmap(image)),
+                ('make_gradcam_heatmap', lambda: make_gradcam_heatmap(
+                    img_array, model_loader.get_model(), layer_name
+                )),
+                ('save_and_display_gradcam', lambda: save_and_display_gradcam(image, heatmap)),
+                ('encode_heatmap_grid', lambda: encode_heatmap_grid(heatmap)),
+            ]
+
+        cv_image, scale = image_processor._to_analysis_image(image)
+        lesion_data = image_processor.detect_lesion(cv_image, scale)
+        overlay = image_processor.create_border_overlay(cv_image, lesion_data)
+        cases += [
+            ('abcde/to_analysis_image', lambda: image_processor._to_analysis_image(image)),
+            ('abcde/detect_lesion', lambda: image_processor.detect_lesion(cv_image, scale)),
+            ('abcde/analyze_abcde', lambda: image_processor.analyze_abcde(cv_image, lesion_data)),
+            ('abcde/create_border_overlay',
+             lambda: image_processor.create_border_overlay(cv_image, lesion_data)),
+            ('abcde/encode_overlay', lambda: image_processor._cv_to_base64(overlay)),
+            ('abcde/process_image_bytes',
+             lambda: image_processor.process_image_bytes(image_bytes, include_overlay=False)),
+        ]
+
+        for name, fn in cases:
+            bench_case(results, f'stages/{name}@{label}', fn, iterations, warmup)
+
+    return results
+
+
+def bench_e2e(resolutions, iterations, warmup):
+    """Benchmark POST /api/analyze end to end through the Flask test client"""
+    from preprocess_parity import make_synthetic_lesion
+
+    # Measure the work, not result cache hits on the repeated image
+    Config.RESULT_CACHE_ENABLED = False
+    import api
+
+    client = api.app.test_client()
+    results = {}
+
+    queries = ['heatmap=none']
+    if api.model_loader.is_gradcam_available():
+        queries += ['heatmap=inline', 'heatmap=inline&heatmap_output=grid']
+
+    for index, (width, height) in enumerate(resolutions):
+        image_bytes = make_synthetic_lesion(width, height, seed=index)
+
+        for query in queries:
+            def analyze():
+                response = client.post(f'/api/analyze?{query}', data=image_bytes,
+                                       content_type='image/jpeg')
+                if response.status_code != 200:
+                    raise RuntimeError(f'/api/analyze?{query} returned {response.status_code}')
+
+            bench_case(results, f'e2e/analyze?{query}@{width}x{height}', analyze, iterations, warmup)
+
+    return results
+
+
+def bench_predict_paths(model_loader, iterations, warmup):
+    """Benchmark model.predict against the tf.function serving path"""
+    import tensorflow as tf
+
+    width, height = Config.MODEL_INPUT_SIZE
+    img_array = np.random.RandomState(0).uniform(0, 255, (1, height, width, 3)).astype(np.float32)
+    model = model_loader.get_model()
+
+    serving_fn = tf.function(
+        lambda x: model(x, training=False),
+        input_signature=[tf.TensorSpec((None, height, width, 3), tf.float32)]
+    )
+
+    results = {}
+    bench_case(results, 'paths/model.predict',
+               lambda: model.predict(img_array, verbose=0), iterations, warmup)
+    bench_case(results, 'paths/tf.function',
+               lambda: serving_fn(tf.convert_to_tensor(img_array)).numpy(), iterations, warmup)
+
+    speedup = results['paths/model.predict']['mean_ms'] / results['paths/tf.function']['mean_ms']
+    print(f"  tf.function speedup over model.predict: {speedup:.2f}x")
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Compare p50 latencies against a baseline report
+
+    Returns:
+        list of (case name, baseline p50, current p50) for the regressed cases
+    """
+    regressions = []
+    for name, stats in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        before, after = previous['p50_ms'], stats['p50_ms']
+        if after > before * (1 + tolerance) and after - before >= MIN_REGRESSION_MS:
+            regressions.append((name, before, after))
+    return regressions
+
+
+def print_results(report, baseline=None):
+    """Print a benchmark results table, with the change against the baseline"""
+    print(f"\n{'='*118}")
+    print(f"{'case':<60}{'p50':>9}{'p95':>9}{'p99':>9}{'ops/s':>10}{'peak RSS':>11}{'vs base':>10}")
+    print(f"{'='*118}")
+    for name, stats in report['results'].items():
+        change = ''
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous:
+            change = f"{100 * (stats['p50_ms'] / previous['p50_ms'] - 1):+.0f}%"
+        print(f"{name:<60}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+              f"{stats['throughput_per_s']:>10.1f}{stats['peak_rss_mb']:>9.0f}MB{change:>10}")
+    print(f"{'='*118}")
+    print(f"Peak RSS: {report['peak_rss_mb']} MB\n")
+
+
+def parse_resolutions(value):
+    """Parse 'WxH,WxH' into a list of (width, height)"""
+    resolutions = []
+    for item in value.split(','):
+        width, _, height = item.strip().lower().partition('x')
+        resolutions.append((int(width), int(height)))
+    return resolutions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the backend hot paths')
+    parser.add_argument('--suite', choices=('all',) + SUITES, default='all')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--resolutions', default=DEFAULT_RESOLUTIONS,
+                        help='Synthetic image sizes, e.g. 640x480,4000x3000')
+    model_group = parser.add_mutually_exclusive_group()
+    model_group.add_argument('--model', help='Path to the .h5 model (defaults to Config.MODEL_PATH)')
+    model_group.add_argument('--stand-in-model', action='store_true',
+                             help='Use a small random model instead of best_model.h5')
+    parser.add_argument('--save-baseline', help='Write the results as a baseline JSON file')
+    parser.add_argument('--baseline', help='Compare against this baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed p50 growth over the baseline (0.25 = 25%%)')
+    parser.add_argument('--report', help='Also write the results as JSON to this path')
+    args = parser.parse_args()
+
+    suites = SUITES if args.suite == 'all' else (args.suite,)
+    resolutions = parse_resolutions(args.resolutions)
+
+    Config.INFERENCE_BACKEND = 'keras'
+    Config.BACKGROUND_MODEL_LOAD = False
+    if args.stand_in_model:
+        Config.MODEL_PATH = make_stand_in_model(
+            os.path.join(tempfile.mkdtemp(prefix='melanox-bench-'), 'stand_in_model.h5')
+        )
+    elif args.model:
+        Config.MODEL_PATH = args.model
+
+    from model_loader import ModelLoader
+
+    print("Loading model...")
+    model_loader = ModelLoader()
+
+    results = {}
+    for suite in suites:
+        print(f"\n[{suite}]")
+        if suite == 'stages':
+            results.update(bench_stages(model_loader, resolutions, args.iterations, args.warmup))
+        elif suite == 'e2e':
+            results.update(bench_e2e(resolutions, args.iterations, args.warmup))
+        elif suite == 'paths':
+            results.update(bench_predict_paths(model_loader, args.iterations, args.warmup))
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'model': 'stand-in' if args.stand_in_model else os.path.basename(Config.MODEL_PATH),
+            'iterations': args.iterations,
+            'fast_preprocess': Config.FAST_PREPROCESS,
+        },
+        'results': results,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print_results(report, baseline)
+
+    for path in (args.save_baseline, args.report):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+
+    if baseline is not None:
+        if baseline.get('meta', {}).get('model') != report['meta']['model']:
+            print("Warning: the baseline was recorded with a different model")
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%} (p50):")
+            for name, before, after in regressions:
+                print(f"  {name}: {before:.2f} ms -> {after:.2f} ms")
+            sys.exit(1)
+        print(f"No regressions over {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,19 +2,139 @@
 Configuration settings for the Melanoma Detection Backend API
 """
 import os
+import tempfile
 
 class Config:
     """Application configuration"""
     
     # Model Configuration
-    MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'best_model.h5')
+    MODEL_PATH = os.environ.get(
+        'MODEL_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'best_model.h5')
+    )
+    # Inference backend: 'keras' (TensorFlow, supports Grad-CAM), 'tflite' or 'onnx'.
+    # Create the exported models with export_model.py
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras')
+    TFLITE_MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH', os.path.splitext(MODEL_PATH)[0] + '.tflite')
+    ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', os.path.splitext(MODEL_PATH)[0] + '.onnx')
+    # XNNPACK delegate of the tflite backend: about 2x faster float inference, but it
+    # repacks the weights into private memory in every process. Turn it off to have
+    # gunicorn workers share the model loaded by the master (see gunicorn.conf.py).
+    TFLITE_XNNPACK = os.environ.get('TFLITE_XNNPACK', 'true').lower() == 'true'
     MODEL_INPUT_SIZE = (224, 224)  # Standard size for medical imaging models
     MODEL_NORMALIZATION = 'none'  # Options: 'imagenet', '0-1', '-1-1', 'none'
+    # Fast preprocessing: decode JPEGs at reduced resolution (Image.draft) and
+    # resize with BILINEAR instead of a full decode + LANCZOS resize.
+    # Validate with preprocess_parity.py before enabling.
+    FAST_PREPROCESS = os.environ.get('FAST_PREPROCESS', 'false').lower() == 'true'
+    FAST_PREPROCESS_DRAFT_FACTOR = 2  # Decode to at least this multiple of the input size
+    # 'function': call the model through a warmed-up tf.function (low per-call overhead)
+    # 'predict': use keras Model.predict
+    MODEL_SERVING_MODE = os.environ.get('MODEL_SERVING_MODE', 'function')
+    # Precision of the keras backend: 'float32', 'bfloat16' (bf16 compute, for CPUs
+    # with AVX512-BF16 / AMX) or 'int8' (int8 weights for Dense layers only: the
+    # convolutions, most of this CNN's compute, stay float32, so latency barely
+    # changes; for int8 convolutions serve `export_model.py tflite --quantize int8`).
+    # A reduced precision is only enabled once `python export_model.py calibrate` has
+    # recorded that it stays within these tolerances against float32; otherwise
+    # float32 is used.
+    MODEL_PRECISION = os.environ.get('MODEL_PRECISION', 'float32')
+    PRECISION_MAX_PROBABILITY_DELTA = float(os.environ.get('PRECISION_MAX_PROBABILITY_DELTA', 1.0))  # points
+    PRECISION_MAX_LABEL_FLIPS = int(os.environ.get('PRECISION_MAX_LABEL_FLIPS', 0))
+    
+    # Model registry: the model above is registered as MODEL_NAME. More models can be
+    # loaded next to it from MODEL_DIR, made the default or given a share of the traffic
+    # through the /api/admin/models endpoints. With MODEL_REGISTRY_FILE, the registry
+    # state is kept in that file and applied by every worker.
+    MODEL_NAME = os.environ.get('MODEL_NAME', 'primary')
+    MODEL_DIR = os.environ.get('MODEL_DIR', os.path.dirname(MODEL_PATH))
+    MODEL_REGISTRY_FILE = os.environ.get('MODEL_REGISTRY_FILE')
+    MODEL_REGISTRY_POLL_SECONDS = float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', 5))
+    
+    # Defer loading the model until load_model() is called explicitly.
+    # Set by gunicorn.conf.py so the model is loaded in each worker after fork,
+    # never in the preloading master (the TensorFlow runtime is not fork-safe).
+    DEFER_MODEL_LOAD = os.environ.get('DEFER_MODEL_LOAD', 'false').lower() == 'true'
+    # Load the model in a background thread: the server answers /api/health
+    # immediately and /api/ready turns 200 once the model is loaded
+    BACKGROUND_MODEL_LOAD = os.environ.get('BACKGROUND_MODEL_LOAD', 'false').lower() == 'true'
+    # Run one inference (and Grad-CAM pass) at load time, before reporting ready
+    MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'true').lower() == 'true'
+    
+    # TensorFlow CPU thread pools per process (0 = let TensorFlow decide)
+    TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 0))
+    TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 0))
+    
+    # Dynamic micro-batching of concurrent inference requests
+    # Only useful with a threaded server; adds up to BATCH_MAX_WAIT_MS per request
+    BATCHING_ENABLED = os.environ.get('BATCHING_ENABLED', 'false').lower() == 'true'
+    BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+    BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+    
+    # Grad-CAM heatmaps on /api/analyze: 'async' (prediction returned first, heatmap
+    # polled at /api/analyze/<job_id>/heatmap), 'inline' or 'none'.
+    # Clients can override it per request with ?heatmap=async|inline|none
+    HEATMAP_MODE = os.environ.get('HEATMAP_MODE', 'async')
+    HEATMAP_WORKERS = int(os.environ.get('HEATMAP_WORKERS', 2))
+    HEATMAP_MAX_PENDING = int(os.environ.get('HEATMAP_MAX_PENDING', 32))  # Queued or running jobs
+    HEATMAP_MAX_JOBS = int(os.environ.get('HEATMAP_MAX_JOBS', 128))  # Finished jobs kept for polling
+    HEATMAP_JOB_TTL_SECONDS = int(os.environ.get('HEATMAP_JOB_TTL_SECONDS', 300))
+    HEATMAP_MAX_WAIT_SECONDS = 30  # Longest ?wait= accepted when polling
+    # 'image': render the overlay on the server (processed_image)
+    # 'grid': return the raw heatmap (heatmap_grid) for the client to colorize and blend.
+    # Clients can override it per request with ?heatmap_output=image|grid
+    HEATMAP_OUTPUT = os.environ.get('HEATMAP_OUTPUT', 'image')
+    
+    # Output images (Grad-CAM and border overlays): downscaled to OUTPUT_MAX_DIMENSION
+    # (longest side, 0 = original resolution) and encoded as 'webp', 'jpeg' or 'png'
+    OUTPUT_IMAGE_FORMAT = os.environ.get('OUTPUT_IMAGE_FORMAT', 'webp')
+    OUTPUT_IMAGE_QUALITY = int(os.environ.get('OUTPUT_IMAGE_QUALITY', 80))  # WebP and JPEG
+    OUTPUT_MAX_DIMENSION = int(os.environ.get('OUTPUT_MAX_DIMENSION', 1024))
+    OUTPUT_WEBP_METHOD = 0  # WebP encoder effort, 0 (fastest) to 6 (smallest)
+    # 'inline': processed_image is a data URL in the JSON response
+    # 'url': processed_image_url points to the binary image instead.
+    # Clients can override it per request with ?image_delivery=inline|url
+    OUTPUT_IMAGE_DELIVERY = os.environ.get('OUTPUT_IMAGE_DELIVERY', 'inline')
+    
+    # Test-time augmentation on /api/analyze: number of views (flips, rotations,
+    # crops) scored in one batch and averaged. 1 disables it.
+    # Clients can override it per request with ?tta=<views>
+    TTA_VIEWS = int(os.environ.get('TTA_VIEWS', 1))
+    TTA_CROP_SCALE = 0.9  # Side of the crop views relative to the model input
+    
+    # Batch analysis endpoint (/api/analyze/batch)
+    BATCH_ANALYSIS_SIZE = int(os.environ.get('BATCH_ANALYSIS_SIZE', 16))  # Images per forward pass
+    BATCH_PREPROCESS_WORKERS = int(os.environ.get('BATCH_PREPROCESS_WORKERS', 4))
+    
+    # Result cache for repeated analyses (keyed by image hash + model version)
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+    RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 256))
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 3600))
+    RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')  # On-disk tier, disabled if unset
+    RESULT_CACHE_MAX_DISK_BYTES = int(os.environ.get('RESULT_CACHE_MAX_DISK_BYTES', 1024 * 1024 * 1024))
     
     # API Configuration
     API_HOST = '0.0.0.0'
     API_PORT = 5000
     DEBUG = True
+    # Level of the backend loggers (DEBUG also logs every raw prediction)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    
+    # Metrics: Prometheus text format at /metrics (counters and histograms are per worker process)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    # Add a Server-Timing header with the stage durations to every /api/analyze response.
+    # Clients can also ask for it per request with ?timing=true
+    TIMING_HEADER_ENABLED = os.environ.get('TIMING_HEADER_ENABLED', 'false').lower() == 'true'
+    
+    # Sampling profiler: cProfile a fraction (0-1) of /api/analyze requests into
+    # PROFILE_DIR, keeping the last PROFILE_MAX_FILES. 0 disables it (no overhead)
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'melanox-profiles'))
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+    # Also record a TensorFlow profiler trace of each sampled request (for TensorBoard)
+    PROFILE_TF_TRACE = os.environ.get('PROFILE_TF_TRACE', 'false').lower() == 'true'
+    # Token for the /api/admin endpoints (Authorization: Bearer <token>); disabled if unset
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
     
     # CORS Configuration - Updated for production
     CORS_ORIGINS = [
@@ -28,9 +148,19 @@ class Config:
     
     # Image Processing Configuration
     MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB max file size
+    MAX_IMAGE_PIXELS = 50_000_000  # Max width * height, checked from the header before decoding
+    # Max request body, enforced by Flask before the body is read (base64 adds ~33%)
+    MAX_REQUEST_SIZE = MAX_IMAGE_SIZE * 4 // 3 + 64 * 1024
+    MAX_BATCH_REQUEST_SIZE = int(os.environ.get('MAX_BATCH_REQUEST_SIZE', 1024 * 1024 * 1024))
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     
     # Computer Vision Parameters
+    # ABCDE analysis runs on a copy downscaled to this longest side (pixel metrics
+    # are reported at the original resolution)
+    ANALYSIS_MAX_DIMENSION = int(os.environ.get('ANALYSIS_MAX_DIMENSION', 1024))
+    # Run the ABCDE analysis on /api/analyze, in parallel with model inference
+    ABCDE_ANALYSIS_ENABLED = os.environ.get('ABCDE_ANALYSIS_ENABLED', 'true').lower() == 'true'
+    ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 4))
     PIXEL_TO_MM_RATIO = 0.1  # Approximate conversion (adjust based on image source)
     MIN_LESION_AREA = 100  # Minimum contour area to consider as lesion
     BORDER_THICKNESS = 3  # Thickness of border overlay in pixels
@@ -43,6 +173,18 @@ class Config:
     ASYMMETRY_THRESHOLD = 0.15  # Threshold for asymmetry detection
     BORDER_IRREGULARITY_THRESHOLD = 0.25  # Threshold for irregular borders
     COLOR_VARIANCE_THRESHOLD = 30  # Threshold for color variation
+    # Clinical lesion colors for the palette (name: (label, reference RGB)).
+    # Lesion pixels are assigned to the nearest one in CIELAB.
+    LESION_COLOR_PALETTE = {
+        'light_brown': ('Marrón claro', (166, 110, 74)),
+        'dark_brown': ('Marrón oscuro', (78, 46, 30)),
+        'black': ('Negro', (26, 22, 22)),
+        'blue_gray': ('Azul grisáceo', (104, 118, 140)),
+        'red': ('Rojo', (172, 48, 52)),
+        'white': ('Blanco', (228, 222, 218)),
+    }
+    COLOR_SAMPLE_SIZE = 4096  # Max lesion pixels sampled for the palette
+    COLOR_MIN_PROPORTION = 0.05  # Palette colors below this share are not reported
     DIAMETER_WARNING_MM = 6.0  # Warning threshold in millimeters
     
     @staticmethod
@@ -0,0 +1,392 @@
+"""
+Export the Keras .h5 model to TFLite / ONNX and compare the inference backends
+
+Usage:
+    python export_model.py tflite [--quantize none|dynamic|float16|int8] [--calibration-dir DIR]
+    python export_model.py onnx [--opset 13]
+    python export_model.py compare [--images DIR] [--iterations 50] [--report report.json]
+    python export_model.py calibrate [--precision bfloat16 int8] [--images DIR]
+
+The compare command loads every exported model next to the Keras one, checks
+output parity on reference images (label flips, probability delta) and reports
+latency and memory per backend. Serve an exported model with
+INFERENCE_BACKEND=tflite or INFERENCE_BACKEND=onnx.
+
+The calibrate command measures the reduced MODEL_PRECISION modes of the Keras
+model against float32 the same way, checks that Grad-CAM still works, and
+records the results next to the model (<model>.precision.json). The API only
+enables a MODEL_PRECISION whose recorded results are within the tolerances.
+"""
+import argparse
+import gc
+import glob
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from benchmark import summarize, time_calls
+from preprocess_parity import make_synthetic_lesion, SYNTHETIC_RESOLUTIONS
+
+# Parity tolerances against the Keras float32 outputs
+MAX_PROBABILITY_DELTA = 1.0  # percentage points
+MAX_LABEL_FLIPS = 0
+
+
+def load_reference_images(image_dir=None, limit=64):
+    """Preprocess reference images (a directory or synthetic lesions) into one batch"""
+    from model_loader import ModelLoader
+
+    # Preprocessing does not need a loaded model
+    Config.DEFER_MODEL_LOAD = True
+    model_loader = ModelLoader()
+
+    if image_dir:
+        paths = sorted(
+            p for ext in ('jpg', 'jpeg', 'png')
+            for p in glob.glob(os.path.join(image_dir, f'*.{ext}'))
+        )[:limit]
+        images = [Image.open(path) for path in paths]
+    else:
+        images = [
+            Image.open(BytesIO(make_synthetic_lesion(width, height, seed=seed)))
+            for seed in range(4)
+            for width, height in SYNTHETIC_RESOLUTIONS[:2]
+        ]
+
+    if not images:
+        raise ValueError(f"No images found in {image_dir}")
+
+    return np.concatenate([model_loader.preprocess_image(image) for image in images], axis=0)
+
+
+def export_tflite(model, output_path, quantize='none', calibration=None):
+    """
+    Convert the Keras model to TFLite
+
+    Args:
+        quantize: 'none', 'dynamic' (int8 weights), 'float16' (fp16 weights)
+            or 'int8' (int8 weights and activations, float input/output)
+        calibration: preprocessed batch used as representative dataset for int8
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if quantize in ('dynamic', 'float16', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    if quantize == 'int8':
+        if calibration is None:
+            raise ValueError("int8 quantization needs calibration images")
+
+        def representative_dataset():
+            for img_array in calibration:
+                yield [img_array[np.newaxis].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, output_path, opset=13):
+    """Convert the Keras model to ONNX (requires tf2onnx)"""
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("ONNX export requires: pip install tf2onnx onnx")
+
+    width, height = Config.MODEL_INPUT_SIZE
+    serving_fn = tf.function(lambda img_array: model(img_array, training=False))
+    tf2onnx.convert.from_function(
+        serving_fn,
+        input_signature=[tf.TensorSpec((None, height, width, 3), tf.float32, name='input')],
+        opset=opset,
+        output_path=output_path
+    )
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux), or None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def compare_backends(images, iterations, warmup):
+    """Compare every available backend against the Keras float32 outputs"""
+    from model_loader import create_backend
+
+    report = {}
+    reference = None
+
+    for name in ('keras', 'tflite', 'onnx'):
+        gc.collect()
+        rss_before = current_rss_mb()
+        try:
+            backend = create_backend(name)
+        except (FileNotFoundError, ImportError) as e:
+            report[name] = {'available': False, 'reason': str(e)}
+            continue
+        rss_after = current_rss_mb()
+
+        outputs = np.concatenate([backend.run(images[i:i + 1]) for i in range(len(images))])
+        malignant = outputs[:, -1] * 100.0
+
+        entry = {
+            'available': True,
+            'model_path': backend.model_path,
+            'model_size_mb': round(os.path.getsize(backend.model_path) / (1024 * 1024), 2),
+            'load_rss_mb': round(rss_after - rss_before, 1) if rss_before is not None else None,
+            'latency': summarize(time_calls(lambda: backend.run(images[:1]), iterations, warmup))
+        }
+
+        if reference is None:
+            reference = malignant
+        else:
+            delta = np.abs(malignant - reference)
+            flips = int(np.sum((malignant > 50.0) != (reference > 50.0)))
+            entry['parity'] = {
+                'max_probability_delta': round(float(delta.max()), 4),
+                'mean_probability_delta': round(float(delta.mean()), 4),
+                'label_flips': flips,
+                'passed': bool(delta.max() <= MAX_PROBABILITY_DELTA and flips <= MAX_LABEL_FLIPS)
+            }
+
+        report[name] = entry
+        del backend
+
+    return report
+
+
+def run_in_batches(backend, images, batch_size=16):
+    return np.concatenate([backend.run(images[i:i + batch_size])
+                           for i in range(0, len(images), batch_size)])
+
+
+def check_gradcam(model, images, reference_heatmap=None):
+    """
+    Compute the Grad-CAM heatmap of the first reference image
+
+    Returns:
+        (heatmap or None, dict with gradcam_ok, and gradcam_max_delta against
+        reference_heatmap or gradcam_error)
+    """
+    from gradcam import GradCamEngine
+
+    try:
+        heatmap = np.asarray(GradCamEngine(model).heatmap(images[:1]), dtype=np.float32)
+    except Exception as e:
+        return None, {'gradcam_ok': False, 'gradcam_error': str(e)}
+
+    if reference_heatmap is None:
+        return heatmap, {'gradcam_ok': True}
+    # Flat heatmaps are NaN (0/0) in float32 too: those must match, not be finite
+    finite = np.isfinite(reference_heatmap)
+    if heatmap.shape != reference_heatmap.shape or not np.array_equal(np.isfinite(heatmap), finite):
+        return heatmap, {'gradcam_ok': False, 'gradcam_error': 'heatmap differs in shape or is not finite'}
+    delta = np.abs(heatmap - reference_heatmap)[finite]
+    return heatmap, {'gradcam_ok': True, 'gradcam_max_delta': round(float(delta.max()), 4) if delta.size else None}
+
+
+def calibrate_precisions(model_path, images, precisions, iterations, warmup,
+                         max_probability_delta, max_label_flips):
+    """Measure each reduced precision against the Keras float32 outputs"""
+    from model_loader import create_backend
+    from precision import int8_weight_share, measure_agreement, within_tolerance
+
+    backend = create_backend('keras', model_path)
+    reference = run_in_batches(backend, images)
+    reference_heatmap, _ = check_gradcam(backend.model, images)
+    report = {'float32': {
+        'latency': summarize(time_calls(lambda: backend.run(images[:1]), iterations, warmup))
+    }}
+    weight_share = int8_weight_share(backend.model)
+    del backend
+
+    for precision in precisions:
+        gc.collect()
+        backend = create_backend('keras', model_path, precision)
+        entry = measure_agreement(reference, run_in_batches(backend, images))
+        _, gradcam_entry = check_gradcam(backend.model, images, reference_heatmap)
+        entry.update(gradcam_entry)
+        entry['latency'] = summarize(time_calls(lambda: backend.run(images[:1]), iterations, warmup))
+        entry['passed'] = bool(entry['gradcam_ok'] and within_tolerance(
+            entry, max_probability_delta, max_label_flips))
+        if precision == 'int8':
+            # Only Dense/EinsumDense weights are quantized; convolutions stay float32
+            entry['int8_weight_share'] = round(weight_share, 4)
+        report[precision] = entry
+        del backend
+
+    return report
+
+
+def write_precision_record(model_path, report, n_images, image_dir, max_probability_delta, max_label_flips):
+    """Record the calibration next to the model, keeping other precisions of the same file"""
+    from model_loader import model_file_version
+    from precision import read_calibration, write_calibration
+
+    model_version = model_file_version(model_path)
+    previous = read_calibration(model_path) or {}
+    precisions = previous.get('precisions', {}) if previous.get('model_version') == model_version else {}
+    precisions.update({name: entry for name, entry in report.items() if name != 'float32'})
+
+    return write_calibration(model_path, {
+        'model_version': model_version,
+        'calibrated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'reference_images': n_images,
+        'image_dir': image_dir,
+        'tolerance': {'max_probability_delta': max_probability_delta, 'max_label_flips': max_label_flips},
+        'precisions': precisions
+    })
+
+
+def print_precision_report(report, n_images):
+    """Print the precision calibration table"""
+    print(f"\n{'='*78}")
+    print(f"Precision calibration on {n_images} reference images (batch of 1 latency)")
+    print(f"{'='*78}")
+    print(f"{'precision':<11}{'p50 ms':>9}{'p95 ms':>9}{'max dprob':>11}{'flips':>7}"
+          f"{'gradcam':>9}  result")
+    for name, entry in report.items():
+        if name == 'float32':
+            print(f"{name:<11}{entry['latency']['p50_ms']:>9.2f}{entry['latency']['p95_ms']:>9.2f}"
+                  f"{0.0:>11.3f}{0:>7}{'OK':>9}  reference")
+            continue
+        print(f"{name:<11}{entry['latency']['p50_ms']:>9.2f}{entry['latency']['p95_ms']:>9.2f}"
+              f"{entry['max_probability_delta']:>11.3f}{entry['label_flips']:>7}"
+              f"{'OK' if entry['gradcam_ok'] else 'FAIL':>9}"
+              f"  {'OK' if entry['passed'] else 'FAIL (will not be enabled)'}")
+    if 'int8' in report:
+        print(f"int8 quantizes only the Dense/EinsumDense layers: "
+              f"{100 * report['int8']['int8_weight_share']:.1f}% of the parameters. Convolutions stay")
+        print("float32; for int8 convolutions export a full-integer TFLite model instead")
+        print("(python export_model.py tflite --quantize int8, served without Grad-CAM).")
+    print(f"{'='*78}\n")
+
+
+def print_report(report, n_images):
+    """Print the backend comparison table"""
+    print(f"\n{'='*78}")
+    print(f"Backend comparison on {n_images} reference images (batch of 1 latency)")
+    print(f"{'='*78}")
+    print(f"{'backend':<9}{'size MB':>9}{'load RSS':>10}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'max dprob':>11}{'flips':>7}  parity")
+    for name, entry in report.items():
+        if not entry['available']:
+            print(f"{name:<9}  not available: {entry['reason']}")
+            continue
+        parity = entry.get('parity')
+        load_rss = entry['load_rss_mb'] if entry['load_rss_mb'] is not None else float('nan')
+        print(f"{name:<9}{entry['model_size_mb']:>9.2f}{load_rss:>10.1f}"
+              f"{entry['latency']['p50_ms']:>9.2f}{entry['latency']['p95_ms']:>9.2f}"
+              f"{(parity['max_probability_delta'] if parity else 0.0):>11.3f}"
+              f"{(parity['label_flips'] if parity else 0):>7}"
+              f"  {'reference' if parity is None else ('OK' if parity['passed'] else 'FAIL')}")
+    print(f"{'='*78}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the model to TFLite/ONNX and compare backends')
+    parser.add_argument('--model', help='Path to the .h5 model (defaults to Config.MODEL_PATH)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    tflite_parser = subparsers.add_parser('tflite', help='Export to TFLite')
+    tflite_parser.add_argument('--quantize', choices=['none', 'dynamic', 'float16', 'int8'], default='none')
+    tflite_parser.add_argument('--calibration-dir', help='Images for int8 calibration (default: synthetic)')
+    tflite_parser.add_argument('--output', help='Output path (defaults to Config.TFLITE_MODEL_PATH)')
+
+    onnx_parser = subparsers.add_parser('onnx', help='Export to ONNX')
+    onnx_parser.add_argument('--opset', type=int, default=13)
+    onnx_parser.add_argument('--output', help='Output path (defaults to Config.ONNX_MODEL_PATH)')
+
+    compare_parser = subparsers.add_parser('compare', help='Parity and latency/memory report')
+    compare_parser.add_argument('--images', help='Reference images directory (default: synthetic)')
+    compare_parser.add_argument('--iterations', type=int, default=50)
+    compare_parser.add_argument('--warmup', type=int, default=5)
+    compare_parser.add_argument('--report', help='Also write the report as JSON to this path')
+
+    calibrate_parser = subparsers.add_parser('calibrate', help='Validate MODEL_PRECISION modes against float32')
+    calibrate_parser.add_argument('--precision', nargs='+', choices=['bfloat16', 'int8'],
+                                  default=['bfloat16', 'int8'])
+    calibrate_parser.add_argument('--images', help='Reference images directory (default: synthetic)')
+    calibrate_parser.add_argument('--limit', type=int, default=500, help='Reference images used')
+    calibrate_parser.add_argument('--max-probability-delta', type=float,
+                                  default=Config.PRECISION_MAX_PROBABILITY_DELTA,
+                                  help='Tolerance in percentage points')
+    calibrate_parser.add_argument('--max-label-flips', type=int, default=Config.PRECISION_MAX_LABEL_FLIPS)
+    calibrate_parser.add_argument('--iterations', type=int, default=50)
+    calibrate_parser.add_argument('--warmup', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.model:
+        Config.MODEL_PATH = args.model
+        Config.TFLITE_MODEL_PATH = os.path.splitext(args.model)[0] + '.tflite'
+        Config.ONNX_MODEL_PATH = os.path.splitext(args.model)[0] + '.onnx'
+
+    if args.command == 'compare':
+        images = load_reference_images(args.images)
+        report = compare_backends(images, args.iterations, args.warmup)
+        print_report(report, len(images))
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+        failed = any(not e.get('parity', {}).get('passed', True) for e in report.values())
+        sys.exit(1 if failed else 0)
+
+    if args.command == 'calibrate':
+        if not args.images:
+            print("Warning: calibrating on synthetic images; pass --images with real lesions")
+        images = load_reference_images(args.images, limit=args.limit)
+        report = calibrate_precisions(
+            Config.MODEL_PATH, images, args.precision, args.iterations, args.warmup,
+            args.max_probability_delta, args.max_label_flips
+        )
+        print_precision_report(report, len(images))
+        path = write_precision_record(
+            Config.MODEL_PATH, report, len(images), args.images,
+            args.max_probability_delta, args.max_label_flips
+        )
+        print(f"Calibration recorded: {path}")
+        passed = [name for name, entry in report.items() if entry.get('passed')]
+        if passed:
+            print(f"Enable with MODEL_PRECISION={passed[0]}")
+        sys.exit(0 if len(passed) == len(args.precision) else 1)
+
+    from tensorflow import keras
+
+    print(f"Loading model: {Config.MODEL_PATH}")
+    model = keras.models.load_model(Config.MODEL_PATH)
+
+    if args.command == 'tflite':
+        output_path = args.output or Config.TFLITE_MODEL_PATH
+        calibration = None
+        if args.quantize == 'int8':
+            calibration = load_reference_images(args.calibration_dir, limit=200)
+        export_tflite(model, output_path, args.quantize, calibration)
+    else:
+        output_path = args.output or Config.ONNX_MODEL_PATH
+        export_onnx(model, output_path, args.opset)
+
+    print(f"Exported: {output_path} ({os.path.getsize(output_path) / (1024 * 1024):.2f} MB)")
+    print("Check parity with: python export_model.py compare")
+
+
+if __name__ == '__main__':
+    main()
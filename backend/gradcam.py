@@ -1,9 +1,9 @@
 import numpy as np
 import tensorflow as tf
 import cv2
-from io import BytesIO
 from PIL import Image
-import base64
+from image_encoding import fit_to_max_dimension, encode_image, to_data_url
+from metrics import stage
 
 def get_last_conv_layer_name(model):
     """
@@ -24,75 +24,150 @@ def get_last_conv_layer_name(model):
     # Fallback para modelos comunes si no se encuentra explícitamente
     return None
 
+def build_grad_model(model, last_conv_layer_name):
+    """
+    Crea el sub-modelo que mapea input -> (activaciones de la última capa
+    convolucional, predicciones).
+    """
+    return tf.keras.models.Model(
+        model.inputs,
+        [model.get_layer(last_conv_layer_name).output, model.output]
+    )
+
+def class_channel_for(preds, pred_index=None):
+    """
+    Selecciona la salida respecto a la cual se derivan los gradientes.
+    """
+    # Dependiendo de si la salida es sigmoide (1 nodo) o softmax (>1 nodo)
+    if preds.shape[-1] == 1:
+        return preds[:, 0]
+    if pred_index is None:
+        # Clase predicha de cada imagen del batch
+        return tf.reduce_max(preds, axis=-1)
+    return preds[:, pred_index]
+
+class GradCamEngine:
+    """
+    Motor Grad-CAM construido una sola vez al cargar el modelo.
+
+    Resuelve la última capa convolucional, crea el sub-modelo de gradientes y
+    envuelve el paso hacia adelante + gradientes en un tf.function con firma
+    fija, de modo que no se reconstruye ni se retraza en cada petición.
+    """
+
+    def __init__(self, model, last_conv_layer_name=None):
+        if last_conv_layer_name is None:
+            last_conv_layer_name = get_last_conv_layer_name(model)
+        if last_conv_layer_name is None:
+            raise ValueError("No se encontró una capa convolucional para Grad-CAM")
+
+        self.last_conv_layer_name = last_conv_layer_name
+        self.grad_model = build_grad_model(model, last_conv_layer_name)
+
+        input_shape = tuple(model.input_shape)
+        self._compute = tf.function(
+            self._forward_with_gradients,
+            input_signature=[tf.TensorSpec((None,) + input_shape[1:], tf.float32)]
+        )
+        # Trazar el grafo ahora para que la primera petición no pague ese costo
+        self._compute.get_concrete_function()
+
+    def _forward_with_gradients(self, img_array):
+        with tf.GradientTape() as tape:
+            conv_output, preds = self.grad_model(img_array, training=False)
+            class_channel = class_channel_for(preds)
+        grads = tape.gradient(class_channel, conv_output)
+        return preds, conv_output, grads
+
+    def compute(self, img_array):
+        """
+        Ejecuta un único paso hacia adelante con gradientes.
+
+        Retorna (predicciones, activaciones, gradientes) como arrays numpy.
+        """
+        preds, conv_output, grads = self._compute(tf.convert_to_tensor(img_array, tf.float32))
+        return preds.numpy(), conv_output.numpy(), grads.numpy()
+
+    def heatmap(self, img_array):
+        """
+        Genera el heatmap Grad-CAM de la primera imagen del batch.
+        """
+        _, conv_output, grads = self.compute(img_array)
+        return heatmap_from_gradients(conv_output[0], grads[0])
+
 def make_gradcam_heatmap(img_array, model, last_conv_layer_name, pred_index=None):
     """
     Genera el mapa de calor Grad-CAM para una imagen y modelo dados.
     """
     # 1. Crear modelo que mapee input -> (activaciones, predicciones)
-    grad_model = tf.keras.models.Model(
-        [model.inputs],
-        [model.get_layer(last_conv_layer_name).output, model.output]
-    )
+    grad_model = build_grad_model(model, last_conv_layer_name)
 
     # 2. Registrar operaciones para calcular gradientes
     with tf.GradientTape() as tape:
         last_conv_layer_output, preds = grad_model(img_array)
-        if pred_index is None:
-            pred_index = tf.argmax(preds[0])
-        
-        # Dependiendo de si la salida es sigmoide (1 nodo) o softmax (>1 nodo)
-        if preds.shape[-1] == 1:
-            class_channel = preds[:, 0]
-        else:
-            class_channel = preds[:, pred_index]
+        class_channel = class_channel_for(preds, pred_index)
 
     # 3. Calcular gradientes de la clase predicha respecto a los mapas de características
     grads = tape.gradient(class_channel, last_conv_layer_output)
 
+    return heatmap_from_gradients(last_conv_layer_output[0], grads[0])
+
+def heatmap_from_gradients(conv_output, grads):
+    """
+    Construye el heatmap Grad-CAM a partir de las activaciones de la última
+    capa convolucional y sus gradientes para una sola imagen (sin dimensión de batch).
+    """
+    # Con MODEL_PRECISION='bfloat16' llegan en bf16: el heatmap se calcula en float32
+    conv_output = tf.cast(conv_output, tf.float32)
+    grads = tf.cast(grads, tf.float32)
+
     # 4. Global Average Pooling de los gradientes
-    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+    pooled_grads = tf.reduce_mean(grads, axis=(0, 1))
 
     # 5. Multiplicar cada canal por su "importancia" (gradiente promedio)
-    last_conv_layer_output = last_conv_layer_output[0]
-    heatmap = last_conv_layer_output @ pooled_grads[..., tf.newaxis]
+    heatmap = conv_output @ pooled_grads[..., tf.newaxis]
     heatmap = tf.squeeze(heatmap)
 
     # 6. Normalizar el heatmap entre 0 y 1
     heatmap = tf.maximum(heatmap, 0) / tf.math.reduce_max(heatmap)
     return heatmap.numpy()
 
-def save_and_display_gradcam(img_pil, heatmap, alpha=0.4):
+def save_and_display_gradcam(img_pil, heatmap, alpha=0.4, max_dimension=None,
+                             image_format=None, quality=None):
     """
-    Superpone el heatmap sobre la imagen original y retorna la imagen resultante en base64.
+    Superpone el heatmap sobre la imagen original y retorna la imagen resultante
+    como data URL, con los ajustes de salida de image_encoding (dimensión máxima,
+    formato y calidad; por defecto los de Config).
     """
-    # Convertir PIL a array
-    img = np.array(img_pil)
-    
-    # Rescalar heatmap al tamaño de la imagen original
-    heatmap = np.uint8(255 * heatmap)
-    
-    # Usar mapa de colores JET
-    jet = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-    
-    # Convertir a RGB (OpenCV usa BGR por defecto)
-    jet = cv2.cvtColor(jet, cv2.COLOR_BGR2RGB)
-    
-    # Redimensionar jet a las dimensiones de la imagen
-    jet = cv2.resize(jet, (img.shape[1], img.shape[0]))
-    
-    # Superponer
-    superimposed_img = jet * alpha + img * (1 - alpha)
-    superimposed_img = np.uint8(superimposed_img)
-    
-    # Convertir de nuevo a PIL para facilitar conversión a base64
-    result_img = Image.fromarray(superimposed_img)
-    
-    # Convertir a base64 string
-    buffered = BytesIO()
-    result_img.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    with stage('overlay'):
+        # Reducir primero la imagen: el heatmap, la mezcla y la codificación
+        # trabajan sobre la resolución de salida y no sobre la original
+        img_pil = fit_to_max_dimension(img_pil, max_dimension)
+        if img_pil.mode != 'RGB':
+            img_pil = img_pil.convert('RGB')
+        
+        # Convertir PIL a array
+        img = np.asarray(img_pil)
+        
+        # Rescalar heatmap a 0-255
+        heatmap = np.uint8(255 * heatmap)
+        
+        # Usar mapa de colores JET
+        jet = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+        
+        # Convertir a RGB (OpenCV usa BGR por defecto)
+        jet = cv2.cvtColor(jet, cv2.COLOR_BGR2RGB)
+        
+        # Redimensionar jet a las dimensiones de la imagen
+        jet = cv2.resize(jet, (img.shape[1], img.shape[0]))
+        
+        # Superponer (en uint8, sin pasar por arrays float)
+        superimposed_img = cv2.addWeighted(jet, alpha, img, 1 - alpha, 0)
+        
+        result_img = Image.fromarray(superimposed_img)
     
-    # Agregar prefijo Data URL para compatibilidad con frontend y almacenamiento
-    img_data_url = f"data:image/jpeg;base64,{img_str}"
+    # Codificar y agregar prefijo Data URL para compatibilidad con frontend y almacenamiento
+    with stage('encode'):
+        img_data_url = to_data_url(*encode_image(result_img, image_format, quality))
     
     return img_data_url, result_img
@@ -0,0 +1,97 @@
+"""
+Gunicorn configuration for production serving
+Run with: gunicorn -c gunicorn.conf.py api:app
+
+The master preloads the app (Flask, config) and imports TensorFlow and Keras
+once, then forks workers that share those pages copy-on-write. The TensorFlow
+runtime is not fork-safe once its thread pools exist, but importing it does
+not start them, so each worker creates its model right after fork, with
+thread pools sized for the worker count. By default each worker does so in a
+background thread and serves /api/health right away; /api/ready returns 503
+until the model is loaded and warmed up, so point the load balancer health
+check at /api/ready.
+
+Model memory per worker depends on the backend:
+    - keras: every worker loads the .h5 file into its own TensorFlow
+      variables. The weights cannot be shared between processes, so each
+      worker holds a full copy.
+    - tflite: the master reads the .tflite file once before forking and the
+      workers run their interpreters on that buffer. With TFLITE_XNNPACK=false
+      the weights are shared copy-on-write and a worker only adds its
+      activation memory; with XNNPACK on (the default, about 2x faster for
+      float models) every worker repacks the weights into a private copy.
+    - onnx: every worker's session holds its own copy of the weights.
+
+Choosing the worker count (WEB_CONCURRENCY):
+    - Each worker runs one forward pass at a time using TF_INTRA_OP_THREADS
+      cores. Keep WEB_CONCURRENCY * TF_INTRA_OP_THREADS <= CPU cores.
+    - Fewer workers with more threads each give lower single-request latency;
+      more workers with fewer threads each give higher throughput.
+    - Keep WEB_CONCURRENCY * (RSS per worker) below the instance RAM; unless
+      the tflite weights are shared, the RSS per worker includes the weights.
+    - Default: one worker per 2 cores, with the cores split evenly.
+"""
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+workers = int(os.environ.get('WEB_CONCURRENCY', max(1, cpu_count // 2)))
+
+# Thread pool sizes for each worker, read by Config when the app is imported
+os.environ.setdefault('TF_INTRA_OP_THREADS', str(max(1, cpu_count // workers)))
+os.environ.setdefault('TF_INTER_OP_THREADS', '1')
+
+# Load the model in the workers, never in the preloading master
+os.environ.setdefault('DEFER_MODEL_LOAD', 'true')
+# ...in a background thread, so workers answer health checks while loading
+os.environ.setdefault('BACKGROUND_MODEL_LOAD', 'true')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+preload_app = True
+
+# A few threads per worker keep requests flowing while one waits on inference
+# (and give the micro-batching scheduler something to batch when enabled)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Allow a slow first boot when the model is loaded synchronously after fork
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    """
+    Import TensorFlow and read the model file (tflite backend only) in the
+    master, before the workers fork
+    """
+    from model_loader import ModelLoader
+
+    try:
+        ModelLoader.import_tensorflow()
+    except ImportError:
+        # Slim tflite / onnx installs without TensorFlow
+        server.log.info("TensorFlow not installed, not imported in the master")
+    if ModelLoader().preload_model_file():
+        server.log.info("Model file preloaded in the master, shared by the workers")
+
+
+def post_fork(server, worker):
+    """Initialize TensorFlow and load the model inside the freshly forked worker"""
+    from config import Config
+    from model_loader import ModelLoader
+    from api import model_registry
+
+    model_loader = ModelLoader()
+    threads = (f"intra_op={os.environ['TF_INTRA_OP_THREADS']}, "
+               f"inter_op={os.environ['TF_INTER_OP_THREADS']}")
+
+    if Config.BACKGROUND_MODEL_LOAD:
+        model_loader.start_background_load()
+        server.log.info(f"Worker {worker.pid}: loading model in the background ({threads})")
+    else:
+        model_loader.load_model()
+        server.log.info(f"Worker {worker.pid}: model loaded ({threads})")
+
+    # Models registered through the admin endpoints (MODEL_REGISTRY_FILE)
+    model_registry.start()
@@ -0,0 +1,165 @@
+"""
+Heatmap Jobs Module - Background Grad-CAM rendering with result polling
+Bounded worker pool plus an in-process table of job results with a TTL
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class HeatmapJobs:
+    """
+    Runs heatmap jobs on a bounded thread pool and keeps their results for polling
+
+    Jobs are identified by a caller-chosen id. Submitting an id that is pending
+    or done reuses that job, so concurrent analyses of the same image render
+    one heatmap. At most max_pending jobs are queued or running; beyond that
+    submit() refuses new jobs instead of growing the backlog. Finished jobs are
+    kept for ttl_seconds, and at most max_jobs of them are kept.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, max_jobs=128, ttl_seconds=300):
+        """
+        Initialize the job pool
+
+        Args:
+            max_workers: threads rendering heatmaps
+            max_pending: maximum jobs queued or running at once
+            max_jobs: maximum finished jobs kept for polling
+            ttl_seconds: how long a finished job can be polled
+        """
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='heatmap')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job id -> job dict
+        self._pending = 0
+        self._stats = {'submitted': 0, 'reused': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, job_id, fn, *args, on_skip=None):
+        """
+        Run fn(*args) in the background under job_id
+
+        Args:
+            on_skip: called when fn will not run (an equivalent job exists or
+                the pool is full), e.g. to release what was acquired for it
+
+        Returns:
+            True if the job is queued (or an equivalent job exists), False if
+            the pool is at max_pending
+        """
+        job = None
+        with self._lock:
+            self._expire(time.time())
+
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing['status'] != 'failed':
+                self._stats['reused'] += 1
+                queued = True
+            elif self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                queued = False
+            else:
+                job = {'status': 'pending', 'result': None, 'error': None,
+                       'expires_at': None, 'finished': threading.Event()}
+                self._jobs[job_id] = job
+                self._pending += 1
+                self._stats['submitted'] += 1
+                queued = True
+
+        if job is None:
+            if on_skip is not None:
+                on_skip()
+            return queued
+
+        self._executor.submit(self._run, job, fn, args)
+        return True
+
+    def put(self, job_id, result):
+        """
+        Store an already computed result under job_id, as a finished job
+
+        Used for heatmaps rendered inline that are served as a separate resource.
+        A pending job with the same id is left to finish on its own.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+
+            job = self._jobs.get(job_id)
+            if job is not None and job['status'] == 'pending':
+                return
+
+            finished = threading.Event()
+            finished.set()
+            self._jobs.pop(job_id, None)
+            self._jobs[job_id] = {'status': 'done', 'result': result, 'error': None,
+                                  'expires_at': now + self.ttl_seconds, 'finished': finished}
+            self._evict()
+
+    def get(self, job_id, wait=0):
+        """
+        Get the state of a job
+
+        Args:
+            job_id: id given to submit()
+            wait: seconds to wait for a pending job to finish
+
+        Returns:
+            dict with status ('pending', 'done' or 'failed'), result and error,
+            or None if the job is unknown or expired
+        """
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        if wait > 0:
+            job['finished'].wait(wait)
+
+        with self._lock:
+            return {'status': job['status'], 'result': job['result'], 'error': job['error']}
+
+    def get_stats(self):
+        """Get job counters and the current backlog"""
+        with self._lock:
+            return {
+                **self._stats,
+                'pending': self._pending,
+                'jobs': len(self._jobs),
+                'max_pending': self.max_pending
+            }
+
+    def _run(self, job, fn, args):
+        try:
+            result, error, status = fn(*args), None, 'done'
+        except Exception as e:
+            logger.exception("Error rendering heatmap")
+            result, error, status = None, str(e), 'failed'
+
+        with self._lock:
+            job.update(status=status, result=result, error=error,
+                       expires_at=time.time() + self.ttl_seconds)
+            self._pending -= 1
+            self._stats['completed' if status == 'done' else 'failed'] += 1
+            self._evict()
+        job['finished'].set()
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['expires_at'] is not None and job['expires_at'] <= now]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _evict(self):
+        """Drop the oldest finished jobs while over max_jobs (pending jobs are kept)"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['expires_at'] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_jobs)]:
+            del self._jobs[job_id]
@@ -0,0 +1,126 @@
+"""
+Image Encoding Module - Encoding the output images of the API (Grad-CAM and border overlays)
+Caps the image dimension and encodes it as WebP, JPEG or PNG, inline (data URL) or as raw bytes,
+and packs raw Grad-CAM heatmaps for client-side rendering
+"""
+import base64
+import binascii
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from config import Config
+
+# Output format name -> (PIL format, MIME type)
+OUTPUT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+
+# How processed images are returned: inline data URL or a URL to the binary image
+IMAGE_DELIVERY_MODES = ('inline', 'url')
+
+
+def fit_to_max_dimension(image, max_dimension=None):
+    """
+    Downscale a PIL image so its longest side is at most max_dimension
+
+    Args:
+        image: PIL Image
+        max_dimension: longest side in pixels (default Config.OUTPUT_MAX_DIMENSION, 0 = no limit)
+
+    Returns:
+        the image itself if it already fits, otherwise a resized copy
+    """
+    if max_dimension is None:
+        max_dimension = Config.OUTPUT_MAX_DIMENSION
+
+    width, height = image.size
+    if not max_dimension or max(width, height) <= max_dimension:
+        return image
+
+    scale = max_dimension / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return image.resize(size, Image.BILINEAR, reducing_gap=1.0)
+
+
+def encode_image(image, image_format=None, quality=None):
+    """
+    Encode a PIL image
+
+    Args:
+        image: PIL Image (RGB)
+        image_format: 'webp', 'jpeg' or 'png' (default Config.OUTPUT_IMAGE_FORMAT)
+        quality: 1-100 for WebP and JPEG (default Config.OUTPUT_IMAGE_QUALITY)
+
+    Returns:
+        tuple of (encoded bytes, MIME type)
+    """
+    image_format = image_format or Config.OUTPUT_IMAGE_FORMAT
+    quality = quality or Config.OUTPUT_IMAGE_QUALITY
+    if image_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output image format: {image_format}")
+
+    pil_format, mime_type = OUTPUT_FORMATS[image_format]
+    if pil_format == 'WEBP':
+        options = {'quality': quality, 'method': Config.OUTPUT_WEBP_METHOD}
+    elif pil_format == 'JPEG':
+        options = {'quality': quality}
+    else:
+        options = {'compress_level': 1}
+
+    buffered = BytesIO()
+    image.save(buffered, format=pil_format, **options)
+    return buffered.getvalue(), mime_type
+
+
+def to_data_url(data, mime_type):
+    """Wrap encoded image bytes in a data URL"""
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def from_data_url(data_url):
+    """
+    Split a data URL produced by to_data_url
+
+    Returns:
+        tuple of (encoded bytes, MIME type)
+    """
+    header, _, payload = data_url.partition(',')
+    if not header.startswith('data:') or not header.endswith(';base64'):
+        raise ValueError('Not a base64 data URL')
+    try:
+        return base64.b64decode(payload, validate=True), header[len('data:'):-len(';base64')]
+    except binascii.Error as e:
+        raise ValueError('Invalid base64 data') from e
+
+
+def encode_data_url(image, max_dimension=None, image_format=None, quality=None):
+    """
+    Downscale and encode a PIL image as a data URL with the output settings
+
+    Returns:
+        the image as a data URL string
+    """
+    image = fit_to_max_dimension(image, max_dimension)
+    return to_data_url(*encode_image(image, image_format, quality))
+
+
+def encode_heatmap_grid(heatmap):
+    """
+    Quantize a normalized Grad-CAM heatmap for client-side compositing
+
+    Args:
+        heatmap: 2D array with values in 0-1, at the last conv layer resolution
+
+    Returns:
+        dict with shape ([rows, cols]), dtype ('uint8') and data, the row-major
+        values 0-255 as base64
+    """
+    grid = np.atleast_2d(np.nan_to_num(np.asarray(heatmap, dtype=np.float32)))
+    grid = np.rint(np.clip(grid, 0.0, 1.0) * 255).astype(np.uint8)
+    return {
+        'shape': list(grid.shape),
+        'dtype': 'uint8',
+        'data': base64.b64encode(grid.tobytes()).decode('ascii')
+    }
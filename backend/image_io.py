@@ -0,0 +1,168 @@
+"""
+Image I/O Module - Reading uploaded images from API requests
+Supports raw binary bodies, multipart/form-data uploads and base64 JSON data URLs
+"""
+import base64
+import binascii
+import json
+from io import BytesIO
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import Config
+
+# Content types accepted as a raw binary request body
+RAW_IMAGE_CONTENT_TYPES = {'image/jpeg', 'image/jpg', 'image/png'}
+
+# Chunk size used when reading raw bodies from the input stream
+READ_CHUNK_SIZE = 64 * 1024
+
+# Let PIL raise DecompressionBombError instead of only warning on huge images
+Image.MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+
+
+class ImageInputError(ValueError):
+    """Raised when a request does not contain a usable image"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _too_large_error():
+    return ImageInputError(
+        f'Image too large (max {Config.MAX_IMAGE_SIZE // (1024 * 1024)}MB)', status_code=413
+    )
+
+
+def _read_limited(stream, limit):
+    """Read a stream in chunks, aborting as soon as more than limit bytes arrive"""
+    buffer = BytesIO()
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if buffer.tell() > limit:
+            raise _too_large_error()
+    return buffer.getvalue()
+
+
+def read_image_stream(stream):
+    """
+    Read an uploaded image file stream (e.g. one part of a batch upload),
+    aborting once it goes over MAX_IMAGE_SIZE
+
+    Returns:
+        bytes with the encoded image file
+    """
+    return _read_limited(stream, Config.MAX_IMAGE_SIZE)
+
+
+def decode_base64_image(image_data):
+    """
+    Decode a base64 string or data URL into raw image bytes
+
+    Args:
+        image_data: "data:image/png;base64,..." or a bare base64 string
+
+    Returns:
+        bytes with the encoded image file
+    """
+    if not isinstance(image_data, str):
+        raise ImageInputError('No image provided')
+
+    # Remove data URL prefix if present
+    if ',' in image_data:
+        image_data = image_data.split(',', 1)[1]
+
+    # Reject from the encoded length, before decoding anything
+    if len(image_data) * 3 // 4 > Config.MAX_IMAGE_SIZE + 2:
+        raise _too_large_error()
+
+    try:
+        return base64.b64decode(image_data)
+    except (binascii.Error, ValueError) as e:
+        raise ImageInputError(f'Invalid image data: {str(e)}')
+
+
+def read_request_image_bytes(request):
+    """
+    Read the uploaded image file bytes from a Flask request
+
+    Accepted formats:
+        - raw body with Content-Type image/jpeg or image/png
+        - multipart/form-data with an "image" file part (or a single file part)
+        - JSON body {"image": "data:image/png;base64,..."}
+
+    Returns:
+        bytes with the encoded image file
+    """
+    # Reject from the declared length before reading any of the body
+    if request.content_length is not None and request.content_length > Config.MAX_REQUEST_SIZE:
+        raise _too_large_error()
+
+    try:
+        return _read_request_image_bytes(request)
+    except RequestEntityTooLarge:
+        # Body went over MAX_CONTENT_LENGTH while being streamed in
+        raise _too_large_error()
+
+
+def _read_request_image_bytes(request):
+    if request.mimetype in RAW_IMAGE_CONTENT_TYPES:
+        # Read the body once, straight from the input stream, enforcing the
+        # size limit as bytes arrive (covers chunked bodies without a length)
+        image_bytes = _read_limited(request.stream, Config.MAX_IMAGE_SIZE)
+        if not image_bytes:
+            raise ImageInputError('No image provided')
+        return image_bytes
+
+    if request.mimetype == 'multipart/form-data':
+        storage = request.files.get('image') or next(iter(request.files.values()), None)
+        if storage is None:
+            raise ImageInputError('No image provided')
+        return _read_limited(storage.stream, Config.MAX_IMAGE_SIZE)
+
+    # Werkzeug truncates streamed bodies at MAX_CONTENT_LENGTH, so a body that
+    # reaches the limit is treated as oversized rather than parsed
+    body = request.get_data(cache=False)
+    if len(body) >= Config.MAX_REQUEST_SIZE:
+        raise _too_large_error()
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'image' not in data:
+        raise ImageInputError('No image provided')
+    return decode_base64_image(data['image'])
+
+
+def open_image_bytes(image_bytes):
+    """
+    Validate raw image bytes and open them as a PIL Image
+
+    Only the image header is parsed here, so the pixel-count check runs
+    before any pixel data is decoded.
+
+    Returns:
+        PIL Image object (lazily decoded)
+    """
+    if len(image_bytes) > Config.MAX_IMAGE_SIZE:
+        raise _too_large_error()
+
+    try:
+        image = Image.open(BytesIO(image_bytes))
+    except Image.DecompressionBombError:
+        raise ImageInputError('Image dimensions too large', status_code=413)
+    except Exception as e:
+        raise ImageInputError(f'Invalid image data: {str(e)}')
+
+    width, height = image.size
+    if width * height > Config.MAX_IMAGE_PIXELS:
+        raise ImageInputError(
+            f'Image dimensions too large ({width}x{height}, '
+            f'max {Config.MAX_IMAGE_PIXELS} pixels)', status_code=413
+        )
+
+    return image
@@ -4,41 +4,59 @@ Image Processor Module - Computer vision analysis for lesion detection and chara
 import cv2
 import numpy as np
 from PIL import Image
-import base64
 from io import BytesIO
 from config import Config
+from image_encoding import encode_data_url
 
 class ImageProcessor:
-    """Handles computer vision processing for melanoma detection"""
+    """
+    Handles computer vision processing for melanoma detection
+    
+    The analysis runs on a copy of the image downscaled to at most
+    Config.ANALYSIS_MAX_DIMENSION pixels on its longest side, and the color
+    statistics only on the lesion bounding box. Reported locations and pixel
+    metrics are scaled back to the original image resolution.
+    """
     
     def __init__(self):
         """Initialize the image processor"""
-        pass
+        # Clinical palette reference colors in CIELAB, for nearest-color matching
+        self._palette_names = list(Config.LESION_COLOR_PALETTE)
+        reference_bgr = np.array(
+            [rgb[::-1] for _, rgb in Config.LESION_COLOR_PALETTE.values()], dtype=np.float32
+        )
+        self._palette_lab = cv2.cvtColor(reference_bgr[np.newaxis] / 255.0, cv2.COLOR_BGR2Lab)[0]
     
-    def process_image(self, image):
+    def process_image(self, image, include_overlay=True, original_size=None):
         """
         Complete image processing pipeline
         
         Args:
             image: PIL Image object
+            include_overlay: also render the border overlay (processed_image)
+            original_size: (width, height) of the source image when image is
+                already a reduced version of it (pixel metrics are reported
+                at this size)
             
         Returns:
             dict with all analysis results and processed image
         """
-        # Convert PIL to OpenCV format
-        cv_image = self._pil_to_cv(image)
+        # Convert PIL to a downscaled OpenCV image
+        cv_image, scale = self._to_analysis_image(image, original_size)
         
         # Detect lesion and get contour
-        lesion_data = self.detect_lesion(cv_image)
+        lesion_data = self.detect_lesion(cv_image, scale)
         
         # Extract ABCDE characteristics
         abcde = self.analyze_abcde(cv_image, lesion_data)
         
-        # Create overlay image with border
-        overlay_image = self.create_border_overlay(cv_image, lesion_data)
-        
-        # Convert overlay back to base64 for frontend
-        overlay_base64 = self._cv_to_base64(overlay_image)
+        overlay_base64 = None
+        if include_overlay:
+            # Create overlay image with border
+            overlay_image = self.create_border_overlay(cv_image, lesion_data)
+            
+            # Convert overlay back to base64 for frontend
+            overlay_base64 = self._cv_to_base64(overlay_image)
         
         return {
             'lesion_detected': lesion_data['detected'],
@@ -48,15 +66,41 @@ class ImageProcessor:
             'processed_image': overlay_base64
         }
     
-    def detect_lesion(self, cv_image):
+    def process_image_bytes(self, image_bytes, include_overlay=True):
+        """
+        Run the pipeline on encoded image bytes
+        
+        Opens a private copy of the image, so it can run in parallel with
+        other work on the same upload. JPEGs are decoded straight at reduced
+        resolution (Image.draft), close to Config.ANALYSIS_MAX_DIMENSION.
+        
+        Args:
+            image_bytes: encoded image (already validated with open_image_bytes)
+            include_overlay: also render the border overlay (processed_image)
+            
+        Returns:
+            dict with all analysis results and processed image
+        """
+        image = Image.open(BytesIO(image_bytes))
+        original_size = image.size
+        
+        max_dimension = Config.ANALYSIS_MAX_DIMENSION
+        image.draft('RGB', (max_dimension, max_dimension))
+        
+        return self.process_image(image, include_overlay, original_size)
+    
+    def detect_lesion(self, cv_image, scale=1.0):
         """
         Detect lesion in the image using contour detection
         
         Args:
             cv_image: OpenCV image (BGR format)
+            scale: size of cv_image relative to the original image; location
+                and metrics are reported in original image pixels
             
         Returns:
-            dict with lesion detection results
+            dict with lesion detection results (contour, bounding box and
+            center are kept in cv_image coordinates for the later stages)
         """
         # Convert to grayscale
         gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
@@ -66,7 +110,7 @@ class ImageProcessor:
         
         # Apply adaptive thresholding
         thresh = cv2.adaptiveThreshold(
-            blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+            blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
             cv2.THRESH_BINARY_INV, 11, 2
         )
         
@@ -79,25 +123,15 @@ class ImageProcessor:
         contours, _ = cv2.findContours(morph, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
         if not contours:
-            return {
-                'detected': False,
-                'location': None,
-                'metrics': None,
-                'contour': None
-            }
+            return self._no_lesion()
         
         # Find the largest contour (assumed to be the lesion)
         largest_contour = max(contours, key=cv2.contourArea)
         area = cv2.contourArea(largest_contour)
         
-        # Check if contour is large enough
-        if area < Config.MIN_LESION_AREA:
-            return {
-                'detected': False,
-                'location': None,
-                'metrics': None,
-                'contour': None
-            }
+        # Check if contour is large enough (MIN_LESION_AREA is in original pixels)
+        if area < Config.MIN_LESION_AREA * scale ** 2:
+            return self._no_lesion()
         
         # Get bounding box
         x, y, w, h = cv2.boundingRect(largest_contour)
@@ -107,7 +141,7 @@ class ImageProcessor:
         
         # Calculate diameter (maximum distance across contour)
         # Use bounding box diagonal as approximation
-        diameter_pixels = np.sqrt(w**2 + h**2)
+        diameter_pixels = np.sqrt(w**2 + h**2) / scale
         diameter_mm = diameter_pixels * Config.PIXEL_TO_MM_RATIO
         
         # Calculate circularity (4π * area / perimeter²)
@@ -125,20 +159,33 @@ class ImageProcessor:
         return {
             'detected': True,
             'location': {
-                'x': int(x),
-                'y': int(y),
-                'width': int(w),
-                'height': int(h),
-                'center_x': int(cx),
-                'center_y': int(cy)
+                'x': int(x / scale),
+                'y': int(y / scale),
+                'width': int(round(w / scale)),
+                'height': int(round(h / scale)),
+                'center_x': int(cx / scale),
+                'center_y': int(cy / scale)
             },
             'metrics': {
-                'area_pixels': int(area),
-                'perimeter_pixels': round(perimeter, 2),
-                'diameter_mm': round(diameter_mm, 2),
-                'circularity': round(circularity, 3)
+                'area_pixels': int(area / scale ** 2),
+                'perimeter_pixels': round(perimeter / scale, 2),
+                'diameter_mm': round(float(diameter_mm), 2),
+                'circularity': round(float(circularity), 3)
             },
-            'contour': largest_contour
+            'contour': largest_contour,
+            'bounding_box': (x, y, w, h),
+            'center': (cx, cy),
+            'scale': scale
+        }
+    
+    @staticmethod
+    def _no_lesion():
+        """Detection result when no lesion is found"""
+        return {
+            'detected': False,
+            'location': None,
+            'metrics': None,
+            'contour': None
         }
     
     def analyze_abcde(self, cv_image, lesion_data):
@@ -146,7 +193,7 @@ class ImageProcessor:
         Analyze ABCDE characteristics of the lesion
         
         Args:
-            cv_image: OpenCV image (BGR format)
+            cv_image: OpenCV image (BGR format) the lesion was detected on
             lesion_data: Lesion detection results
             
         Returns:
@@ -156,39 +203,40 @@ class ImageProcessor:
             return None
         
         contour = lesion_data['contour']
-        location = lesion_data['location']
         
         # A - Asymmetry
         asymmetry_score = self._calculate_asymmetry(contour)
-        asymmetry_detected = asymmetry_score > Config.ASYMMETRY_THRESHOLD
+        asymmetry_detected = bool(asymmetry_score > Config.ASYMMETRY_THRESHOLD)
         
         # B - Border irregularity
-        border_score = self._calculate_border_irregularity(contour)
-        border_irregular = border_score > Config.BORDER_IRREGULARITY_THRESHOLD
+        border_score = self._calculate_border_irregularity(contour, lesion_data['scale'])
+        border_irregular = bool(border_score > Config.BORDER_IRREGULARITY_THRESHOLD)
         
-        # C - Color analysis
-        color_data = self._analyze_color(cv_image, contour)
-        color_varied = color_data['variance'] > Config.COLOR_VARIANCE_THRESHOLD
+        # C - Color analysis (bounding box only)
+        color_data = self._analyze_color(cv_image, contour, lesion_data['bounding_box'])
+        color_varied = bool(color_data['variance'] > Config.COLOR_VARIANCE_THRESHOLD)
         
         # D - Diameter
         diameter_mm = lesion_data['metrics']['diameter_mm']
-        diameter_warning = diameter_mm > Config.DIAMETER_WARNING_MM
+        diameter_warning = bool(diameter_mm > Config.DIAMETER_WARNING_MM)
         
         return {
             'asymmetry': {
                 'detected': asymmetry_detected,
-                'score': round(asymmetry_score, 3),
+                'score': round(float(asymmetry_score), 3),
                 'description': 'Detectada' if asymmetry_detected else 'No detectada'
             },
             'border': {
                 'irregular': border_irregular,
-                'score': round(border_score, 3),
+                'score': round(float(border_score), 3),
                 'description': 'Irregular' if border_irregular else 'Regular'
             },
             'color': {
                 'varied': color_varied,
                 'variance': round(color_data['variance'], 2),
                 'dominant_colors': color_data['dominant_colors'],
+                'palette': color_data['palette'],
+                'colors_present': len(color_data['palette']),
                 'description': 'Variado' if color_varied else 'Uniforme'
             },
             'diameter': {
@@ -203,7 +251,7 @@ class ImageProcessor:
         Create image with lesion border overlay
         
         Args:
-            cv_image: OpenCV image (BGR format)
+            cv_image: OpenCV image (BGR format) the lesion was detected on
             lesion_data: Lesion detection results
             
         Returns:
@@ -215,28 +263,22 @@ class ImageProcessor:
             return overlay
         
         contour = lesion_data['contour']
-        location = lesion_data['location']
+        x, y, w, h = lesion_data['bounding_box']
         
         # Draw contour in cyan color
         cv2.drawContours(overlay, [contour], -1, (255, 255, 0), Config.BORDER_THICKNESS)
         
         # Draw bounding box in green
-        cv2.rectangle(
-            overlay,
-            (location['x'], location['y']),
-            (location['x'] + location['width'], location['y'] + location['height']),
-            (0, 255, 0),
-            2
-        )
+        cv2.rectangle(overlay, (x, y), (x + w, y + h), (0, 255, 0), 2)
         
         # Draw center point
-        cv2.circle(overlay, (location['center_x'], location['center_y']), 5, (0, 0, 255), -1)
+        cv2.circle(overlay, lesion_data['center'], 5, (0, 0, 255), -1)
         
         # Add label
         label = f"Lesion: {lesion_data['metrics']['diameter_mm']}mm"
         cv2.putText(
             overlay, label,
-            (location['x'], location['y'] - 10),
+            (x, y - 10),
             cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2
         )
         
@@ -246,9 +288,6 @@ class ImageProcessor:
         """Calculate asymmetry score using image moments"""
         moments = cv2.moments(contour)
         
-        # Use Hu moments for shape comparison
-        hu_moments = cv2.HuMoments(moments)
-        
         # Simple asymmetry metric based on central moments
         if moments['m00'] == 0:
             return 0.0
@@ -262,8 +301,8 @@ class ImageProcessor:
         
         return asymmetry
     
-    def _calculate_border_irregularity(self, contour):
-        """Calculate border irregularity score"""
+    def _calculate_border_irregularity(self, contour, scale=1.0):
+        """Calculate border irregularity score (defect depths in original image pixels)"""
         # Approximate contour to polygon
         epsilon = 0.02 * cv2.arcLength(contour, True)
         approx = cv2.approxPolyDP(contour, epsilon, True)
@@ -278,10 +317,13 @@ class ImageProcessor:
             defects = cv2.convexityDefects(contour, hull)
             if defects is not None:
                 # Average defect depth normalized by contour size
-                avg_defect = np.mean(defects[:, 0, 3]) / 256.0
+                # (depths are fixed-point with 8 fractional bits; the array is
+                # (N, 1, 4) or (N, 4) depending on the OpenCV version)
+                avg_defect = np.mean(defects.reshape(-1, 4)[:, 3]) / 256.0 / scale
             else:
                 avg_defect = 0.0
-        except:
+        except cv2.error:
+            # Self-intersecting contours have no well-defined defects
             avg_defect = 0.0
         
         # Combine metrics
@@ -289,73 +331,107 @@ class ImageProcessor:
         
         return irregularity
     
-    def _analyze_color(self, cv_image, contour):
-        """Analyze color characteristics within the lesion"""
-        # Create mask from contour
-        mask = np.zeros(cv_image.shape[:2], dtype=np.uint8)
-        cv2.drawContours(mask, [contour], -1, 255, -1)
-        
-        # Extract colors within mask
-        masked_image = cv2.bitwise_and(cv_image, cv_image, mask=mask)
-        
-        # Convert to HSV for better color analysis
-        hsv = cv2.cvtColor(masked_image, cv2.COLOR_BGR2HSV)
-        
-        # Get pixels within lesion
-        lesion_pixels = hsv[mask > 0]
-        
-        if len(lesion_pixels) == 0:
-            return {'variance': 0, 'dominant_colors': []}
+    def _analyze_color(self, cv_image, contour, bounding_box):
+        """
+        Analyze color characteristics within the lesion
         
-        # Calculate color variance
-        h_variance = np.var(lesion_pixels[:, 0])
-        s_variance = np.var(lesion_pixels[:, 1])
-        v_variance = np.var(lesion_pixels[:, 2])
+        Only the bounding box is masked and converted to HSV, and each
+        statistic is a single masked pass over it.
+        """
+        x, y, w, h = bounding_box
+        roi = cv_image[y:y + h, x:x + w]
         
-        total_variance = (h_variance + s_variance + v_variance) / 3
+        # Create mask from contour, in bounding box coordinates
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(mask, [contour], -1, 255, -1, offset=(-x, -y))
         
-        # Find dominant colors using k-means (simplified)
-        bgr_pixels = cv_image[mask > 0]
+        if not cv2.countNonZero(mask):
+            return {'variance': 0, 'dominant_colors': [], 'palette': []}
         
-        # Sample pixels if too many
-        if len(bgr_pixels) > 1000:
-            indices = np.random.choice(len(bgr_pixels), 1000, replace=False)
-            bgr_pixels = bgr_pixels[indices]
+        # Calculate color variance (mean of the per-channel HSV variances)
+        hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+        _, hsv_std = cv2.meanStdDev(hsv, mask=mask)
+        total_variance = float(np.mean(hsv_std ** 2))
         
-        # Get mean color
-        mean_color = np.mean(bgr_pixels, axis=0).astype(int)
-        dominant_colors = [f"rgb({mean_color[2]}, {mean_color[1]}, {mean_color[0]})"]
+        # Dominant colors from the clinical palette
+        palette = self._color_palette(roi, mask)
         
         return {
-            'variance': float(total_variance),
-            'dominant_colors': dominant_colors
+            'variance': total_variance,
+            'dominant_colors': [entry['rgb'] for entry in palette],
+            'palette': palette
         }
     
-    def _pil_to_cv(self, pil_image):
-        """Convert PIL Image to OpenCV format"""
+    def _color_palette(self, roi, mask):
+        """
+        Share of each clinical color (Config.LESION_COLOR_PALETTE) in the lesion
+        
+        Works on an evenly strided, deterministic sample of at most
+        Config.COLOR_SAMPLE_SIZE lesion pixels, so the cost does not grow with
+        the lesion size. Each sampled pixel goes to the nearest palette color
+        in CIELAB.
+        
+        Returns:
+            list of dicts (color, label, proportion, mean rgb of its pixels),
+            by decreasing proportion, for colors over Config.COLOR_MIN_PROPORTION
+        """
+        lesion_indices = np.flatnonzero(mask)
+        step = -(-len(lesion_indices) // Config.COLOR_SAMPLE_SIZE)  # ceil division
+        sample = roi.reshape(-1, 3)[lesion_indices[::step]]
+        
+        lab = cv2.cvtColor(sample[np.newaxis].astype(np.float32) / 255.0, cv2.COLOR_BGR2Lab)[0]
+        distances = ((lab[:, np.newaxis, :] - self._palette_lab[np.newaxis]) ** 2).sum(axis=2)
+        assignments = distances.argmin(axis=1)
+        counts = np.bincount(assignments, minlength=len(self._palette_names))
+        
+        palette = []
+        for index in np.argsort(-counts, kind='stable'):
+            proportion = counts[index] / len(sample)
+            if proportion < Config.COLOR_MIN_PROPORTION:
+                break
+            
+            name = self._palette_names[index]
+            blue, green, red = sample[assignments == index].mean(axis=0).astype(int)
+            palette.append({
+                'color': name,
+                'label': Config.LESION_COLOR_PALETTE[name][0],
+                'proportion': round(float(proportion), 3),
+                'rgb': f"rgb({red}, {green}, {blue})"
+            })
+        
+        return palette
+    
+    def _to_analysis_image(self, pil_image, original_size=None):
+        """
+        Convert a PIL Image to an OpenCV image no larger than
+        Config.ANALYSIS_MAX_DIMENSION on its longest side
+        
+        Returns:
+            tuple (OpenCV image in BGR format, scale relative to original_size,
+            or to the given image when not set)
+        """
         # Convert to RGB if needed
         if pil_image.mode != 'RGB':
             pil_image = pil_image.convert('RGB')
         
-        # Convert to numpy array
-        numpy_image = np.array(pil_image)
+        width, height = pil_image.size
+        resize_scale = Config.ANALYSIS_MAX_DIMENSION / max(width, height)
+        if resize_scale < 1.0:
+            size = (max(1, round(width * resize_scale)), max(1, round(height * resize_scale)))
+            # Box-reduce by an integer factor first, then BILINEAR to the exact size
+            pil_image = pil_image.resize(size, Image.Resampling.BILINEAR, reducing_gap=1.0)
         
-        # Convert RGB to BGR (OpenCV format)
-        cv_image = cv2.cvtColor(numpy_image, cv2.COLOR_RGB2BGR)
+        scale = pil_image.size[0] / (original_size or (width, height))[0]
         
-        return cv_image
+        return cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR), scale
     
     def _cv_to_base64(self, cv_image):
-        """Convert OpenCV image to base64 string"""
+        """Convert OpenCV image to a data URL with the output encoding settings"""
         # Convert BGR to RGB
         rgb_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
         
         # Convert to PIL Image
         pil_image = Image.fromarray(rgb_image)
         
-        # Convert to base64
-        buffered = BytesIO()
-        pil_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        return f"data:image/png;base64,{img_str}"
+        # Downscale and encode (image_encoding, WebP by default)
+        return encode_data_url(pil_image)
@@ -0,0 +1,242 @@
+"""
+Metrics Module - In-process counters and histograms for the serving hot path
+Rendered in the Prometheus text exposition format, plus per-request stage
+timings for the Server-Timing response header
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cached response to a slow Grad-CAM render
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    """Base class: a named metric family with a fixed set of label names"""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # label values tuple -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """Yield (name suffix, label pairs, value) for every series"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, one series per label combination"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield '_total', list(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, with sum and count"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, list(series['counts']), series['sum'])
+                            for key, series in self._values.items())
+        for key, counts, total in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', labels + [('le', _format_value(bound))], cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+class Gauge(_Metric):
+    """Current value read from a callback when the metrics are rendered"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, fn):
+        super().__init__(name, documentation)
+        self.fn = fn
+
+    def _samples(self):
+        yield '', [], self.fn()
+
+
+class MetricsRegistry:
+    """Named metrics of the process, rendered together for a scrape"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, fn):
+        return self._register(Gauge(name, documentation, fn))
+
+    def render(self):
+        """Get every metric in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    'melanox_http_requests', 'HTTP requests by endpoint and status code', ('endpoint', 'status'))
+REQUEST_SECONDS = registry.histogram(
+    'melanox_http_request_duration_seconds', 'HTTP request latency by endpoint', ('endpoint',))
+STAGE_SECONDS = registry.histogram(
+    'melanox_stage_duration_seconds', 'Duration of each analysis stage', ('stage',))
+ANALYSIS_ERRORS = registry.counter(
+    'melanox_analysis_errors', 'Failed analyses by stage', ('stage',))
+GRADCAM_FAILURES = registry.counter(
+    'melanox_gradcam_failures', 'Grad-CAM heatmaps that could not be computed or rendered', ('mode',))
+CACHE_LOOKUPS = registry.counter(
+    'melanox_result_cache_lookups', 'Result cache lookups on /api/analyze by result', ('result',))
+MODEL_INFERENCE_SECONDS = registry.histogram(
+    'melanox_model_inference_duration_seconds', 'Inference latency of /api/analyze by model', ('model',))
+MODEL_ERRORS = registry.counter(
+    'melanox_model_errors', 'Failed inferences of /api/analyze by model', ('model',))
+BATCH_SIZE = registry.histogram(
+    'melanox_batch_size', 'Images per forward pass by source', ('source',), BATCH_SIZE_BUCKETS)
+
+
+# Stage timings of the request being served, for the Server-Timing header.
+# A context variable, so work handed to another thread with
+# contextvars.copy_context().run() records into the same request.
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Stage durations of one request, in the order they finished"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = []  # (stage, seconds)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages.append((stage, seconds))
+
+    def server_timing(self):
+        """Format the stages as a Server-Timing header value (durations in ms)"""
+        with self._lock:
+            return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages)
+
+
+def start_request_timings():
+    """Start collecting the stage timings of the current request"""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def current_request_timings():
+    """Stage timings of the current request, or None outside a timed request"""
+    return _request_timings.get()
+
+
+def end_request_timings():
+    _request_timings.set(None)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as an analysis stage
+
+    The duration goes to the stage histogram and, inside a timed request, to
+    the request's Server-Timing breakdown.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
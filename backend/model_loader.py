@@ -1,18 +1,301 @@
 """
 Model Loader Module - Handles loading and inference with the Keras .h5 model
+and its exported TFLite / ONNX variants
 """
+import logging
 import os
+import threading
+import time
+from io import BytesIO
 import numpy as np
 from PIL import Image
-import tensorflow as tf
-from tensorflow import keras
 from config import Config
+from batching import BatchScheduler
+from tta import build_views
+from precision import PRECISIONS, apply_precision, check_calibration
+from metrics import stage, BATCH_SIZE, GRADCAM_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# TensorFlow (and gradcam.py, which needs it) is imported lazily when the model
+# is loaded, so importing this module - and the API - stays fast. Under gunicorn
+# the master imports it up front instead (ModelLoader.import_tensorflow).
+
+
+class KerasBackend:
+    """Runs the Keras .h5 model with TensorFlow (the only backend supporting Grad-CAM)"""
+    
+    name = 'keras'
+    supports_gradcam = True
+    
+    def __init__(self, model_path, precision='float32'):
+        from tensorflow import keras
+        
+        self.model_path = model_path
+        self.precision = precision
+        self.model = keras.models.load_model(model_path)
+        if precision != 'float32':
+            apply_precision(self.model, precision)
+        self._serving_fn = self._build_serving_fn()
+    
+    @property
+    def serving_mode(self):
+        return 'function' if self._serving_fn is not None else 'predict'
+    
+    def _build_serving_fn(self):
+        """Wrap the model in a tf.function with a fixed signature and warm it up"""
+        if Config.MODEL_SERVING_MODE != 'function':
+            return None
+        
+        import tensorflow as tf
+        
+        width, height = Config.MODEL_INPUT_SIZE
+        serving_fn = tf.function(
+            lambda img_array: self.model(img_array, training=False),
+            input_signature=[tf.TensorSpec((None, height, width, 3), tf.float32)]
+        )
+        
+        # Warm-up call so graph tracing is not paid by the first request
+        serving_fn(tf.zeros((1, height, width, 3), tf.float32))
+        
+        return serving_fn
+    
+    def run(self, img_array):
+        """Run a preprocessed float32 batch, returning the raw outputs"""
+        if self._serving_fn is not None:
+            return self._serving_fn(img_array.astype(np.float32, copy=False)).numpy()
+        
+        return self.model.predict(img_array, verbose=0)
+    
+    def get_info(self):
+        return {
+            'input_shape': str(self.model.input_shape),
+            'output_shape': str(self.model.output_shape),
+            'total_params': self.model.count_params(),
+            'serving_mode': self.serving_mode,
+            'precision': self.precision
+        }
+
+
+class TFLiteBackend:
+    """Runs an exported .tflite model (float32, float16 or quantized weights)"""
+    
+    name = 'tflite'
+    supports_gradcam = False
+    serving_mode = 'interpreter'
+    
+    def __init__(self, model_path, model_content=None):
+        """
+        Args:
+            model_path: .tflite file
+            model_content: the file contents, already read (e.g. by the gunicorn
+                master); the interpreter then runs on this buffer in place
+        """
+        Interpreter, OpResolverType = self._interpreter_api()
+        options = {}
+        if not Config.TFLITE_XNNPACK:
+            # Without XNNPACK the kernels read the weights straight from the
+            # model buffer instead of repacking them into private memory
+            options['experimental_op_resolver_type'] = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        if model_content is not None:
+            options['model_content'] = model_content
+        else:
+            options['model_path'] = model_path
+        
+        self.model_path = model_path
+        self.interpreter = Interpreter(num_threads=Config.TF_INTRA_OP_THREADS or None, **options)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        # The interpreter is stateful: one invocation at a time
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _interpreter_api():
+        """
+        Interpreter class and OpResolverType enum, preferring the standalone
+        LiteRT / tflite-runtime interpreters when installed
+        """
+        try:
+            from ai_edge_litert.interpreter import Interpreter, OpResolverType
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter, OpResolverType
+            except ImportError:
+                import tensorflow as tf
+                Interpreter, OpResolverType = tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+        return Interpreter, OpResolverType
+    
+    def run(self, img_array):
+        """Run a preprocessed float32 batch, returning the raw outputs"""
+        with self._lock:
+            if tuple(self._input['shape']) != img_array.shape:
+                # Batch size changed: resize the input and re-plan the tensors
+                self.interpreter.resize_tensor_input(self._input['index'], img_array.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+            
+            self.interpreter.set_tensor(self._input['index'], self._quantize(img_array))
+            self.interpreter.invoke()
+            return self._dequantize(self.interpreter.get_tensor(self._output['index']))
+    
+    def _quantize(self, img_array):
+        """Convert float input to the model input type (integer-only models)"""
+        dtype = self._input['dtype']
+        if dtype == np.float32:
+            return img_array.astype(np.float32, copy=False)
+        scale, zero_point = self._input['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(img_array / scale + zero_point), info.min, info.max).astype(dtype)
+    
+    def _dequantize(self, output):
+        """Convert model output back to float probabilities"""
+        if self._output['dtype'] == np.float32:
+            return output.copy()
+        scale, zero_point = self._output['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+    
+    @property
+    def precision(self):
+        """Precision chosen at export (export_model.py tflite --quantize)"""
+        if self._input['dtype'] != np.float32:
+            return 'int8'
+        dtypes = {detail['dtype'] for detail in self.interpreter.get_tensor_details()}
+        if np.float16 in dtypes:
+            return 'float16'
+        if np.int8 in dtypes:
+            return 'int8_weights'
+        return 'float32'
+    
+    def get_info(self):
+        return {
+            'input_shape': str(tuple(int(dim) for dim in self._input['shape_signature'])),
+            'output_shape': str(tuple(int(dim) for dim in self._output['shape_signature'])),
+            'total_params': None,
+            'serving_mode': self.serving_mode,
+            'precision': self.precision
+        }
+
+
+class OnnxBackend:
+    """Runs an exported .onnx model with ONNX Runtime on CPU"""
+    
+    name = 'onnx'
+    supports_gradcam = False
+    serving_mode = 'session'
+    # export_model.py exports the float32 model
+    precision = 'float32'
+    
+    def __init__(self, model_path):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("INFERENCE_BACKEND='onnx' requires: pip install onnxruntime")
+        
+        self.model_path = model_path
+        options = ort.SessionOptions()
+        if Config.TF_INTRA_OP_THREADS:
+            options.intra_op_num_threads = Config.TF_INTRA_OP_THREADS
+        if Config.TF_INTER_OP_THREADS:
+            options.inter_op_num_threads = Config.TF_INTER_OP_THREADS
+        
+        self.session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider']
+        )
+        self._input = self.session.get_inputs()[0]
+        self._output = self.session.get_outputs()[0]
+    
+    def run(self, img_array):
+        """Run a preprocessed float32 batch, returning the raw outputs"""
+        return self.session.run(
+            [self._output.name], {self._input.name: img_array.astype(np.float32, copy=False)}
+        )[0]
+    
+    def get_info(self):
+        return {
+            'input_shape': str(tuple(self._input.shape)),
+            'output_shape': str(tuple(self._output.shape)),
+            'total_params': None,
+            'serving_mode': self.serving_mode,
+            'precision': self.precision
+        }
+
+
+# Registered inference backends and the Config setting holding each model path
+INFERENCE_BACKENDS = {
+    'keras': (KerasBackend, 'MODEL_PATH'),
+    'tflite': (TFLiteBackend, 'TFLITE_MODEL_PATH'),
+    'onnx': (OnnxBackend, 'ONNX_MODEL_PATH'),
+}
+
+
+def create_backend(name, model_path=None, precision='float32', model_content=None):
+    """
+    Create an inference backend
+    
+    Args:
+        name: one of INFERENCE_BACKENDS
+        model_path: model file (defaults to the Config path for that backend)
+        precision: one of precision.PRECISIONS (keras only; the precision of
+            exported models is chosen at export time)
+        model_content: contents of the model file, already read (tflite only)
+        
+    Returns:
+        backend instance exposing run(img_array) and get_info()
+    """
+    if name not in INFERENCE_BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend '{name}' (options: {', '.join(INFERENCE_BACKENDS)})"
+        )
+    
+    backend_class, path_setting = INFERENCE_BACKENDS[name]
+    model_path = model_path or getattr(Config, path_setting)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found at {model_path}")
+    
+    if precision != 'float32':
+        if name != 'keras':
+            raise ValueError(f"Precision '{precision}' is only supported by the keras backend")
+        return backend_class(model_path, precision)
+    if model_content is not None:
+        if name != 'tflite':
+            raise ValueError("Only the tflite backend can run from preloaded model contents")
+        return backend_class(model_path, model_content=model_content)
+    return backend_class(model_path)
+
+
+def model_file_version(model_path):
+    """Identifier of a model file from its name, size and modification time"""
+    stat = os.stat(model_path)
+    return f"{os.path.basename(model_path)}-{stat.st_size}-{int(stat.st_mtime)}"
 
 class ModelLoader:
-    """Singleton class for loading and managing the melanoma detection model"""
+    """
+    Singleton class for loading and managing the melanoma detection model
+    
+    ModelLoader() is the model configured in Config. Additional models (e.g.
+    a new checkpoint served next to it by the model registry) get their own,
+    independent loaders from ModelLoader.for_model().
+    """
     
     _instance = None
+    _tf_threading_configured = False
+    # Model file and backend of this loader (None: the Config settings)
+    _model_path = None
+    _backend_name = None
+    _backend = None
     _model = None
+    _model_version = None
+    _gradcam = None
+    _schedulers = {}
+    # (contents, version) of the model file read by preload_model_file()
+    _preloaded_model = None
+    # Load state: 'not_loaded' -> 'loading' -> 'ready' | 'failed'
+    _status = 'not_loaded'
+    _load_error = None
+    _load_seconds = None
+    _load_lock = threading.Lock()
     
     def __new__(cls):
         """Ensure only one instance of ModelLoader exists"""
@@ -22,20 +305,227 @@ class ModelLoader:
     
     def __init__(self):
         """Initialize the model loader"""
-        if self._model is None:
-            self.load_model()
+        if self._status == 'not_loaded' and not Config.DEFER_MODEL_LOAD:
+            if Config.BACKGROUND_MODEL_LOAD:
+                self.start_background_load()
+            else:
+                self.load_model()
+    
+    @classmethod
+    def for_model(cls, model_path, backend=None):
+        """
+        Create a separate loader for another model file (not the singleton)
+        
+        Args:
+            model_path: model file to serve
+            backend: inference backend name (default Config.INFERENCE_BACKEND)
+            
+        Returns:
+            a ModelLoader in the 'not_loaded' state; call load_model() to load it
+        """
+        loader = super().__new__(cls)
+        loader._model_path = model_path
+        loader._backend_name = backend
+        loader._schedulers = {}
+        loader._load_lock = threading.Lock()
+        return loader
+    
+    @staticmethod
+    def import_tensorflow():
+        """
+        Import TensorFlow, Keras and the Grad-CAM module ahead of load_model()
+        
+        Called by the gunicorn master before it forks, so the workers inherit
+        the imported modules instead of each importing TensorFlow again.
+        Importing is fork-safe: TensorFlow starts no threads or sessions until
+        the first op runs, and each worker sizes its thread pools after fork.
+        """
+        import tensorflow
+        from tensorflow import keras
+        import gradcam
+        
+        return tensorflow, keras, gradcam
+    
+    @staticmethod
+    def configure_threading():
+        """
+        Apply the configured TensorFlow thread pool sizes
+        
+        Must run before the TensorFlow runtime is initialized (before the
+        model is loaded or any op executes), e.g. in a freshly forked worker.
+        """
+        import tensorflow as tf
+        
+        try:
+            if Config.TF_INTRA_OP_THREADS:
+                tf.config.threading.set_intra_op_parallelism_threads(Config.TF_INTRA_OP_THREADS)
+            if Config.TF_INTER_OP_THREADS:
+                tf.config.threading.set_inter_op_parallelism_threads(Config.TF_INTER_OP_THREADS)
+        except RuntimeError as e:
+            logger.warning("TensorFlow threading already initialized: %s", e)
     
     def load_model(self):
-        """Load the Keras model from disk"""
+        """
+        Load the model from disk with the configured inference backend
+        
+        The loader only reports ready once the backend, the Grad-CAM engine
+        and the schedulers exist and the warm-up inference has run.
+        """
+        with self._load_lock:
+            if self._status == 'ready':
+                return
+            self._set_status('loading')
+        
+        start = time.perf_counter()
         try:
-            if not os.path.exists(Config.MODEL_PATH):
-                raise FileNotFoundError(f"Model file not found at {Config.MODEL_PATH}")
-            
-            self._model = keras.models.load_model(Config.MODEL_PATH)
-            
+            backend_name = self._backend_name or Config.INFERENCE_BACKEND
+            if backend_name == 'keras' and not ModelLoader._tf_threading_configured:
+                self.configure_threading()
+                ModelLoader._tf_threading_configured = True
+            precision = self._resolve_precision(backend_name)
+            model_content, model_version = self._preloaded_model or (None, None)
+            self._backend = create_backend(backend_name, self._model_path, precision, model_content)
+            # Keras model, only available (and only needed for Grad-CAM) on the keras backend
+            self._model = getattr(self._backend, 'model', None)
+            # Outputs differ slightly per precision, so it is part of the version (and cache key)
+            self._model_version = (model_version or self._compute_model_version()) + (
+                f'+{precision}' if precision != 'float32' else '')
+            self._gradcam = self._build_gradcam_engine()
+            self._schedulers = self._build_schedulers()
+            if Config.MODEL_WARMUP:
+                self.warm_up()
+        
         except Exception as e:
-            print(f"Error loading model: {str(e)}")
+            logger.exception("Error loading model")
+            self._set_status('failed', error=str(e))
             raise
+        
+        self._set_status('ready', load_seconds=time.perf_counter() - start)
+    
+    def _resolve_precision(self, backend_name):
+        """
+        Precision to load the model with: Config.MODEL_PRECISION when its
+        calibration record for this model file is within the Config
+        tolerances, float32 otherwise
+        """
+        precision = Config.MODEL_PRECISION
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown MODEL_PRECISION '{precision}' (options: {', '.join(PRECISIONS)})")
+        if precision == 'float32':
+            return precision
+        
+        if backend_name != 'keras':
+            logger.warning("MODEL_PRECISION=%s only applies to the keras backend; "
+                           "export a quantized model for the %s backend instead", precision, backend_name)
+            return 'float32'
+        
+        model_path = self._model_path or Config.MODEL_PATH
+        reason = check_calibration(
+            model_path, model_file_version(model_path), precision,
+            Config.PRECISION_MAX_PROBABILITY_DELTA, Config.PRECISION_MAX_LABEL_FLIPS
+        )
+        if reason is not None:
+            logger.warning("MODEL_PRECISION=%s not enabled for %s, serving float32: %s",
+                           precision, model_path, reason)
+            return 'float32'
+        
+        logger.info("Serving %s at %s precision", model_path, precision)
+        return precision
+    
+    def preload_model_file(self):
+        """
+        Read the model file into memory ahead of load_model()
+        
+        Called by the gunicorn master before it forks the workers: they build
+        their interpreters on this buffer and share its pages with the master
+        instead of each holding a copy. Only the tflite backend can run on a
+        shared buffer; Keras and ONNX Runtime copy the weights into their own
+        per-process structures, so nothing is preloaded for them.
+        
+        Returns:
+            True if the model file was preloaded
+        """
+        backend_name = self._backend_name or Config.INFERENCE_BACKEND
+        if backend_name != 'tflite':
+            return False
+        
+        model_path = self._model_path or Config.TFLITE_MODEL_PATH
+        with open(model_path, 'rb') as f:
+            self._preloaded_model = (f.read(), model_file_version(model_path))
+        return True
+    
+    def start_background_load(self):
+        """
+        Load the model in a daemon thread so the HTTP server can start serving
+        (health checks) right away. No-op if a load is running or done.
+        
+        Returns:
+            the loading thread, or None if no load was started
+        """
+        with self._load_lock:
+            if self._status in ('loading', 'ready'):
+                return None
+            self._set_status('loading')
+        
+        def load():
+            try:
+                self.load_model()
+            except Exception:
+                pass  # Already recorded as 'failed' by load_model
+        
+        thread = threading.Thread(target=load, name='model-loader', daemon=True)
+        thread.start()
+        return thread
+    
+    def close(self):
+        """
+        Stop the micro-batching workers and drop the backend, so the model
+        can be freed. Used by the model registry once a removed model has no
+        requests in flight; the loader reports 'not_loaded' afterwards.
+        """
+        with self._load_lock:
+            schedulers, self._schedulers = self._schedulers, {}
+            self._backend = None
+            self._model = None
+            self._gradcam = None
+            self._model_version = None
+            self._set_status('not_loaded')
+        
+        for scheduler in schedulers.values():
+            scheduler.close()
+    
+    def warm_up(self):
+        """
+        Run one inference (and Grad-CAM pass) on a blank image so the first
+        real request does not pay for graph tracing and kernel initialization
+        """
+        width, height = Config.MODEL_INPUT_SIZE
+        img_array = self.preprocess_image(Image.new('RGB', (width, height), (128, 128, 128)))
+        self.run_model(img_array)
+        if self._gradcam is not None:
+            _, conv_output, grads = self._gradcam.compute(img_array)
+            self._heatmap_from_gradients(conv_output, grads)
+    
+    def _set_status(self, status, error=None, load_seconds=None):
+        self._status = status
+        self._load_error = error
+        if load_seconds is not None:
+            self._load_seconds = load_seconds
+    
+    def get_status(self):
+        """
+        Get the model load state
+        
+        Returns:
+            dict with status ('not_loaded', 'loading', 'ready' or 'failed'),
+            the load error if any and the load time once ready
+        """
+        status = {'status': self._status}
+        if self._load_error:
+            status['error'] = self._load_error
+        if self._load_seconds is not None:
+            status['load_seconds'] = round(self._load_seconds, 2)
+        return status
     
     def preprocess_image(self, image):
         """
@@ -48,7 +538,10 @@ class ModelLoader:
             numpy array ready for model prediction
         """
         # Resize to model input size
-        img_resized = image.resize(Config.MODEL_INPUT_SIZE, Image.Resampling.LANCZOS)
+        if Config.FAST_PREPROCESS:
+            img_resized = self._fast_resize(image)
+        else:
+            img_resized = image.resize(Config.MODEL_INPUT_SIZE, Image.Resampling.LANCZOS)
         
         # Convert to RGB if needed
         if img_resized.mode != 'RGB':
@@ -64,6 +557,7 @@ class ModelLoader:
             pass
         elif Config.MODEL_NORMALIZATION == 'imagenet':
             # ImageNet normalization (mean subtraction and std division)
+            from tensorflow import keras
             img_array = keras.applications.imagenet_utils.preprocess_input(
                 img_array, mode='tf'
             )
@@ -79,6 +573,38 @@ class ModelLoader:
         
         return img_array
     
+    def _fast_resize(self, image):
+        """
+        Resize to the model input size using a reduced-resolution JPEG decode
+        
+        JPEG sources are re-opened from their buffer (the caller's image is left
+        untouched) and decoded with Image.draft straight to the smallest DCT
+        scale that is still FAST_PREPROCESS_DRAFT_FACTOR times the input size.
+        The remaining downscale uses BILINEAR with a reducing gap.
+        """
+        width, height = Config.MODEL_INPUT_SIZE
+        factor = Config.FAST_PREPROCESS_DRAFT_FACTOR
+        
+        reduced = self._open_jpeg_copy(image)
+        if reduced is not None and reduced.draft('RGB', (width * factor, height * factor)):
+            image = reduced
+        
+        return image.resize(
+            Config.MODEL_INPUT_SIZE, Image.Resampling.BILINEAR, reducing_gap=float(factor)
+        )
+    
+    def _open_jpeg_copy(self, image):
+        """Open an independent, not yet decoded copy of a JPEG image, if possible"""
+        if image.format != 'JPEG':
+            return None
+        
+        fp = getattr(image, 'fp', None)
+        if isinstance(fp, BytesIO):
+            return Image.open(BytesIO(fp.getvalue()))
+        if getattr(image, 'filename', None):
+            return Image.open(image.filename)
+        return None
+    
     def predict(self, image):
         """
         Make prediction on an image
@@ -89,15 +615,221 @@ class ModelLoader:
         Returns:
             dict with prediction results
         """
-        if self._model is None:
+        if not self.is_loaded():
             raise RuntimeError("Model not loaded")
         
         # Preprocess image
-        processed_image = self.preprocess_image(image)
+        with stage('preprocess'):
+            processed_image = self.preprocess_image(image)
+        
+        # Make prediction (through the micro-batching scheduler when enabled)
+        with stage('inference'):
+            if 'predict' in self._schedulers:
+                prediction = self._schedulers['predict'].run(processed_image[0])
+            else:
+                prediction = self.run_model(processed_image)
+        
+        return self._parse_prediction(prediction)
+    
+    def predict_tta(self, image, n_views):
+        """
+        Make a test-time augmented prediction on an image
+        
+        The flipped, rotated and cropped views are built as one batch and
+        scored in a single forward pass; the prediction is made from the mean
+        of the view outputs.
+        
+        Args:
+            image: PIL Image object
+            n_views: number of views (1 to len(TTA_VIEW_NAMES))
+            
+        Returns:
+            dict with prediction results, plus 'tta' with the view names and the
+            mean, variance and standard deviation of the malignant probability
+            and the share of views agreeing with the prediction
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded")
+        
+        with stage('preprocess'):
+            processed_image = self.preprocess_image(image)
+        with stage('tta_views'):
+            views, view_names = build_views(processed_image, n_views, Config.TTA_CROP_SCALE)
+        
+        BATCH_SIZE.observe(len(views), source='tta')
+        with stage('inference_tta'):
+            predictions = np.asarray(self.run_model(views), dtype=np.float64)
+        
+        result = self._parse_prediction(predictions.mean(axis=0, keepdims=True))
+        malignant = predictions[:, 0] if predictions.shape[-1] == 1 else predictions[:, 1]
+        view_labels = malignant > 0.5
+        result['tta'] = {
+            'views': len(view_names),
+            'view_names': view_names,
+            'malignant_probability_mean': round(float(malignant.mean()), 4),
+            'malignant_probability_variance': round(float(malignant.var()), 6),
+            'malignant_probability_std': round(float(malignant.std()), 4),
+            'agreement': round(float(np.mean(view_labels == (result['prediction'] == 'Maligno'))), 4)
+        }
+        return result
+    
+    def predict_batch(self, img_arrays):
+        """
+        Make predictions on a batch of preprocessed images in one forward pass
+        
+        Args:
+            img_arrays: list of arrays returned by preprocess_image
+            
+        Returns:
+            list of dicts with prediction results, in input order
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded")
+        
+        BATCH_SIZE.observe(len(img_arrays), source='batch')
+        with stage('inference_batch'):
+            predictions = self.run_model(np.concatenate(img_arrays, axis=0))
         
-        # Make prediction
-        prediction = self._model.predict(processed_image, verbose=0)
+        return [self._parse_prediction(predictions[i:i + 1]) for i in range(len(predictions))]
+    
+    def run_model(self, img_array):
+        """
+        Run the model on a preprocessed batch
+        
+        Args:
+            img_array: preprocessed numpy array with batch dimension
+            
+        Returns:
+            numpy array with the raw model outputs
+        """
+        return self._backend.run(img_array)
+    
+    def forward_with_gradients(self, img_array):
+        """
+        Run a single taped forward pass through the Grad-CAM engine
         
+        Args:
+            img_array: preprocessed numpy array with batch dimension
+            
+        Returns:
+            tuple (predictions, last conv activations, gradients) as numpy arrays
+        """
+        if self._gradcam is None:
+            raise RuntimeError("Grad-CAM not available for this model")
+        
+        if 'gradcam' in self._schedulers and len(img_array) == 1:
+            return self._schedulers['gradcam'].run(img_array[0])
+        
+        return self._gradcam.compute(img_array)
+    
+    def predict_with_gradcam(self, image):
+        """
+        Make prediction and Grad-CAM heatmap on an image from one forward pass
+        
+        Args:
+            image: PIL Image object
+            
+        Returns:
+            tuple (dict with prediction results, heatmap numpy array or None)
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded")
+        
+        if self._gradcam is None:
+            # No conv layer usable for Grad-CAM - fall back to plain prediction
+            return self.predict(image), None
+        
+        with stage('preprocess'):
+            processed_image = self.preprocess_image(image)
+        with stage('inference_gradcam'):
+            prediction, conv_output, grads = self.forward_with_gradients(processed_image)
+        try:
+            with stage('gradcam_heatmap'):
+                heatmap = self._heatmap_from_gradients(conv_output, grads)
+        except Exception:
+            logger.exception("Error generating Grad-CAM heatmap")
+            GRADCAM_FAILURES.inc(mode='inline')
+            heatmap = None
+        
+        return self._parse_prediction(prediction), heatmap
+    
+    def gradcam_heatmap(self, image):
+        """
+        Compute only the Grad-CAM heatmap of an image (e.g. in a background job
+        after the prediction was returned with predict())
+        
+        Args:
+            image: PIL Image object
+            
+        Returns:
+            heatmap numpy array
+        """
+        if not self.is_loaded():
+            raise RuntimeError("Model not loaded")
+        
+        with stage('preprocess'):
+            processed_image = self.preprocess_image(image)
+        with stage('gradcam'):
+            _, conv_output, grads = self.forward_with_gradients(processed_image)
+            return self._heatmap_from_gradients(conv_output, grads)
+    
+    @staticmethod
+    def _heatmap_from_gradients(conv_output, grads):
+        from gradcam import heatmap_from_gradients
+        return heatmap_from_gradients(conv_output[0], grads[0])
+    
+    def is_gradcam_available(self):
+        """Whether Grad-CAM heatmaps can be computed with the loaded model"""
+        return self._gradcam is not None
+    
+    def _build_gradcam_engine(self):
+        """Resolve the last conv layer and build the compiled Grad-CAM engine"""
+        if not self._backend.supports_gradcam:
+            return None
+        
+        from gradcam import GradCamEngine
+        
+        try:
+            return GradCamEngine(self._model)
+        except ValueError as e:
+            logger.warning("Grad-CAM unavailable: %s", e)
+            return None
+    
+    def _build_schedulers(self):
+        """Create micro-batching schedulers in front of the forward passes"""
+        if not Config.BATCHING_ENABLED:
+            return {}
+        
+        schedulers = {
+            'predict': BatchScheduler(
+                self.run_model,
+                Config.BATCH_MAX_SIZE, Config.BATCH_MAX_WAIT_MS, name='predict'
+            )
+        }
+        if self._gradcam is not None:
+            schedulers['gradcam'] = BatchScheduler(
+                self._gradcam.compute,
+                Config.BATCH_MAX_SIZE, Config.BATCH_MAX_WAIT_MS, name='gradcam'
+            )
+        return schedulers
+    
+    def get_batching_stats(self):
+        """Get queue depth and batch size metrics of each scheduler"""
+        return {
+            'enabled': bool(self._schedulers),
+            'schedulers': {name: s.get_stats() for name, s in self._schedulers.items()}
+        }
+    
+    def _parse_prediction(self, prediction):
+        """
+        Convert raw model output into the prediction result dict
+        
+        Args:
+            prediction: numpy array of shape (1, n_outputs)
+            
+        Returns:
+            dict with prediction results
+        """
         # Parse prediction results
         # Model output shape is (None, 1) - single sigmoid output
         if prediction.shape[-1] == 1:
@@ -105,15 +837,13 @@ class ModelLoader:
             malignant_prob = float(prediction[0][0])
             benign_prob = 1.0 - malignant_prob
             
-            # Debug logging
-            print(f"Raw prediction value: {prediction[0][0]}")
-            print(f"Malignant probability: {malignant_prob:.4f}")
-            print(f"Benign probability: {benign_prob:.4f}")
+            logger.debug("Raw prediction value: %s, malignant probability: %.4f, benign probability: %.4f",
+                         prediction[0][0], malignant_prob, benign_prob)
         else:
             # Multiple outputs (softmax) - [benign, malignant]
             benign_prob = float(prediction[0][0])
             malignant_prob = float(prediction[0][1])
-            print(f"Benign prob: {benign_prob:.4f}, Malignant prob: {malignant_prob:.4f}")
+            logger.debug("Benign prob: %.4f, Malignant prob: %.4f", benign_prob, malignant_prob)
         
         # Determine prediction class using 0.5 threshold for sigmoid
         is_malignant = malignant_prob > 0.5
@@ -131,16 +861,29 @@ class ModelLoader:
     
     def get_model_info(self):
         """Get information about the loaded model"""
-        if self._model is None:
+        if not self.is_loaded():
             return None
         
         return {
-            'input_shape': str(self._model.input_shape),
-            'output_shape': str(self._model.output_shape),
-            'total_params': self._model.count_params(),
-            'model_path': Config.MODEL_PATH
+            **self._backend.get_info(),
+            'model_path': self._backend.model_path,
+            'model_version': self._model_version,
+            'backend': self._backend.name,
+            'gradcam_available': self._gradcam is not None
         }
-
+    
+    def is_loaded(self):
+        """Whether a model is loaded, warmed up and ready for inference"""
+        return self._status == 'ready'
+    
+    def get_model_version(self):
+        """Return an identifier of the loaded model weights"""
+        return self._model_version
+    
+    def _compute_model_version(self):
+        """Derive a version from the model file name, size and modification time"""
+        return model_file_version(self._backend.model_path)
+    
     def get_model(self):
-        """Return the underlying Keras model instance"""
+        """Return the underlying Keras model instance (None on non-keras backends)"""
         return self._model
@@ -0,0 +1,385 @@
+"""
+Model Registry Module - Versioned models served side by side
+Background loading and warm-up, atomic swap of the default model and
+percentage-based A/B routing to a candidate model
+"""
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+
+from config import Config
+from metrics import MODEL_INFERENCE_SECONDS, MODEL_ERRORS
+from model_loader import ModelLoader, INFERENCE_BACKENDS
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """Request count, errors and latency percentiles over the most recent calls"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._requests = 0
+        self._errors = 0
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self._requests += 1
+            if error:
+                self._errors += 1
+            else:
+                self._latencies.append(seconds)
+
+    def get_stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {'requests': self._requests, 'errors': self._errors}
+
+        if latencies:
+            def percentile(q):
+                return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)
+            stats.update(
+                mean_ms=round(sum(latencies) / len(latencies) * 1000, 2),
+                p50_ms=percentile(0.50),
+                p95_ms=percentile(0.95),
+                p99_ms=percentile(0.99),
+                window=len(latencies)
+            )
+        return stats
+
+
+class RegisteredModel:
+    """
+    A named model of the registry: its loader, where it came from and its stats
+
+    Requests hold the model between acquire() and release(). Once the model is
+    removed from the registry (retire()), no new request can acquire it and
+    its loader is closed when the last of them releases it.
+    """
+
+    def __init__(self, name, loader, path, backend):
+        self.name = name
+        self.loader = loader
+        self.path = path
+        self.backend = backend
+        self.stats = LatencyStats()
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._retired = False
+        self.closed = False
+
+    def acquire(self):
+        """Hold the model for a new request; False once it was removed from the registry"""
+        with self._lock:
+            if self._retired:
+                return False
+            self._in_flight += 1
+            return True
+
+    def retain(self):
+        """
+        Hold the model once more for a caller that already holds it (e.g. to
+        hand it to a background job). Allowed after retire(): a held model
+        cannot have been closed.
+        """
+        with self._lock:
+            self._in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            close = self._close_if_idle()
+        if close:
+            self._close()
+
+    def retire(self):
+        """Close the loader once no request holds the model any more"""
+        with self._lock:
+            self._retired = True
+            close = self._close_if_idle()
+        if close:
+            self._close()
+
+    def _close_if_idle(self):
+        if self._retired and self._in_flight == 0 and not self.closed:
+            self.closed = True
+            return True
+        return False
+
+    def _close(self):
+        logger.info("Closing model %s", self.name)
+        self.loader.close()
+
+    def get_info(self):
+        info = {
+            'name': self.name,
+            'path': self.path,
+            'backend': self.backend,
+            **self.loader.get_status(),
+            'model_version': self.loader.get_model_version(),
+            'latency': self.stats.get_stats()
+        }
+        return info
+
+
+class ModelRegistry:
+    """
+    Serves several versioned models side by side
+
+    The desired state is a dict: {"models": {name: {"path", "backend"}},
+    "default": name, "candidate": name or None, "candidate_percent": 0-100}.
+    apply() loads new models in background threads (with warm-up) and unloads
+    removed ones. The default model is only swapped once the new one is ready,
+    and the candidate only gets traffic once ready, so requests never wait on a
+    cold model. Routing reads one (default, candidate, percent) tuple that is
+    replaced atomically, and each request keeps the model it was routed to, so
+    a swap never affects in-flight requests.
+
+    With a state file, every worker applies the same state: changes are written
+    to the file and each worker polls it every poll_seconds.
+    """
+
+    def __init__(self, primary_loader, primary_name, state_file=None, poll_seconds=5):
+        """
+        Initialize the registry with the Config model as its first model
+
+        Args:
+            primary_loader: the ModelLoader singleton
+            primary_name: registry name of the Config model
+            state_file: JSON file with the desired state shared by the workers
+            poll_seconds: how often workers check the state file for changes
+        """
+        self.state_file = state_file
+        self.poll_seconds = poll_seconds
+
+        self._lock = threading.RLock()
+        primary = RegisteredModel(
+            primary_name, primary_loader,
+            getattr(Config, INFERENCE_BACKENDS[Config.INFERENCE_BACKEND][1]), Config.INFERENCE_BACKEND
+        )
+        self._models = {primary_name: primary}
+        self._state = {
+            'models': {primary_name: {'path': primary.path, 'backend': primary.backend}},
+            'default': primary_name,
+            'candidate': None,
+            'candidate_percent': 0
+        }
+        # (default model, candidate model or None, candidate percent)
+        self._routing = (primary, None, 0)
+        self._state_mtime = None
+        self._poller = None
+
+    def start(self):
+        """Apply the state file and start polling it (call in each serving process)"""
+        if self.state_file:
+            self._poll_state_file()
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, name='model-registry', daemon=True)
+                self._poller.start()
+
+    def route(self, routing_key):
+        """
+        Pick and acquire the model serving a request
+
+        Args:
+            routing_key: bytes identifying the request (e.g. the image), so the
+                same input is always served by the same model
+
+        Returns:
+            RegisteredModel, to release() when the request is done with it
+        """
+        while True:
+            default, candidate, percent = self._routing
+            if candidate is not None and zlib.crc32(routing_key) % 10000 < percent * 100:
+                model = candidate
+            else:
+                model = default
+            # Retired only if removed since the routing was read: route again
+            if model.acquire():
+                return model
+
+    def acquire_default(self):
+        """Acquire the default model (release() it when done)"""
+        while True:
+            model = self._routing[0]
+            if model.acquire():
+                return model
+
+    def get_default(self):
+        """The model serving the requests not routed to the candidate"""
+        return self._routing[0]
+
+    def record(self, model, seconds, error=False):
+        """Record the inference latency of a request served by model"""
+        model.stats.record(seconds, error)
+        if error:
+            MODEL_ERRORS.inc(model=model.name)
+        else:
+            MODEL_INFERENCE_SECONDS.observe(seconds, model=model.name)
+
+    def get_state(self):
+        """Copy of the desired state"""
+        with self._lock:
+            return json.loads(json.dumps(self._state))
+
+    def update(self, change):
+        """
+        Change the desired state, persist it for the other workers and apply it
+
+        Args:
+            change: function taking a copy of the state and modifying it in place
+                (raise ValueError to reject the change)
+        """
+        with self._lock:
+            if self.state_file:
+                # Start from the latest state, which another worker may have changed
+                self._poll_state_file()
+            state = self.get_state()
+            change(state)
+            self._validate(state)
+            if self.state_file:
+                self._write_state_file(state)
+            self.apply(state)
+
+    def apply(self, state):
+        """Load, unload and route models to match the desired state"""
+        with self._lock:
+            self._state = state
+            for name, spec in state['models'].items():
+                model = self._models.get(name)
+                if model is None:
+                    self._models[name] = self._start_load(name, spec)
+                elif (model.path, model.backend) != (spec['path'], spec['backend']):
+                    logger.warning("Model %s is already registered with another file; "
+                                   "register new versions under a new name", name)
+
+            self._update_routing()
+
+    def get_info(self):
+        """Registry state: default, candidate and every model with its status and latency"""
+        with self._lock:
+            default, candidate, percent = self._routing
+            return {
+                'default': default.name,
+                'candidate': candidate.name if candidate is not None else None,
+                'candidate_percent': percent if candidate is not None else 0,
+                'desired': self.get_state(),
+                'models': {name: model.get_info() for name, model in self._models.items()}
+            }
+
+    def resolve_path(self, path):
+        """
+        Resolve a model path of a registration request against Config.MODEL_DIR
+
+        Raises:
+            ValueError: if the file is outside MODEL_DIR or does not exist
+        """
+        model_dir = os.path.realpath(Config.MODEL_DIR)
+        resolved = os.path.realpath(os.path.join(model_dir, path))
+        if os.path.commonpath([model_dir, resolved]) != model_dir:
+            raise ValueError(f"Model files must be inside {Config.MODEL_DIR}")
+        if not os.path.isfile(resolved):
+            raise ValueError(f"Model file not found: {path}")
+        return resolved
+
+    def _validate(self, state):
+        models = state['models']
+        if state['default'] not in models:
+            raise ValueError(f"Unknown default model: {state['default']}")
+        if state['candidate'] is not None and state['candidate'] not in models:
+            raise ValueError(f"Unknown candidate model: {state['candidate']}")
+        if state['candidate'] is not None and state['candidate'] == state['default']:
+            raise ValueError("The candidate model is already the default")
+        if not 0 <= state['candidate_percent'] <= 100:
+            raise ValueError("candidate_percent must be between 0 and 100")
+        for name, spec in models.items():
+            if spec['backend'] not in INFERENCE_BACKENDS:
+                raise ValueError(f"Unknown inference backend for {name}: {spec['backend']}")
+
+    def _start_load(self, name, spec):
+        """Register a model and load it (with warm-up) in a background thread"""
+        logger.info("Loading model %s from %s (%s)", name, spec['path'], spec['backend'])
+        # Relative paths (e.g. edited into the state file) are relative to MODEL_DIR
+        model_path = os.path.join(Config.MODEL_DIR, spec['path'])
+        model = RegisteredModel(name, ModelLoader.for_model(model_path, spec['backend']),
+                                spec['path'], spec['backend'])
+
+        def load():
+            try:
+                model.loader.load_model()
+            except Exception:
+                return  # Logged and recorded as 'failed' by load_model
+            if model.closed:
+                # Removed while loading
+                model.loader.close()
+                return
+            logger.info("Model %s ready (version %s)", name, model.loader.get_model_version())
+            with self._lock:
+                self._update_routing()
+
+        threading.Thread(target=load, name=f'model-load-{name}', daemon=True).start()
+        return model
+
+    def _update_routing(self):
+        """Point the routing at the desired models that are ready (with the lock held)"""
+        state = self._state
+        default, candidate, percent = self._routing
+
+        wanted = self._models.get(state['default'])
+        if wanted is not None and wanted is not default and wanted.loader.is_loaded():
+            logger.info("Default model swapped: %s -> %s", default.name, wanted.name)
+            default = wanted
+
+        candidate = self._models.get(state['candidate']) if state['candidate'] else None
+        if candidate is not None and (candidate is default or not candidate.loader.is_loaded()):
+            candidate = None
+
+        self._routing = (default, candidate, state['candidate_percent'] if candidate else 0)
+
+        # Models removed from the state are dropped once they no longer serve as
+        # default, and closed once the requests already routed to them finish
+        for name in list(self._models):
+            if name not in state['models'] and self._models[name] is not default:
+                logger.info("Unloading model %s", name)
+                self._models.pop(name).retire()
+
+    def _write_state_file(self, state):
+        tmp_path = f'{self.state_file}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        # Atomic so the other workers never read a partial file
+        os.replace(tmp_path, self.state_file)
+        self._state_mtime = os.stat(self.state_file).st_mtime_ns
+
+    def _poll_state_file(self):
+        try:
+            mtime = os.stat(self.state_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._state_mtime:
+            return
+        self._state_mtime = mtime
+
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                state = json.load(f)
+            self._validate(state)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Ignoring invalid model registry file %s: %s", self.state_file, e)
+            return
+
+        self.apply(state)
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self._poll_state_file()
+            except Exception:
+                logger.exception("Error polling the model registry file")
@@ -0,0 +1,166 @@
+"""
+Precision Module - Reduced-precision CPU inference for the Keras model
+Applies bfloat16 compute or int8 weights at load time, and keeps the
+calibration record that allows a precision only within the accuracy tolerances
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 'float32': the model as saved
+# 'bfloat16': mixed precision, bf16 compute with float32 weights (fast on CPUs
+#   with AVX512-BF16 / AMX); the output layer stays float32
+# 'int8': int8 weights for the layers Keras can quantize (Dense, EinsumDense).
+#   Convolutions stay float32, so on a CNN this mostly shrinks the dense head;
+#   for int8 convolutions serve a full-integer TFLite export instead
+#   (export_model.py tflite --quantize int8, without Grad-CAM)
+PRECISIONS = ('float32', 'bfloat16', 'int8')
+
+
+def apply_precision(model, precision):
+    """
+    Switch a loaded Keras model to a reduced precision, in place
+
+    Args:
+        model: Keras model (built, with its weights loaded)
+        precision: one of PRECISIONS
+
+    Returns:
+        the model
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision '{precision}' (options: {', '.join(PRECISIONS)})")
+
+    if precision == 'bfloat16':
+        # Inputs and the output layer keep float32, so probabilities are not rounded to bf16
+        output_layers = set(model.output_names)
+        for layer in model.layers:
+            if layer.name in output_layers:
+                continue
+            for sublayer in _flatten_layers(layer):
+                if sublayer.__class__.__name__ != 'InputLayer':
+                    sublayer.dtype_policy = 'mixed_bfloat16'
+    elif precision == 'int8':
+        quantizable = [layer.name for layer in int8_quantizable_layers(model)]
+        if not quantizable:
+            raise ValueError("The model has no layers Keras can quantize to int8")
+        share = int8_weight_share(model)
+        model.quantize('int8')
+        logger.info("Quantized %d layers to int8 weights (%.1f%% of the parameters, "
+                    "convolutions stay float32): %s", len(quantizable), 100 * share, ', '.join(quantizable))
+
+    return model
+
+
+def _flatten_layers(layer):
+    """A layer and, for nested models (e.g. a pretrained backbone), all the layers inside"""
+    yield layer
+    for sublayer in getattr(layer, 'layers', ()):
+        yield from _flatten_layers(sublayer)
+
+
+def int8_quantizable_layers(model):
+    """Layers model.quantize('int8') converts (Dense, EinsumDense; not convolutions)"""
+    return [layer for layer in _flatten_layers(model)
+            if layer.__class__.__name__ in ('Dense', 'EinsumDense')]
+
+
+def int8_weight_share(model):
+    """Fraction (0-1) of the model parameters that int8 quantizes"""
+    quantized = sum(layer.count_params() for layer in int8_quantizable_layers(model))
+    return quantized / max(model.count_params(), 1)
+
+
+def malignant_probabilities(outputs):
+    """Malignant probability (0-100) of each row of raw model outputs"""
+    return np.asarray(outputs, dtype=np.float32)[:, -1] * 100.0
+
+
+def measure_agreement(reference, outputs):
+    """
+    Compare reduced-precision outputs with the float32 ones
+
+    Args:
+        reference: raw float32 model outputs for the reference images
+        outputs: raw outputs of the same images at the reduced precision
+
+    Returns:
+        dict with max_probability_delta, mean_probability_delta (percentage
+        points) and label_flips
+    """
+    reference = malignant_probabilities(reference)
+    probabilities = malignant_probabilities(outputs)
+    delta = np.abs(probabilities - reference)
+    return {
+        'max_probability_delta': round(float(delta.max()), 4),
+        'mean_probability_delta': round(float(delta.mean()), 4),
+        'label_flips': int(np.sum((probabilities > 50.0) != (reference > 50.0)))
+    }
+
+
+def within_tolerance(agreement, max_probability_delta, max_label_flips):
+    return (agreement['max_probability_delta'] <= max_probability_delta
+            and agreement['label_flips'] <= max_label_flips)
+
+
+def calibration_path(model_path):
+    """Calibration record of a model file, stored next to it"""
+    return f'{model_path}.precision.json'
+
+
+def read_calibration(model_path):
+    """Get the calibration record of a model file, or None if there is none"""
+    try:
+        with open(calibration_path(model_path), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_calibration(model_path, record):
+    path = calibration_path(model_path)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def check_calibration(model_path, model_version, precision, max_probability_delta, max_label_flips):
+    """
+    Check that a precision was calibrated for this model file and stays within tolerance
+
+    Args:
+        model_path: model file
+        model_version: version of the file (name, size and mtime), so a
+            record of a replaced file is not trusted
+        precision: reduced precision to enable
+        max_probability_delta: tolerance in percentage points
+        max_label_flips: tolerance in label flips
+
+    Returns:
+        None if the precision can be enabled, else the reason it cannot
+    """
+    try:
+        record = read_calibration(model_path)
+    except (OSError, ValueError) as e:
+        return f"unreadable calibration record: {e}"
+    if record is None:
+        return f"no calibration record (run: python export_model.py calibrate --precision {precision})"
+    if record.get('model_version') != model_version:
+        return "the calibration record is for another version of the model file"
+
+    agreement = record.get('precisions', {}).get(precision)
+    if agreement is None:
+        return f"{precision} was not calibrated for this model"
+    if not agreement.get('gradcam_ok', False):
+        return f"Grad-CAM failed at {precision} during calibration"
+    if not within_tolerance(agreement, max_probability_delta, max_label_flips):
+        return (f"{precision} exceeds the tolerance on the reference images "
+                f"(max delta {agreement['max_probability_delta']} pp, "
+                f"{agreement['label_flips']} label flips)")
+    return None
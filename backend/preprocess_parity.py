@@ -0,0 +1,139 @@
+"""
+Accuracy-parity check for the fast preprocessing path (Config.FAST_PREPROCESS)
+Compares reduced-resolution JPEG decode + BILINEAR against full decode + LANCZOS
+
+Usage: python preprocess_parity.py [image_dir] [--model path/to/model.h5]
+Without image_dir, synthetic lesion-like JPEGs of several resolutions are used.
+Exits with status 1 if any image goes over the tolerances. The synthetic
+comparison also runs in the test suite (tests/test_preprocess_parity.py).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from config import Config
+
+# Tolerances on the 0-255 model input scale
+MAX_MEAN_ABS_DIFF = 3.0
+MAX_P99_ABS_DIFF = 20.0
+# Tolerance on the malignant probability (percentage points), when a model is given
+MAX_PROBABILITY_DELTA = 2.0
+
+SYNTHETIC_RESOLUTIONS = [(640, 480), (1600, 1200), (3024, 4032), (4000, 3000)]
+
+
+def make_synthetic_lesion(width, height, seed=0):
+    """Create a smooth skin-toned image with a dark irregular lesion, as JPEG bytes"""
+    rng = np.random.RandomState(seed)
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[:] = (200, 160, 140)
+
+    # Irregular lesion: ellipse plus noise, blurred edges
+    mask = np.zeros((height, width), dtype=np.uint8)
+    center = (width // 2 + rng.randint(-width // 10, width // 10),
+              height // 2 + rng.randint(-height // 10, height // 10))
+    axes = (int(min(width, height) * rng.uniform(0.15, 0.3)),
+            int(min(width, height) * rng.uniform(0.1, 0.25)))
+    cv2.ellipse(mask, center, axes, rng.uniform(0, 180), 0, 360, 255, -1)
+    blur = max(3, (min(width, height) // 50) | 1)
+    mask = cv2.GaussianBlur(mask, (blur, blur), 0).astype(np.float32) / 255.0
+
+    lesion = np.array((90, 55, 40), dtype=np.float32)
+    image = image * (1 - mask[..., None]) + lesion * mask[..., None]
+
+    # Fine texture (hair/pores-like high frequencies)
+    image += rng.normal(0, 6, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+
+    buffered = BytesIO()
+    Image.fromarray(image).save(buffered, format='JPEG', quality=92)
+    return buffered.getvalue()
+
+
+def iter_sources(image_dir):
+    """Yield (name, JPEG bytes) pairs from a directory or synthetic images"""
+    if image_dir:
+        paths = sorted(glob.glob(os.path.join(image_dir, '*.jpg')) +
+                       glob.glob(os.path.join(image_dir, '*.jpeg')))
+        for path in paths:
+            with open(path, 'rb') as f:
+                yield os.path.basename(path), f.read()
+        return
+
+    for index, (width, height) in enumerate(SYNTHETIC_RESOLUTIONS):
+        yield f'synthetic-{width}x{height}', make_synthetic_lesion(width, height, seed=index)
+
+
+def preprocess(model_loader, image_bytes, fast):
+    """Preprocess image bytes with the fast path on or off, timing it"""
+    Config.FAST_PREPROCESS = fast
+    start = time.perf_counter()
+    img_array = model_loader.preprocess_image(Image.open(BytesIO(image_bytes)))
+    return img_array, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check fast preprocessing parity with LANCZOS')
+    parser.add_argument('image_dir', nargs='?', help='Directory with .jpg images (default: synthetic)')
+    parser.add_argument('--model', help='Also compare model outputs using this .h5 model')
+    args = parser.parse_args()
+
+    # Compare raw pixels regardless of the model normalization
+    normalization = Config.MODEL_NORMALIZATION
+    Config.MODEL_NORMALIZATION = 'none'
+
+    if args.model:
+        Config.MODEL_PATH = args.model
+    else:
+        # Preprocessing does not need the model; skip loading it
+        Config.DEFER_MODEL_LOAD = True
+
+    from model_loader import ModelLoader
+    model_loader = ModelLoader()
+
+    failures = 0
+    print(f"\n{'image':<28}{'mean|d|':>9}{'p99|d|':>9}{'lanczos':>10}{'fast':>9}{'dprob':>8}")
+    print('=' * 73)
+
+    for name, image_bytes in iter_sources(args.image_dir):
+        reference, ref_time = preprocess(model_loader, image_bytes, fast=False)
+        candidate, fast_time = preprocess(model_loader, image_bytes, fast=True)
+
+        diff = np.abs(reference - candidate)
+        mean_diff = float(diff.mean())
+        p99_diff = float(np.percentile(diff, 99))
+        failed = mean_diff > MAX_MEAN_ABS_DIFF or p99_diff > MAX_P99_ABS_DIFF
+
+        prob_delta = ''
+        if args.model:
+            Config.MODEL_NORMALIZATION = normalization
+            Config.FAST_PREPROCESS = False
+            ref_prob = model_loader.predict(Image.open(BytesIO(image_bytes)))['probabilities']['malignant']
+            Config.FAST_PREPROCESS = True
+            fast_prob = model_loader.predict(Image.open(BytesIO(image_bytes)))['probabilities']['malignant']
+            Config.MODEL_NORMALIZATION = 'none'
+            delta = abs(ref_prob - fast_prob)
+            failed = failed or delta > MAX_PROBABILITY_DELTA
+            prob_delta = f'{delta:.2f}'
+
+        failures += failed
+        print(f"{name[:27]:<28}{mean_diff:>9.2f}{p99_diff:>9.2f}"
+              f"{ref_time * 1000:>8.1f}ms{fast_time * 1000:>7.1f}ms{prob_delta:>8}"
+              f"{'  FAIL' if failed else ''}")
+
+    print('=' * 73)
+    print(f"Tolerances: mean|d| <= {MAX_MEAN_ABS_DIFF}, p99|d| <= {MAX_P99_ABS_DIFF}"
+          f"{f', dprob <= {MAX_PROBABILITY_DELTA}' if args.model else ''}")
+    print('PARITY FAILED' if failures else 'PARITY OK')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Profiling Module - Opt-in sampling profiler for production requests
+Profiles a fraction of requests with cProfile (and optionally a TensorFlow
+trace) into a rotating local directory
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Profile ids are generated by RequestProfiler; anything else is rejected
+PROFILE_ID_PATTERN = re.compile(r'\d{8}-\d{9}-\d+-[0-9a-f]{8}')
+
+
+class RequestProfile:
+    """A running profile of one request (see RequestProfiler.start)"""
+
+    def __init__(self, profile_id, started_at):
+        self.profile_id = profile_id
+        self.tf_trace_dir = None
+        self.started_at = started_at
+        self._start = time.perf_counter()
+        self._profile = cProfile.Profile()
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and keeps the last profiles on disk
+
+    Each sampled request gets a cProfile of the thread serving it, stored as
+    <id>.prof (pstats format) next to <id>.json with the request details and
+    duration, and optionally a TensorFlow profiler trace in <id>-tf/. At most
+    one request per process is profiled at a time: profilers are process-wide
+    on recent Pythons, and so is the TensorFlow trace. The oldest profiles are
+    deleted once there are more than max_profiles.
+    """
+
+    def __init__(self, directory, sample_rate, max_profiles=50, tf_trace=False):
+        """
+        Initialize the profiler
+
+        Args:
+            directory: where profiles are written (created if missing)
+            sample_rate: fraction of requests profiled, 0-1
+            max_profiles: number of profiles kept in the directory
+            tf_trace: also record a TensorFlow profiler trace
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self.tf_trace = tf_trace
+
+        self._active = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """
+        Start profiling the current request if it is sampled
+
+        Returns:
+            RequestProfile to pass to stop(), or None if the request is not
+            sampled or another request is being profiled
+        """
+        if random.random() >= self.sample_rate or not self._active.acquire(blocking=False):
+            return None
+
+        now = time.time()
+        profile_id = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}"
+                      f"{int(now * 1000) % 1000:03d}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        profile = RequestProfile(profile_id, started_at=now)
+        if self.tf_trace:
+            trace_dir = self._path(f'{profile_id}-tf')
+            try:
+                self._start_tf_trace(trace_dir)
+                profile.tf_trace_dir = trace_dir
+            except Exception as e:
+                logger.warning("TensorFlow trace unavailable, profiling with cProfile only: %s", e)
+
+        try:
+            profile._profile.enable()
+        except ValueError as e:
+            # Another profiler is active in the process (e.g. a debugger)
+            logger.warning("Could not start request profile: %s", e)
+            self._finish_tf_trace(profile)
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile, details):
+        """
+        Stop a profile started by start() and write it to the directory
+
+        Args:
+            profile: RequestProfile returned by start()
+            details: JSON-serializable request details stored with the profile
+        """
+        try:
+            profile._profile.disable()
+            elapsed = profile.elapsed()
+            self._finish_tf_trace(profile)
+        finally:
+            self._active.release()
+
+        try:
+            profile._profile.dump_stats(self._path(f'{profile.profile_id}.prof'))
+            meta = {
+                'id': profile.profile_id,
+                'created_at': round(profile.started_at, 3),
+                'duration_ms': round(elapsed * 1000, 2),
+                'pid': os.getpid(),
+                'tf_trace': profile.tf_trace_dir is not None,
+                **details
+            }
+            # Written last: a profile is listed once its metadata exists
+            with open(self._path(f'{profile.profile_id}.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            self._rotate()
+        except OSError as e:
+            logger.warning("Error writing request profile: %s", e)
+
+    def list_profiles(self):
+        """Get the metadata of the stored profiles, newest first"""
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(self._path(name), encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def get_profile_path(self, profile_id):
+        """Path of a stored cProfile file, or None if the id is unknown"""
+        if not PROFILE_ID_PATTERN.fullmatch(profile_id):
+            return None
+        path = self._path(f'{profile_id}.prof')
+        return path if os.path.isfile(path) else None
+
+    def get_tf_trace_archive(self, profile_id):
+        """Zip the TensorFlow trace of a profile in memory (None if it has none)"""
+        if not PROFILE_ID_PATTERN.fullmatch(profile_id):
+            return None
+        trace_dir = self._path(f'{profile_id}-tf')
+        if not os.path.isdir(trace_dir):
+            return None
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for root, _, files in os.walk(trace_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    archive.write(path, os.path.relpath(path, trace_dir))
+        return buffer.getvalue()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _rotate(self):
+        """Delete the oldest profiles beyond max_profiles (ids sort by start time)"""
+        ids = sorted(name[:-len('.json')] for name in os.listdir(self.directory)
+                     if name.endswith('.json'))
+        for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+            for name in (f'{profile_id}.json', f'{profile_id}.prof'):
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+            shutil.rmtree(self._path(f'{profile_id}-tf'), ignore_errors=True)
+
+    def _finish_tf_trace(self, profile):
+        if profile.tf_trace_dir is None:
+            return
+        try:
+            self._stop_tf_trace()
+        except Exception as e:
+            logger.warning("Error stopping TensorFlow trace: %s", e)
+            profile.tf_trace_dir = None
+
+    @staticmethod
+    def _start_tf_trace(logdir):
+        import tensorflow as tf
+        tf.profiler.experimental.start(logdir)
+
+    @staticmethod
+    def _stop_tf_trace():
+        import tensorflow as tf
+        tf.profiler.experimental.stop()
@@ -0,0 +1,208 @@
+"""
+Result Cache Module - Content-hash cache for repeated analyses
+In-process LRU with size and TTL bounds, plus an optional on-disk tier
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Caches analysis responses keyed by a hash of the image bytes and model version
+
+    Entries are stored as encoded JSON so a hit can be written straight to the
+    response without re-serializing the (large) Grad-CAM overlay. The memory
+    tier is an LRU bounded by entry count and total size; both tiers expire
+    entries after ttl_seconds. The disk tier, when a directory is given,
+    survives restarts and is shared by every worker on the machine.
+    """
+
+    # Prune the disk tier every this many writes
+    DISK_PRUNE_INTERVAL = 100
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, ttl_seconds=3600,
+                 disk_dir=None, max_disk_bytes=1024 * 1024 * 1024):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries: maximum number of entries kept in memory
+            max_bytes: maximum total size of the in-memory entries
+            ttl_seconds: time to live of an entry in both tiers
+            disk_dir: directory for the on-disk tier (None disables it)
+            max_disk_bytes: maximum total size of the on-disk tier
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, encoded JSON)
+        self._bytes = 0
+        self._disk_writes = 0
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_bytes, *parts):
+        """Build a cache key from the image bytes and extra parts (e.g. model version)"""
+        digest = hashlib.sha256(image_bytes)
+        for part in parts:
+            digest.update(b'\0' + str(part).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Get a cached value
+
+        Returns:
+            the cached value as an encoded JSON string, or None on a miss
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, encoded = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return encoded
+                self._remove(key)
+
+        entry = self._disk_get(key, now)
+
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+
+        # Promote to the memory tier for the rest of the entry's lifetime
+        expires_at, encoded = entry
+        self._memory_set(key, encoded, expires_at)
+        return encoded
+
+    def set(self, key, value):
+        """Store a JSON-serializable dict in the cache"""
+        encoded = json.dumps(value)
+        self._memory_set(key, encoded, time.time() + self.ttl_seconds)
+        with self._lock:
+            self._stats['sets'] += 1
+        self._disk_set(key, encoded)
+
+    def get_stats(self):
+        """Get hit/miss counters and occupancy"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['disk_hits'] + self._stats['misses']
+            hits = self._stats['hits'] + self._stats['disk_hits']
+            return {
+                **self._stats,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'disk_enabled': bool(self.disk_dir)
+            }
+
+    def _memory_set(self, key, encoded, expires_at):
+        if len(encoded) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, encoded)
+            self._bytes += len(encoded)
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def _remove(self, key):
+        _, encoded = self._entries.pop(key)
+        self._bytes -= len(encoded)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json')
+
+    def _disk_get(self, key, now):
+        """Get (expires_at, encoded JSON) from the disk tier, removing the file if expired"""
+        if not self.disk_dir:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            expires_at = os.path.getmtime(path) + self.ttl_seconds
+            if expires_at <= now:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return expires_at, f.read()
+        except OSError:
+            return None
+
+    def _disk_set(self, key, encoded):
+        if not self.disk_dir:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(encoded)
+            # Atomic so concurrent workers never read a partial file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Error writing result cache entry: %s", e)
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % self.DISK_PRUNE_INTERVAL == 0
+        if prune:
+            self._disk_prune()
+
+    def _disk_prune(self):
+        """Remove expired entries, then the oldest ones while over max_disk_bytes"""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if stat.st_mtime + self.ttl_seconds <= now:
+                self._disk_unlink(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            self._disk_unlink(path)
+            total -= size
+
+    @staticmethod
+    def _disk_unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,347 @@
+"""
+Offline bulk scoring of an image dataset with the served model
+
+Usage:
+    python score_dataset.py IMAGES --output scores.csv [--batch-size 32] [--readers 4]
+    python score_dataset.py manifest.csv --output scores.parquet [--checkpoint-every 1024]
+
+IMAGES is a directory (searched recursively for .jpg/.jpeg/.png), a glob
+pattern such as 'data/**/*.jpg', or a CSV manifest with a "path" column (and an
+optional "id" column; relative paths are resolved against the manifest's
+directory). Images are decoded and preprocessed by a pool of reader threads
+that stays --prefetch batches ahead of the model, and scored in fixed-size
+batches through ModelLoader.predict_batch (any INFERENCE_BACKEND).
+
+Results are streamed to a CSV file, or to a Parquet dataset directory with one
+part file per --checkpoint-every images. Both are the checkpoint: running the
+same command again skips the images already scored (use --overwrite to start
+over). Images that cannot be read or scored get a row with the error and are
+retried on the next run, so the output may hold an error row and a later
+result for the same path.
+"""
+import argparse
+import csv
+import glob
+import os
+import shutil
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from config import Config
+
+# Output columns, in order
+COLUMNS = [
+    'id', 'path', 'prediction', 'confidence', 'prob_benign', 'prob_malignant',
+    'confidence_level', 'model_version', 'error'
+]
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 5.0
+
+
+def list_images(source):
+    """
+    List the images to score
+
+    Args:
+        source: directory, glob pattern or CSV manifest path
+
+    Returns:
+        list of {"id", "path"} dicts, in a stable order
+    """
+    extensions = tuple(f'.{ext}' for ext in Config.ALLOWED_EXTENSIONS)
+
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files)
+                         if name.lower().endswith(extensions))
+        return [{'id': path, 'path': path} for path in paths]
+
+    if os.path.isfile(source) and source.lower().endswith('.csv'):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            if 'path' not in (reader.fieldnames or []):
+                raise ValueError(f'Manifest {source} has no "path" column')
+            items = []
+            for row in reader:
+                path = os.path.join(base_dir, row['path'])
+                items.append({'id': row.get('id') or row['path'], 'path': path})
+        return items
+
+    paths = sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+    if not paths:
+        raise ValueError(f'No images found for {source}')
+    return [{'id': path, 'path': path} for path in paths]
+
+
+def load_image(model_loader, path):
+    """Decode and preprocess one image file for the model (runs on a reader thread)"""
+    with Image.open(path) as image:
+        width, height = image.size
+        if width * height > Config.MAX_IMAGE_PIXELS:
+            raise ValueError(f'Image dimensions too large ({width}x{height})')
+        return model_loader.preprocess_image(image)
+
+
+def iter_batches(items, model_loader, batch_size, readers, prefetch):
+    """
+    Load images on a reader pool and yield them in batches of batch_size
+
+    Up to prefetch batches beyond the current one are queued on the pool, so
+    decoding overlaps with inference.
+
+    Yields:
+        lists of (item, future with the preprocessed array)
+    """
+    executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='reader')
+    items = iter(items)
+    pending = deque()
+
+    def fill():
+        while len(pending) < batch_size * (prefetch + 1):
+            item = next(items, None)
+            if item is None:
+                return
+            pending.append((item, executor.submit(load_image, model_loader, item['path'])))
+
+    try:
+        fill()
+        while pending:
+            batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+            fill()
+            yield batch
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def collect_batch(model_loader, batch):
+    """
+    Wait for the images of a batch and start its output rows
+
+    Returns:
+        (rows, arrays): one row per image (dicts with COLUMNS, with the error
+        filled in for images that failed to load) and the loaded arrays
+    """
+    rows, arrays = [], []
+    for item, future in batch:
+        row = dict.fromkeys(COLUMNS, '')
+        row.update(id=item['id'], path=item['path'], model_version=model_loader.get_model_version())
+        try:
+            arrays.append(future.result())
+        except Exception as e:
+            row['error'] = f'{type(e).__name__}: {str(e)}'
+        rows.append(row)
+    return rows, arrays
+
+
+def score_batch(model_loader, rows, arrays):
+    """
+    Run the loaded arrays through the model and fill in their rows
+
+    If the model fails on the batch, every loaded image of it gets the error
+    instead of aborting the run.
+    """
+    if arrays:
+        try:
+            results = iter(model_loader.predict_batch(arrays))
+        except Exception as e:
+            for row in rows:
+                if not row['error']:
+                    row['error'] = f'{type(e).__name__}: {str(e)}'
+            return
+        for row in rows:
+            if row['error']:
+                continue
+            result = next(results)
+            row.update(
+                prediction=result['prediction'],
+                confidence=result['confidence'],
+                prob_benign=result['probabilities']['benign'],
+                prob_malignant=result['probabilities']['malignant'],
+                confidence_level=result['confidence_level']
+            )
+
+
+class CsvResultWriter:
+    """Appends result rows to a CSV file, flushed after every batch"""
+
+    def __init__(self, path, overwrite=False):
+        self.path = path
+        if overwrite and os.path.exists(path):
+            os.remove(path)
+        self.done = self._read_done()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if new_file:
+            self._writer.writeheader()
+
+    def _read_done(self):
+        """Paths scored without error; drops a partial last line left by an interruption"""
+        if not os.path.exists(self.path):
+            return set()
+
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+        with open(self.path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames and reader.fieldnames != COLUMNS:
+                raise ValueError(f'{self.path} has different columns, use --overwrite')
+            return {row['path'] for row in reader if not row['error']}
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def checkpoint(self):
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """Writes result rows to a Parquet dataset directory, one part file per checkpoint"""
+
+    def __init__(self, path, overwrite=False):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit('Parquet output requires pyarrow (pip install pyarrow)')
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+
+        self.path = path
+        if overwrite and os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+        self._parts = sorted(name for name in os.listdir(path) if name.endswith('.parquet'))
+        self.done = set()
+        for name in self._parts:
+            table = self._pq.read_table(os.path.join(path, name), columns=['path', 'error'])
+            self.done.update(path for path, error in zip(table.column('path').to_pylist(),
+                                                         table.column('error').to_pylist())
+                             if not error)
+        self._rows = []
+
+    def write(self, rows):
+        self._rows.extend(rows)
+
+    def checkpoint(self):
+        """Write the buffered rows as a new part file (atomically)"""
+        if not self._rows:
+            return
+        columns = {name: [str(row[name]) for row in self._rows] for name in COLUMNS}
+        for name in ('confidence', 'prob_benign', 'prob_malignant'):
+            columns[name] = [float(value) if value != '' else None for value in columns[name]]
+
+        part = os.path.join(self.path, f'part-{len(self._parts):05d}.parquet')
+        self._pq.write_table(self._pa.table(columns), part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self._parts.append(os.path.basename(part))
+        self._rows = []
+
+    def close(self):
+        self.checkpoint()
+
+
+def run(args):
+    items = list_images(args.images)
+
+    writer_class = ParquetResultWriter if args.output.endswith('.parquet') else CsvResultWriter
+    writer = writer_class(args.output, overwrite=args.overwrite)
+    remaining = [item for item in items if item['path'] not in writer.done]
+    print(f"{len(items)} images, {len(items) - len(remaining)} already scored, "
+          f"{len(remaining)} to score -> {args.output}")
+
+    from model_loader import ModelLoader, INFERENCE_BACKENDS
+
+    if args.backend:
+        Config.INFERENCE_BACKEND = args.backend
+    if args.model:
+        # Path setting of the selected backend (MODEL_PATH, TFLITE_MODEL_PATH, ...)
+        setattr(Config, INFERENCE_BACKENDS[Config.INFERENCE_BACKEND][1], args.model)
+    Config.BACKGROUND_MODEL_LOAD = False
+
+    print("Loading model...")
+    model_loader = ModelLoader()
+    if not model_loader.is_loaded():
+        raise SystemExit(f"Model failed to load: {model_loader.get_status().get('error')}")
+
+    scored = failed = since_checkpoint = 0
+    model_seconds = 0.0
+    start = last_report = time.perf_counter()
+
+    try:
+        for batch in iter_batches(remaining, model_loader, args.batch_size, args.readers, args.prefetch):
+            rows, arrays = collect_batch(model_loader, batch)
+            batch_start = time.perf_counter()
+            score_batch(model_loader, rows, arrays)
+            model_seconds += time.perf_counter() - batch_start
+
+            writer.write(rows)
+            scored += len(rows)
+            failed += sum(1 for row in rows if row['error'])
+            since_checkpoint += len(rows)
+            if since_checkpoint >= args.checkpoint_every:
+                writer.checkpoint()
+                since_checkpoint = 0
+
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                print(f"  {scored}/{len(remaining)} images  "
+                      f"{scored / (now - start):.1f} images/s", flush=True)
+    except KeyboardInterrupt:
+        print("\nInterrupted, saving progress (run the same command to resume)")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{'='*60}")
+    print(f"Scored:     {scored} images ({failed} failed)")
+    print(f"Elapsed:    {elapsed:.1f}s")
+    if scored:
+        print(f"Throughput: {scored / elapsed:.1f} images/s")
+        print(f"Model time: {100 * model_seconds / elapsed:.0f}% "
+              f"(the rest is waiting on the readers)")
+    print(f"{'='*60}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a directory, glob or CSV manifest of images')
+    parser.add_argument('images', help='Directory, glob pattern or CSV manifest with a "path" column')
+    parser.add_argument('--output', required=True, help='Output .csv file or .parquet dataset directory')
+    parser.add_argument('--batch-size', type=int, default=Config.BATCH_ANALYSIS_SIZE)
+    parser.add_argument('--readers', type=int, default=Config.BATCH_PREPROCESS_WORKERS,
+                        help='Threads decoding and preprocessing images')
+    parser.add_argument('--prefetch', type=int, default=2, help='Batches loaded ahead of the model')
+    parser.add_argument('--checkpoint-every', type=int, default=1024,
+                        help='Images between checkpoints (fsync / new Parquet part)')
+    parser.add_argument('--overwrite', action='store_true', help='Discard existing results instead of resuming')
+    parser.add_argument('--model', help='Model file for the selected backend (defaults to its Config path)')
+    parser.add_argument('--backend', choices=['keras', 'tflite', 'onnx'],
+                        help='Inference backend (defaults to Config.INFERENCE_BACKEND)')
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except ValueError as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
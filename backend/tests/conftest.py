@@ -0,0 +1,53 @@
+"""
+Pytest configuration: flat backend modules importable, and a test model
+Run from backend/ with: python -m pytest tests
+"""
+import os
+import sys
+from io import BytesIO
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def model_path(tmp_path_factory):
+    """A small Keras model with the production input/output shapes (not trained)"""
+    from tensorflow import keras
+
+    inputs = keras.Input((224, 224, 3))
+    x = keras.layers.Rescaling(1 / 255.0)(inputs)
+    x = keras.layers.Conv2D(8, 3, strides=4, activation='relu')(x)
+    x = keras.layers.Conv2D(16, 3, strides=4, activation='relu', name='top_conv')(x)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    outputs = keras.layers.Dense(1, activation='sigmoid')(x)
+
+    path = str(tmp_path_factory.mktemp('models') / 'model.h5')
+    keras.Model(inputs, outputs).save(path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def api(model_path):
+    """The Flask app module, serving the test model without the result cache"""
+    from config import Config
+
+    Config.MODEL_PATH = model_path
+    Config.MODEL_DIR = os.path.dirname(model_path)
+    Config.DEFER_MODEL_LOAD = False
+    Config.BACKGROUND_MODEL_LOAD = False
+    Config.RESULT_CACHE_ENABLED = False
+    import api
+    return api
+
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
+
+
+def jpeg_bytes(image):
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
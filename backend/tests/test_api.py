@@ -0,0 +1,78 @@
+"""Tests for the /api/analyze endpoint"""
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from config import Config
+from conftest import jpeg_bytes
+from result_cache import ResultCache
+
+
+def analyze(client, image):
+    return client.post('/api/analyze?heatmap=none', data=jpeg_bytes(image), content_type='image/jpeg')
+
+
+def test_analyze_without_lesion(client):
+    response = analyze(client, Image.new('RGB', (300, 300), (200, 180, 170)))
+
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['success'] is True
+    assert result['lesion_detected'] is False
+    assert result['lesion_location'] is None
+    assert result['abcde_analysis'] is None
+    assert 'analysis_error' not in result
+
+
+def fail(*args, **kwargs):
+    raise RuntimeError('analysis failed')
+
+
+def test_failed_abcde_analysis_does_not_claim_a_lesion(api, client, monkeypatch):
+    monkeypatch.setattr(api.image_processor, 'process_image_bytes', fail)
+
+    response = analyze(client, Image.new('RGB', (300, 300), (200, 180, 170)))
+
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['success'] is True
+    assert result['prediction'] in ('Benigno', 'Maligno')
+    assert result['lesion_detected'] is None
+    assert result['analysis_error'] is True
+
+
+@pytest.mark.parametrize('heatmap', ['inline', 'async'])
+def test_failed_abcde_analysis_is_not_cached(api, client, monkeypatch, heatmap):
+    monkeypatch.setattr(api, 'result_cache', ResultCache())
+    process_image_bytes = api.image_processor.process_image_bytes
+    monkeypatch.setattr(api.image_processor, 'process_image_bytes', fail)
+    image = jpeg_bytes(Image.new('RGB', (300, 300), (200, 180, 170)))
+
+    result = client.post(f'/api/analyze?heatmap={heatmap}', data=image, content_type='image/jpeg').get_json()
+    assert result['analysis_error'] is True
+    if heatmap == 'async':
+        assert client.get(f"{result['heatmap_url']}?wait=30").get_json()['status'] == 'done'
+    assert api.result_cache.get_stats()['sets'] == 0
+
+    # Once the analysis works again, the same image gets a complete response
+    monkeypatch.setattr(api.image_processor, 'process_image_bytes', process_image_bytes)
+    result = client.post(f'/api/analyze?heatmap={heatmap}', data=image, content_type='image/jpeg').get_json()
+    assert 'analysis_error' not in result
+    assert result['lesion_detected'] is False
+
+
+def test_batch_rejects_oversized_parts(client, monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_IMAGE_SIZE', 1024 * 1024)
+    small = jpeg_bytes(Image.new('RGB', (300, 300), (200, 180, 170)))
+
+    response = client.post('/api/analyze/batch', content_type='multipart/form-data', data={
+        'images': [(BytesIO(small), 'small.jpg'), (BytesIO(b'\xff' * (2 * 1024 * 1024)), 'large.jpg')]
+    })
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]['id'] == 'small.jpg' and lines[0]['success'] is True
+    assert lines[1] == {'id': 'large.jpg', 'success': False, 'error': 'Image too large (max 1MB)'}
+    assert lines[2] == {'done': True, 'total': 2, 'failed': 1}
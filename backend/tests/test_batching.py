@@ -0,0 +1,56 @@
+"""Tests for the micro-batching scheduler"""
+import threading
+
+import numpy as np
+import pytest
+
+from batching import BatchScheduler
+
+
+def test_concurrent_inputs_share_a_forward_pass():
+    started, release = threading.Event(), threading.Event()
+    batch_sizes = []
+
+    def batch_fn(batch):
+        batch_sizes.append(len(batch))
+        started.set()
+        release.wait(10)
+        return batch * 2, batch.sum(axis=1)
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=50)
+    try:
+        # The first input runs alone; the next ones queue up behind it
+        futures = [scheduler.submit(np.full(3, 0.0))]
+        assert started.wait(10)
+        futures += [scheduler.submit(np.full(3, float(i))) for i in range(1, 6)]
+        assert scheduler.get_stats()['max_queue_depth'] >= 5
+        release.set()
+
+        for i, future in enumerate(futures):
+            doubled, total = future.result(10)
+            np.testing.assert_array_equal(doubled, np.full((1, 3), 2.0 * i))
+            np.testing.assert_array_equal(total, [3.0 * i])
+    finally:
+        release.set()
+        scheduler.close()
+
+    assert batch_sizes == [1, 4, 1]
+    stats = scheduler.get_stats()
+    assert stats['batches'] == 3 and stats['items'] == 6
+    assert stats['batch_size_counts'] == {'1': 2, '4': 1}
+
+
+def test_failed_batch_reaches_every_caller():
+    def batch_fn(batch):
+        raise RuntimeError('inference failed')
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=0)
+    try:
+        with pytest.raises(RuntimeError, match='inference failed'):
+            scheduler.run(np.zeros(3))
+    finally:
+        scheduler.close()
+
+    assert scheduler.get_stats()['errors'] == 1
+    with pytest.raises(RuntimeError):
+        scheduler.submit(np.zeros(3))
@@ -0,0 +1,18 @@
+"""Tests for reading uploaded images"""
+from io import BytesIO
+
+import pytest
+
+from config import Config
+from image_io import READ_CHUNK_SIZE, ImageInputError, read_image_stream
+
+
+def test_read_image_stream_stops_at_the_size_limit(monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_IMAGE_SIZE', 1024 * 1024)
+    stream = BytesIO(b'\xff' * (8 * 1024 * 1024))
+
+    with pytest.raises(ImageInputError) as error:
+        read_image_stream(stream)
+
+    assert error.value.status_code == 413
+    assert stream.tell() <= 1024 * 1024 + READ_CHUNK_SIZE
@@ -0,0 +1,25 @@
+"""Tests for the ABCDE image analysis"""
+from PIL import Image
+
+from image_processor import ImageProcessor
+
+
+def test_no_lesion_on_uniform_skin():
+    result = ImageProcessor().process_image(Image.new('RGB', (300, 300), (200, 180, 170)))
+
+    assert result['lesion_detected'] is False
+    assert result['lesion_location'] is None
+    assert result['lesion_metrics'] is None
+    assert result['abcde_analysis'] is None
+
+
+def test_detect_lesion_without_contours():
+    processor = ImageProcessor()
+    cv_image, scale = processor._to_analysis_image(Image.new('RGB', (64, 64), (200, 180, 170)))
+
+    assert processor.detect_lesion(cv_image, scale) == {
+        'detected': False,
+        'location': None,
+        'metrics': None,
+        'contour': None
+    }
@@ -0,0 +1,38 @@
+"""Tests for the inference backends"""
+import numpy as np
+import pytest
+from tensorflow import keras
+
+from config import Config
+from export_model import export_tflite
+from model_loader import ModelLoader, create_backend
+
+
+@pytest.mark.parametrize('quantize, precision', [('none', 'float32'), ('dynamic', 'int8_weights')])
+def test_backends_report_the_same_info_keys(model_path, tmp_path, quantize, precision):
+    tflite_path = str(tmp_path / 'model.tflite')
+    export_tflite(keras.models.load_model(model_path), tflite_path, quantize)
+
+    keras_info = create_backend('keras', model_path).get_info()
+    tflite_info = create_backend('tflite', tflite_path).get_info()
+
+    assert tflite_info.keys() == keras_info.keys()
+    assert tflite_info['serving_mode'] == 'interpreter'
+    assert tflite_info['precision'] == precision
+    assert tflite_info['input_shape'] == '(-1, 224, 224, 3)'
+
+
+def test_tflite_runs_from_the_preloaded_model_file(model_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'TFLITE_XNNPACK', False)
+    tflite_path = str(tmp_path / 'model.tflite')
+    export_tflite(keras.models.load_model(model_path), tflite_path, 'none')
+
+    loader = ModelLoader.for_model(tflite_path, 'tflite')
+    assert loader.preload_model_file()
+    loader.load_model()
+
+    img_array = np.random.default_rng(0).uniform(0, 255, (1, 224, 224, 3)).astype(np.float32)
+    expected = create_backend('tflite', tflite_path).run(img_array)
+    np.testing.assert_allclose(loader.run_model(img_array), expected, atol=1e-5)
+    assert loader.get_model_version().startswith('model.tflite-')
+    assert not ModelLoader.for_model(model_path, 'keras').preload_model_file()
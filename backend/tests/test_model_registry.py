@@ -0,0 +1,79 @@
+"""Tests for the model registry: hot-swap, A/B routing and unloading"""
+import time
+
+import pytest
+from PIL import Image
+
+from config import Config
+from model_loader import ModelLoader
+from model_registry import ModelRegistry
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the condition")
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def registry(model_path, monkeypatch):
+    """A registry with a loaded primary model and a batching 'v2' candidate"""
+    monkeypatch.setattr(Config, 'BATCHING_ENABLED', True)
+    primary = ModelLoader.for_model(model_path, 'keras')
+    primary.load_model()
+    registry = ModelRegistry(primary, 'primary')
+
+    def add_candidate(state):
+        state['models']['v2'] = {'path': model_path, 'backend': 'keras'}
+        state['candidate'] = 'v2'
+        state['candidate_percent'] = 100
+    registry.update(add_candidate)
+    wait_until(lambda: registry.get_info()['candidate'] == 'v2')
+    return registry
+
+
+def remove_candidate(state):
+    del state['models']['v2']
+    state['candidate'], state['candidate_percent'] = None, 0
+
+
+def test_removed_model_worker_threads_exit(registry):
+    v2 = registry.route(b'image')
+    registry.record(v2, 0.01)
+    v2.release()
+    workers = [scheduler._worker for scheduler in v2.loader._schedulers.values()]
+    assert workers and all(worker.is_alive() for worker in workers)
+
+    registry.update(remove_candidate)
+
+    assert not any(worker.is_alive() for worker in workers)
+    assert v2.closed
+    assert not v2.loader.is_loaded()
+    assert 'v2' not in registry.get_info()['models']
+
+
+def test_removed_model_is_closed_after_in_flight_requests(registry):
+    v2 = registry.route(b'image')
+    workers = [scheduler._worker for scheduler in v2.loader._schedulers.values()]
+
+    registry.update(remove_candidate)
+
+    # Still serving the request routed to it before the removal, but not new ones
+    assert not v2.acquire()
+    primary = registry.route(b'image')
+    assert primary.name == 'primary'
+    primary.release()
+    assert all(worker.is_alive() for worker in workers)
+    blank = Image.new('RGB', (224, 224), (128, 128, 128))
+    assert v2.loader.predict_batch([v2.loader.preprocess_image(blank)])
+
+    # A background job handed the request's model keeps it open too
+    v2.retain()
+    v2.release()
+    assert not v2.closed
+    v2.release()
+
+    assert not any(worker.is_alive() for worker in workers)
+    assert v2.closed
@@ -0,0 +1,46 @@
+"""Tests for the reduced-precision modes of the keras backend"""
+import shutil
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import Config
+from export_model import calibrate_precisions, write_precision_record
+from model_loader import ModelLoader
+from preprocess_parity import make_synthetic_lesion
+
+
+@pytest.mark.parametrize('precision', ['bfloat16', 'int8'])
+def test_gradcam_works_at_reduced_precision(model_path, tmp_path, monkeypatch, precision):
+    # The model is untrained, so only Grad-CAM is checked, not the tolerances
+    monkeypatch.setattr(Config, 'MODEL_PRECISION', precision)
+    monkeypatch.setattr(Config, 'PRECISION_MAX_PROBABILITY_DELTA', 100.0)
+    monkeypatch.setattr(Config, 'PRECISION_MAX_LABEL_FLIPS', 100)
+    path = str(tmp_path / 'model.h5')
+    shutil.copy(model_path, path)
+
+    images = np.random.default_rng(0).uniform(0, 255, (4, 224, 224, 3)).astype(np.float32)
+    report = calibrate_precisions(path, images, [precision], iterations=1, warmup=0,
+                                  max_probability_delta=100.0, max_label_flips=100)
+    assert report[precision]['gradcam_ok']
+    write_precision_record(path, report, len(images), None, 100.0, 100)
+
+    loader = ModelLoader.for_model(path, 'keras')
+    loader.load_model()
+    assert loader.get_model_info()['precision'] == precision
+
+    heatmap = loader.gradcam_heatmap(Image.open(BytesIO(make_synthetic_lesion(640, 480, seed=0))))
+    assert heatmap.ndim == 2
+    assert np.all(np.isfinite(heatmap))
+    assert heatmap.min() >= 0 and heatmap.max() <= 1
+
+
+def test_int8_reports_the_share_of_quantized_parameters(model_path):
+    images = np.zeros((2, 224, 224, 3), np.float32)
+    report = calibrate_precisions(model_path, images, ['int8'], iterations=1, warmup=0,
+                                  max_probability_delta=100.0, max_label_flips=100)
+
+    # Only the Dense head (17 of 1409 parameters), not the convolutions
+    assert report['int8']['int8_weight_share'] == pytest.approx(17 / 1409, abs=1e-4)
@@ -0,0 +1,42 @@
+"""Accuracy parity of the fast preprocessing path (runs preprocess_parity.py's checks)"""
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import Config
+from model_loader import ModelLoader
+from preprocess_parity import (
+    MAX_MEAN_ABS_DIFF, MAX_P99_ABS_DIFF, MAX_PROBABILITY_DELTA, SYNTHETIC_RESOLUTIONS,
+    make_synthetic_lesion, preprocess
+)
+
+
+@pytest.fixture
+def loader(model_path, monkeypatch):
+    # preprocess() switches FAST_PREPROCESS; restore it after each test
+    monkeypatch.setattr(Config, 'FAST_PREPROCESS', False)
+    monkeypatch.setattr(Config, 'MODEL_NORMALIZATION', 'none')
+    loader = ModelLoader.for_model(model_path, 'keras')
+    loader.load_model()
+    return loader
+
+
+@pytest.mark.parametrize('index, size', list(enumerate(SYNTHETIC_RESOLUTIONS)))
+def test_fast_preprocess_matches_lanczos(loader, index, size):
+    image_bytes = make_synthetic_lesion(*size, seed=index)
+
+    reference, _ = preprocess(loader, image_bytes, fast=False)
+    candidate, _ = preprocess(loader, image_bytes, fast=True)
+
+    diff = np.abs(reference - candidate)
+    assert diff.mean() <= MAX_MEAN_ABS_DIFF
+    assert np.percentile(diff, 99) <= MAX_P99_ABS_DIFF
+
+    probabilities = []
+    for fast in (False, True):
+        Config.FAST_PREPROCESS = fast
+        result = loader.predict(Image.open(BytesIO(image_bytes)))
+        probabilities.append(result['probabilities']['malignant'])
+    assert abs(probabilities[0] - probabilities[1]) <= MAX_PROBABILITY_DELTA
@@ -0,0 +1,88 @@
+"""Tests for the result cache tiers"""
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def test_disk_hit_keeps_its_remaining_lifetime(tmp_path):
+    disk_dir = str(tmp_path / 'cache')
+    ResultCache(ttl_seconds=60, disk_dir=disk_dir).set('key', {'prediction': 'Benign'})
+    written = time.time() - 50
+    os.utime(os.path.join(disk_dir, 'key.json'), (written, written))
+
+    cache = ResultCache(ttl_seconds=60, disk_dir=disk_dir)
+    assert cache.get('key') is not None
+    expires_at, _ = cache._entries['key']
+    assert abs(expires_at - (written + 60)) < 1
+
+
+def test_expired_disk_entry_is_removed(tmp_path):
+    disk_dir = str(tmp_path / 'cache')
+    ResultCache(ttl_seconds=60, disk_dir=disk_dir).set('key', {'prediction': 'Benign'})
+    written = time.time() - 120
+    path = os.path.join(disk_dir, 'key.json')
+    os.utime(path, (written, written))
+
+    cache = ResultCache(ttl_seconds=60, disk_dir=disk_dir)
+    assert cache.get('key') is None
+    assert not os.path.exists(path)
+    assert 'key' not in cache._entries
+
+
+def test_key_depends_on_the_image_and_model_version():
+    key = ResultCache.make_key(b'image', 'model-v1')
+    assert key == ResultCache.make_key(b'image', 'model-v1')
+    assert key != ResultCache.make_key(b'image', 'model-v2')
+    assert key != ResultCache.make_key(b'other image', 'model-v1')
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2)
+    cache.set('a', {'n': 1})
+    cache.set('b', {'n': 2})
+    assert cache.get('a') == '{"n": 1}'
+    cache.set('c', {'n': 3})
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_memory_tier_is_bounded_by_size():
+    cache = ResultCache(max_bytes=100)
+    cache.set('a', {'data': 'x' * 60})
+    cache.set('b', {'data': 'y' * 60})
+    cache.set('huge', {'data': 'z' * 200})
+
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+    assert cache.get('huge') is None
+    assert cache.get_stats()['bytes'] <= 100
+
+
+def test_entries_expire_and_hits_are_counted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    cache = ResultCache(ttl_seconds=60)
+    cache.set('key', {'prediction': 'Benign'})
+
+    assert cache.get('key') is not None
+    now[0] += 61
+    assert cache.get('key') is None
+
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['sets']) == (1, 1, 1)
+    assert stats['hit_rate'] == 0.5
+    assert stats['entries'] == 0
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    disk_dir = str(tmp_path / 'cache')
+    ResultCache(disk_dir=disk_dir).set('key', {'prediction': 'Benign'})
+
+    cache = ResultCache(disk_dir=disk_dir)
+    assert cache.get('key') == '{"prediction": "Benign"}'
+    assert cache.get('key') is not None
+    stats = cache.get_stats()
+    assert (stats['disk_hits'], stats['hits']) == (1, 1)
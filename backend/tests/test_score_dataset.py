@@ -0,0 +1,33 @@
+"""Tests for the offline scoring checkpoint and error rows"""
+from score_dataset import COLUMNS, CsvResultWriter, score_batch
+
+
+class FailingModel:
+    def predict_batch(self, arrays):
+        raise RuntimeError('out of memory')
+
+
+def make_row(path, error=''):
+    row = dict.fromkeys(COLUMNS, '')
+    row.update(id=path, path=path, error=error)
+    return row
+
+
+def test_batch_failure_becomes_error_rows():
+    rows = [make_row('a.jpg'), make_row('b.jpg', error='OSError: truncated')]
+
+    score_batch(FailingModel(), rows, arrays=[object()])
+
+    assert rows[0]['error'] == 'RuntimeError: out of memory'
+    assert rows[1]['error'] == 'OSError: truncated'
+
+
+def test_resume_retries_error_rows(tmp_path):
+    path = str(tmp_path / 'scores.csv')
+    writer = CsvResultWriter(path)
+    scored = make_row('a.jpg')
+    scored.update(prediction='Benign', confidence=90.0)
+    writer.write([scored, make_row('b.jpg', error='RuntimeError: out of memory')])
+    writer.close()
+
+    assert CsvResultWriter(path).done == {'a.jpg'}
@@ -0,0 +1,74 @@
+"""
+TTA Module - Test-time augmentation views of a preprocessed model input
+Builds the flipped, rotated and cropped views as one batch for a single forward pass
+"""
+import cv2
+import numpy as np
+
+# Views in the order they are used: the first n are taken for n views.
+# Flips and rotations first (lesions have no canonical orientation), then crops.
+TTA_VIEW_NAMES = (
+    'identity', 'hflip', 'vflip', 'rot180', 'rot90', 'rot270', 'transpose', 'transverse',
+    'crop_center', 'crop_top_left', 'crop_top_right', 'crop_bottom_left', 'crop_bottom_right'
+)
+
+_GEOMETRIC_VIEWS = {
+    'identity': lambda x: x,
+    'hflip': lambda x: x[:, ::-1],
+    'vflip': lambda x: x[::-1],
+    'rot180': lambda x: x[::-1, ::-1],
+    'rot90': lambda x: np.rot90(x),
+    'rot270': lambda x: np.rot90(x, -1),
+    'transpose': lambda x: x.transpose(1, 0, 2),
+    'transverse': lambda x: x[::-1, ::-1].transpose(1, 0, 2),
+}
+
+
+def _crop_window(zoomed, name, size):
+    """Window of the upscaled image for a named crop"""
+    margin = zoomed.shape[0] - size
+    top, left = {
+        'crop_center': (margin // 2, margin // 2),
+        'crop_top_left': (0, 0),
+        'crop_top_right': (0, margin),
+        'crop_bottom_left': (margin, 0),
+        'crop_bottom_right': (margin, margin),
+    }[name]
+    return zoomed[top:top + size, left:left + size]
+
+
+def build_views(img_array, n_views, crop_scale=0.9):
+    """
+    Build the first n_views TTA views of a preprocessed image as one batch
+
+    Args:
+        img_array: preprocessed array of shape (1, H, W, C), as returned by
+            ModelLoader.preprocess_image (H == W, since views include rotations)
+        n_views: number of views, 1 to len(TTA_VIEW_NAMES)
+        crop_scale: side of the crops relative to the image (rounded so the
+            crops are whole pixels of the upscaled image)
+
+    Returns:
+        tuple (batch array of shape (n_views, H, W, C), list of view names)
+    """
+    if not 1 <= n_views <= len(TTA_VIEW_NAMES):
+        raise ValueError(f"TTA views must be between 1 and {len(TTA_VIEW_NAMES)}")
+
+    image = img_array[0]
+    height, width = image.shape[:2]
+    if height != width:
+        raise ValueError("TTA needs a square model input")
+
+    names = list(TTA_VIEW_NAMES[:n_views])
+    views = [_GEOMETRIC_VIEWS[name](image) for name in names if name in _GEOMETRIC_VIEWS]
+
+    crops = [name for name in names if name not in _GEOMETRIC_VIEWS]
+    if crops:
+        # Crops of the same scale resized back to the input size are windows of
+        # one upscaled copy of the image (a single bilinear resize for all crops)
+        zoomed_size = round(height / crop_scale)
+        zoomed = cv2.resize(image, (zoomed_size, zoomed_size), interpolation=cv2.INTER_LINEAR)
+        views.extend(_crop_window(zoomed, name, height) for name in crops)
+
+    # Flips, rotations and crop windows are strided views: one copy into the batch
+    return np.stack(views).astype(img_array.dtype, copy=False), names
@@ -144,3 +144,15 @@ export const ABCDE_CHARACTERISTICS = {
         varied: 'Variado',
     },
 }
+
+// ============================================
+// MAPA DE CALOR (GRAD-CAM)
+// ============================================
+
+export const HEATMAP_CONFIG = {
+    output: 'grid',                  // 'grid': el backend envía el heatmap crudo y se colorea aquí
+    alpha: 0.4,                      // Opacidad del heatmap sobre la imagen (igual que el backend)
+    maxDimension: 1024,              // Lado mayor de la imagen compuesta (px)
+    mimeType: 'image/jpeg',          // Formato de la imagen compuesta (se guarda en Storage)
+    quality: 0.85,                   // Calidad JPEG de la imagen compuesta
+}
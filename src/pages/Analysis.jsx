@@ -6,12 +6,14 @@ import LoginModal from '../components/LoginModal'
 import { useAuth } from '../context/AuthContext'
 import { useAnalysis } from '../context/AnalysisContext'
 import { saveAnalysis } from '../services/analysisService'
+import { renderHeatmapOverlay } from '../utils/heatmapOverlay'
 import {
   ANALYSIS_CONFIG,
   PREDICTION_TYPES,
   RISK_LEVELS,
   LESION_TYPES,
-  ABCDE_CHARACTERISTICS
+  ABCDE_CHARACTERISTICS,
+  HEATMAP_CONFIG
 } from '../constants'
 
 /**
@@ -60,10 +62,10 @@ const Analysis = () => {
 
       try {
         // Importar dinámicamente el servicio API
-        const { analyzeImage } = await import('../services/apiService')
+        const { analyzeImage, fetchHeatmap } = await import('../services/apiService')
 
-        // Llamar a la API real
-        const apiResult = await analyzeImage(image)
+        // Llamar a la API real (el mapa de calor llega como rejilla y se colorea aquí)
+        const apiResult = await analyzeImage(image, { heatmapOutput: HEATMAP_CONFIG.output })
 
         // Formatear resultados para el componente
         const formattedResult = {
@@ -86,10 +88,28 @@ const Analysis = () => {
         setResult(formattedResult)
         setIsScanning(false)
 
+        // El mapa de calor se genera en segundo plano: mostrarlo cuando esté listo
+        let heatmapData = apiResult
+        if (apiResult.heatmap_status === 'pending' && apiResult.heatmap_url) {
+          heatmapData = await fetchHeatmap(apiResult.heatmap_url)
+        }
+
+        // Rejilla cruda: colorear y superponer sobre la imagen original en el navegador
+        let analysisData = apiResult
+        let processedImage = heatmapData?.processed_image || null
+        if (!processedImage && heatmapData?.heatmap_grid) {
+          processedImage = await renderHeatmapOverlay(image, heatmapData.heatmap_grid)
+        }
+        if (processedImage && processedImage !== formattedResult.processedImage) {
+          // Solo si el usuario no cargó otra imagen mientras tanto
+          setResult(prev => (prev === formattedResult ? { ...prev, processedImage } : prev))
+          analysisData = { ...apiResult, processed_image: processedImage }
+        }
+
         // Guardar análisis en la base de datos
         try {
           const userId = user?.id || null
-          await saveAnalysis(apiResult, image, userId)
+          await saveAnalysis(analysisData, image, userId)
           console.log('✅ Análisis guardado en la base de datos')
         } catch (saveError) {
           console.error('Error guardando análisis:', saveError)
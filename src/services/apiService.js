@@ -7,11 +7,16 @@ const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000';
 /**
  * Analyze an image using the backend API
  * @param {string} imageDataUrl - Base64 encoded image data URL
+ * @param {Object} options - Analysis options
+ * @param {string} [options.heatmapOutput] - 'image' (overlay rendered by the server) or
+ *   'grid' (raw heatmap_grid, composited with renderHeatmapOverlay)
  * @returns {Promise<Object>} Analysis results
  */
-export async function analyzeImage(imageDataUrl) {
+export async function analyzeImage(imageDataUrl, { heatmapOutput } = {}) {
+    const query = heatmapOutput ? `?heatmap_output=${encodeURIComponent(heatmapOutput)}` : '';
+
     try {
-        const response = await fetch(`${API_BASE_URL}/api/analyze`, {
+        const response = await fetch(`${API_BASE_URL}/api/analyze${query}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -40,6 +45,39 @@ export async function analyzeImage(imageDataUrl) {
     }
 }
 
+/**
+ * Wait for the Grad-CAM heatmap of an analysis returned with heatmap_status "pending"
+ * @param {string} heatmapUrl - heatmap_url from the analysis response
+ * @param {number} timeoutMs - Give up after this long
+ * @returns {Promise<Object|null>} {processed_image} or {heatmap_grid} (heatmap_output=grid),
+ *   or null if unavailable
+ */
+export async function fetchHeatmap(heatmapUrl, timeoutMs = 60000) {
+    const deadline = Date.now() + timeoutMs;
+
+    try {
+        while (Date.now() < deadline) {
+            // Long polling: the server holds the request until the heatmap is ready (max 10s)
+            const response = await fetch(`${API_BASE_URL}${heatmapUrl}?wait=10`, {
+                headers: {
+                    'ngrok-skip-browser-warning': 'true'
+                }
+            });
+
+            if (response.status === 202) {
+                continue;
+            }
+
+            const data = await response.json();
+            return response.ok && data.success ? data : null;
+        }
+    } catch (error) {
+        console.error('Failed to get heatmap:', error);
+    }
+
+    return null;
+}
+
 /**
  * Check API health status
  * @returns {Promise<Object>} Health status
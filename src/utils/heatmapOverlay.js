@@ -0,0 +1,96 @@
+import { HEATMAP_CONFIG } from '../constants'
+
+/**
+ * Utilidades para componer el mapa de calor Grad-CAM en el navegador
+ *
+ * El backend (heatmap_output=grid) envía el heatmap crudo a la resolución de la
+ * última capa convolucional, cuantizado a uint8: { shape: [filas, columnas],
+ * dtype: 'uint8', data: base64 }. Aquí se colorea con la paleta JET, se escala
+ * con interpolación bilineal del canvas y se superpone sobre la imagen original.
+ */
+
+/**
+ * Paleta JET (azul → cian → amarillo → rojo), equivalente a cv2.COLORMAP_JET
+ * @param {number} value - Intensidad 0-255
+ * @returns {number[]} Color [r, g, b]
+ */
+const jetColor = (value) => {
+  const x = value / 255
+  const channel = (offset) => Math.round(255 * Math.min(1, Math.max(0, 1.5 - Math.abs(4 * x - offset))))
+  return [channel(3), channel(2), channel(1)]
+}
+
+/**
+ * Decodifica la rejilla del heatmap a un canvas del tamaño de la rejilla
+ * @param {Object} grid - heatmap_grid de la respuesta de la API
+ * @returns {HTMLCanvasElement} Canvas con el heatmap coloreado (1 píxel por celda)
+ */
+const gridToCanvas = (grid) => {
+  const [rows, cols] = grid.shape
+  const bytes = atob(grid.data)
+  if (bytes.length !== rows * cols) {
+    throw new Error('Tamaño de heatmap_grid inválido')
+  }
+
+  const canvas = document.createElement('canvas')
+  canvas.width = cols
+  canvas.height = rows
+  const ctx = canvas.getContext('2d')
+  const pixels = ctx.createImageData(cols, rows)
+
+  for (let i = 0; i < bytes.length; i++) {
+    const [r, g, b] = jetColor(bytes.charCodeAt(i))
+    pixels.data[i * 4] = r
+    pixels.data[i * 4 + 1] = g
+    pixels.data[i * 4 + 2] = b
+    pixels.data[i * 4 + 3] = 255
+  }
+
+  ctx.putImageData(pixels, 0, 0)
+  return canvas
+}
+
+/**
+ * Carga una imagen desde una URL (data URL)
+ * @param {string} src - URL de la imagen
+ * @returns {Promise<HTMLImageElement>} Imagen cargada
+ */
+const loadImage = (src) => new Promise((resolve, reject) => {
+  const img = new Image()
+  img.onload = () => resolve(img)
+  img.onerror = () => reject(new Error('No se pudo cargar la imagen'))
+  img.src = src
+})
+
+/**
+ * Superpone el heatmap Grad-CAM sobre la imagen original
+ * @param {string} imageDataUrl - Data URL de la imagen analizada
+ * @param {Object} grid - heatmap_grid de la respuesta de la API
+ * @returns {Promise<string|null>} Data URL de la imagen compuesta, o null si falla
+ */
+export async function renderHeatmapOverlay(imageDataUrl, grid) {
+  try {
+    const img = await loadImage(imageDataUrl)
+    const scale = Math.min(1, HEATMAP_CONFIG.maxDimension / Math.max(img.width, img.height))
+    const width = Math.max(1, Math.round(img.width * scale))
+    const height = Math.max(1, Math.round(img.height * scale))
+
+    const canvas = document.createElement('canvas')
+    canvas.width = width
+    canvas.height = height
+    const ctx = canvas.getContext('2d')
+    ctx.drawImage(img, 0, 0, width, height)
+
+    // Escalar la rejilla al tamaño de la imagen (suavizado bilineal) y mezclar
+    ctx.imageSmoothingEnabled = true
+    ctx.imageSmoothingQuality = 'high'
+    ctx.globalAlpha = HEATMAP_CONFIG.alpha
+    ctx.drawImage(gridToCanvas(grid), 0, 0, width, height)
+    ctx.globalAlpha = 1
+
+    return canvas.toDataURL(HEATMAP_CONFIG.mimeType, HEATMAP_CONFIG.quality)
+  } catch (error) {
+    console.error('Error componiendo el mapa de calor:', error)
+    return null
+  }
+}